@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""
+Measures contention on the app and request globals.
+
+Compares :class:`webapp2_extras.local.Local` with the previous
+implementation, which acquired a global lock on every access. Each thread
+sets its own request and reads it repeatedly, as handlers do through
+``webapp2.get_request()``.
+
+Usage::
+
+    python benchmarks/local_benchmark.py [threads ...]
+"""
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+from webapp2_extras import local
+
+#: Reads per thread.
+READS = 100000
+
+
+class LockedLocal(object):
+    """The previous :class:`webapp2_extras.local.Local`, for comparison."""
+
+    __slots__ = ('__storage__', '__lock__')
+
+    def __init__(self):
+        object.__setattr__(self, '__storage__', {})
+        object.__setattr__(self, '__lock__', threading.Lock())
+
+    def __call__(self, proxy):
+        return local.LocalProxy(self, proxy)
+
+    def __release_local__(self):
+        self.__storage__.pop(local.get_ident(), None)
+
+    def __getattr__(self, name):
+        self.__lock__.acquire()
+        try:
+            try:
+                return self.__storage__[local.get_ident()][name]
+            except KeyError:
+                raise AttributeError(name)
+        finally:
+            self.__lock__.release()
+
+    def __setattr__(self, name, value):
+        self.__lock__.acquire()
+        try:
+            ident = local.get_ident()
+            storage = self.__storage__
+            if ident in storage:
+                storage[ident][name] = value
+            else:
+                storage[ident] = {name: value}
+        finally:
+            self.__lock__.release()
+
+
+def run(local_class, num_threads):
+    """Returns the time to perform all reads in ``num_threads`` threads."""
+    l = local_class()
+    request = l('request')
+    start_event = threading.Event()
+
+    def worker():
+        l.request = object()
+        start_event.wait()
+        for i in xrange(READS):
+            request._get_current_object()
+
+        l.__release_local__()
+
+    threads = [threading.Thread(target=worker) for i in range(num_threads)]
+    for t in threads:
+        t.start()
+
+    start = time.time()
+    start_event.set()
+    for t in threads:
+        t.join()
+
+    return time.time() - start
+
+
+def main(args):
+    counts = [int(arg) for arg in args] or [1, 4, 16, 32]
+    print '%8s %12s %12s %8s' % ('threads', 'locked (s)', 'local (s)',
+                                 'speedup')
+    for num_threads in counts:
+        locked = run(LockedLocal, num_threads)
+        unlocked = run(local.Local, num_threads)
+        print '%8d %12.3f %12.3f %7.1fx' % (num_threads, locked, unlocked,
+                                            locked / unlocked)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+import gzip
+import StringIO
+import zlib
+
+import webapp2
+
+from webapp2_extras import compression
+
+import test_base
+
+TEXT = 'Lorem ipsum dolor sit amet. ' * 100
+
+
+def gunzip(data):
+    return gzip.GzipFile(fileobj=StringIO.StringIO(data)).read()
+
+
+class TextHandler(webapp2.RequestHandler):
+    def get(self):
+        self.response.etag = 'text'
+        self.response.write(TEXT)
+
+    head = get
+
+
+class ConditionalHandler(TextHandler):
+    etag_mode = 'strong'
+
+
+class SmallHandler(webapp2.RequestHandler):
+    def get(self):
+        self.response.write('small')
+
+
+class ImageHandler(webapp2.RequestHandler):
+    def get(self):
+        self.response.content_type = 'image/png'
+        self.response.write(TEXT)
+
+
+class JSONHandler(webapp2.RequestHandler):
+    def get(self):
+        self.response.content_type = 'application/json; charset=utf-8'
+        self.response.headers['Vary'] = 'Cookie'
+        self.response.write('[%s]' % ', '.join(['"item"'] * 200))
+
+
+class StreamHandler(webapp2.RequestHandler):
+    def get(self):
+        for i in range(10):
+            yield TEXT
+
+
+class EncodedHandler(webapp2.RequestHandler):
+    def get(self):
+        self.response.headers['Content-Encoding'] = 'gzip'
+        self.response.write('already compressed')
+
+
+app = compression.CompressionMiddleware(webapp2.WSGIApplication([
+    ('/text', TextHandler),
+    ('/conditional', ConditionalHandler),
+    ('/small', SmallHandler),
+    ('/image', ImageHandler),
+    ('/json', JSONHandler),
+    ('/stream', StreamHandler),
+    ('/encoded', EncodedHandler),
+]))
+
+
+def get_response(path, accept_encoding='gzip, deflate', **kwargs):
+    req = webapp2.Request.blank(path, **kwargs)
+    if accept_encoding:
+        req.headers['Accept-Encoding'] = accept_encoding
+
+    return req.get_response(app)
+
+
+class TestCompressionMiddleware(test_base.BaseTestCase):
+    def test_gzip(self):
+        rsp = get_response('/text')
+        self.assertEqual(rsp.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(rsp.headers['Vary'], 'Accept-Encoding')
+        self.assertEqual(rsp.content_length, len(rsp.body))
+        self.assertTrue(rsp.content_length < len(TEXT))
+        self.assertEqual(gunzip(rsp.body), TEXT)
+        self.assertEqual(rsp.etag, 'text-gzip')
+
+    def test_not_modified(self):
+        rsp = get_response('/conditional', headers={
+            'If-None-Match': '"text-gzip"'})
+        self.assertEqual(rsp.status_int, 304)
+        self.assertEqual(rsp.etag, 'text-gzip')
+
+        rsp = get_response('/conditional', 'deflate', headers={
+            'If-None-Match': '"text-deflate"'})
+        self.assertEqual(rsp.status_int, 304)
+        self.assertEqual(rsp.etag, 'text-deflate')
+
+        rsp = get_response('/conditional', None, headers={
+            'If-None-Match': '"text"'})
+        self.assertEqual(rsp.status_int, 304)
+        self.assertEqual(rsp.etag, 'text')
+
+        rsp = get_response('/conditional', headers={
+            'If-None-Match': '"other-gzip"'})
+        self.assertEqual(rsp.status_int, 200)
+        self.assertEqual(gunzip(rsp.body), TEXT)
+
+    def test_deflate(self):
+        rsp = get_response('/text', 'gzip;q=0.5, deflate')
+        self.assertEqual(rsp.headers['Content-Encoding'], 'deflate')
+        self.assertEqual(zlib.decompress(rsp.body), TEXT)
+
+    def test_not_accepted(self):
+        for accept in (None, 'identity', 'gzip;q=0'):
+            rsp = get_response('/text', accept)
+            self.assertEqual(rsp.body, TEXT)
+            self.assertFalse('Content-Encoding' in rsp.headers)
+            self.assertEqual(rsp.headers['Vary'], 'Accept-Encoding')
+            self.assertEqual(rsp.etag, 'text')
+
+    def test_thresholds(self):
+        rsp = get_response('/small')
+        self.assertEqual(rsp.body, 'small')
+        self.assertFalse('Content-Encoding' in rsp.headers)
+        self.assertEqual(rsp.headers['Vary'], 'Accept-Encoding')
+
+        rsp = get_response('/image')
+        self.assertEqual(rsp.body, TEXT)
+        self.assertFalse('Content-Encoding' in rsp.headers)
+        self.assertFalse('Vary' in rsp.headers)
+
+        rsp = get_response('/encoded')
+        self.assertEqual(rsp.body, 'already compressed')
+        self.assertEqual(rsp.headers['Content-Encoding'], 'gzip')
+
+        rsp = get_response('/missing')
+        self.assertEqual(rsp.status_int, 404)
+        self.assertFalse('Content-Encoding' in rsp.headers)
+
+        rsp = get_response('/text', environ={'REQUEST_METHOD': 'HEAD'})
+        self.assertEqual(rsp.body, '')
+        self.assertFalse('Content-Encoding' in rsp.headers)
+        self.assertEqual(rsp.headers['Vary'], 'Accept-Encoding')
+
+    def test_list_without_length(self):
+        def raw_app(environ, start_response):
+            start_response('200 OK', [('Content-Type', 'text/plain'),
+                                      ('Accept-Ranges', 'bytes')])
+            return ['x'] * int(environ['PATH_INFO'][1:])
+
+        middleware = compression.CompressionMiddleware(raw_app)
+        req = webapp2.Request.blank('/100')
+        req.headers['Accept-Encoding'] = 'gzip'
+        rsp = req.get_response(middleware)
+        self.assertEqual(rsp.body, 'x' * 100)
+        self.assertFalse('Content-Encoding' in rsp.headers)
+        self.assertEqual(rsp.headers['Accept-Ranges'], 'bytes')
+
+        req = webapp2.Request.blank('/1000')
+        req.headers['Accept-Encoding'] = 'gzip'
+        rsp = req.get_response(middleware)
+        self.assertEqual(rsp.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(gunzip(rsp.body), 'x' * 1000)
+        self.assertFalse('Accept-Ranges' in rsp.headers)
+
+    def test_content_types(self):
+        rsp = get_response('/json')
+        self.assertEqual(rsp.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(rsp.headers['Vary'], 'Cookie, Accept-Encoding')
+
+        middleware = app.__class__(app.app, mime_types=['image/png'])
+        self.assertTrue(middleware.is_compressible('image/png'))
+        self.assertTrue(middleware.is_compressible('text/html'))
+        self.assertTrue(middleware.is_compressible('application/foo+xml'))
+        self.assertFalse(middleware.is_compressible('application/json'))
+
+    def test_stream(self):
+        req = webapp2.Request.blank('/stream')
+        req.headers['Accept-Encoding'] = 'gzip'
+        result = {}
+
+        def start_response(status, headers, exc_info=None):
+            result['headers'] = dict(headers)
+
+        app_iter = app(req.environ, start_response)
+        self.assertFalse('Content-Length' in result['headers'])
+        self.assertEqual(result['headers']['Content-Encoding'], 'gzip')
+        self.assertEqual(result['headers']['Vary'], 'Accept-Encoding')
+
+        # Each chunk is flushed and can be decompressed on arrival.
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        chunks = []
+        for chunk in app_iter:
+            chunks.append(decompressor.decompress(chunk))
+            if len(chunks) == 1:
+                self.assertEqual(chunks[0], TEXT)
+
+        app_iter.close()
+        self.assertEqual(''.join(chunks), TEXT * 10)
+        self.assertEqual(len(chunks), 11)
+
+
+if __name__ == '__main__':
+    test_base.main()
@@ -387,6 +387,14 @@ class I18nTestCase(test_base.BaseTestCase):
         self.assertEqual(len(req.registry), 1)
         self.assertTrue(isinstance(i, i18n.I18n))
 
+    def test_warmup(self):
+        store = i18n.I18nStore(self.app)
+        store.warmup()
+        self.assertEqual(store.translations.keys(), ['en_US'])
+        store.warmup(['pt_BR', 'de_DE'])
+        self.assertEqual(sorted(store.translations.keys()),
+                         ['de_DE', 'en_US', 'pt_BR'])
+
     def test_set_locale_selector(self):
         i18n.get_store().set_locale_selector(
             'resources.i18n.locale_selector')
@@ -1,5 +1,7 @@
 # -*- coding: utf-8 -*-
 import os
+import shutil
+import tempfile
 
 import webapp2
 from webapp2_extras import jinja2
@@ -76,6 +78,65 @@ class TestJinja2(test_base.BaseTestCase):
         hello = j.get_template_attribute('hello.html', 'hello')
         self.assertEqual(hello('World'), 'Hello, World!')
 
+    def test_warmup(self):
+        app = webapp2.WSGIApplication(config={
+            'webapp2_extras.jinja2': {
+                'template_path': template_path,
+                'filters': dict(foo=lambda x: x + '-foofilter'),
+                'environment_args': {
+                    'extensions': ['jinja2.ext.i18n'],
+                },
+            }
+        })
+        j = jinja2.Jinja2(app)
+        j.warmup(['hello.html'])
+        self.assertEqual(len(j.environment.cache), 1)
+        j.warmup()
+        self.assertEqual(len(j.environment.cache), 4)
+
+    def test_warmup_compiled(self):
+        app = webapp2.WSGIApplication(config={
+            'webapp2_extras.jinja2': {
+                'template_path': template_path,
+                'compiled_path': compiled_path,
+                'force_compiled': True,
+            }
+        })
+        j = jinja2.Jinja2(app)
+        # Compiled templates can't be listed.
+        j.warmup()
+        self.assertEqual(len(j.environment.cache), 0)
+
+    def test_warmup_extensions(self):
+        root = tempfile.mkdtemp()
+        try:
+            self._test_warmup_extensions(root)
+        finally:
+            shutil.rmtree(root)
+
+    def _test_warmup_extensions(self, root):
+        for filename, content in [('good.html', 'Hello, {{ name }}!'),
+                                  ('broken.html', '{% if %}'),
+                                  ('image.png', '\x89PNG\xff\xfe')]:
+            f = open(os.path.join(root, filename), 'wb')
+            f.write(content)
+            f.close()
+
+        app = webapp2.WSGIApplication(config={
+            'webapp2_extras.jinja2': {
+                'template_path': root,
+            },
+        })
+        j = jinja2.Jinja2(app)
+        # Files with other extensions are ignored, and templates that fail
+        # to compile are skipped.
+        j.warmup()
+        self.assertEqual(sorted(j.environment.cache.keys()), ['good.html'])
+
+        j = jinja2.Jinja2(app, config={'warmup_extensions': ['txt']})
+        j.warmup()
+        self.assertEqual(sorted(j.environment.cache.keys()), [])
+
     def test_set_jinja2(self):
         app = webapp2.WSGIApplication()
         self.assertEqual(len(app.registry), 0)
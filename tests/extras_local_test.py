@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+import threading
+
+from webapp2_extras import local
+
+import test_base
+
+
+class TestLocal(test_base.BaseTestCase):
+    def test_attributes(self):
+        l = local.Local()
+        self.assertRaises(AttributeError, getattr, l, 'foo')
+        l.foo = 'bar'
+        self.assertEqual(l.foo, 'bar')
+        self.assertEqual(list(l), [(local.get_ident(), {'foo': 'bar'})])
+        del l.foo
+        self.assertRaises(AttributeError, getattr, l, 'foo')
+        self.assertRaises(AttributeError, delattr, l, 'foo')
+
+        l.foo = 'bar'
+        l.__release_local__()
+        self.assertRaises(AttributeError, getattr, l, 'foo')
+
+    def test_threads(self):
+        l = local.Local()
+        l.value = 'main'
+        values = {}
+        errors = []
+
+        def run(i):
+            try:
+                self.assertRaises(AttributeError, getattr, l, 'value')
+                l.value = i
+                for n in range(100):
+                    self.assertEqual(l.value, i)
+
+                values[i] = l.value
+                l.__release_local__()
+            except Exception, e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=run, args=(i,)) for i in range(10)]
+        for t in threads:
+            t.start()
+
+        for t in threads:
+            t.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(values, dict((i, i) for i in range(10)))
+        self.assertEqual(l.value, 'main')
+        self.assertEqual(len(list(l)), 1)
+
+    def test_ident_func(self):
+        context = {'ident': 'a'}
+        l = local.Local(ident_func=lambda: context['ident'])
+        l.value = 1
+        context['ident'] = 'b'
+        self.assertRaises(AttributeError, getattr, l, 'value')
+        l.value = 2
+        context['ident'] = 'a'
+        self.assertEqual(l.value, 1)
+
+        l.__ident_func__ = lambda: 'c'
+        self.assertRaises(AttributeError, getattr, l, 'value')
+        self.assertEqual(sorted(l), [('a', {'value': 1}), ('b', {'value': 2})])
+
+    def test_proxy(self):
+        l = local.Local()
+        proxy = l('request')
+        self.assertFalse(proxy)
+        l.request = {'foo': 'bar'}
+        self.assertEqual(proxy['foo'], 'bar')
+
+
+if __name__ == '__main__':
+    test_base.main()
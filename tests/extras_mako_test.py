@@ -1,5 +1,7 @@
 # -*- coding: utf-8 -*-
 import os
+import shutil
+import tempfile
 
 import webapp2
 from webapp2_extras import mako
@@ -25,6 +27,48 @@ class TestMako(test_base.BaseTestCase):
         res = m.render_template( 'template1.html', message=message)
         self.assertEqual(res, message + '\n')
 
+    def test_warmup(self):
+        app = webapp2.WSGIApplication(config={
+            'webapp2_extras.mako': {
+                'template_path': template_path,
+            },
+        })
+        m = mako.Mako(app)
+        m.warmup()
+        self.assertEqual(m.environment._collection.keys(),
+                         ['template1.html'])
+
+    def test_warmup_extensions(self):
+        root = tempfile.mkdtemp()
+        try:
+            self._test_warmup_extensions(root)
+        finally:
+            shutil.rmtree(root)
+
+    def _test_warmup_extensions(self, root):
+        for filename, content in [('good.html', 'Hello, ${name}!'),
+                                  ('broken.html', '% if:\n'),
+                                  ('image.png', '\x89PNG\xff\xfe')]:
+            f = open(os.path.join(root, filename), 'wb')
+            f.write(content)
+            f.close()
+
+        app = webapp2.WSGIApplication(config={
+            'webapp2_extras.mako': {
+                'template_path': root,
+            },
+        })
+        m = mako.Mako(app)
+        # Files with other extensions are ignored, and templates that fail
+        # to compile are skipped.
+        m.warmup()
+        self.assertEqual(sorted(m.environment._collection.keys()),
+                         ['good.html'])
+
+        m = mako.Mako(app, config={'warmup_extensions': ['txt']})
+        m.warmup()
+        self.assertEqual(sorted(m.environment._collection.keys()), [])
+
     def test_set_mako(self):
         app = webapp2.WSGIApplication()
         self.assertEqual(len(app.registry), 0)
@@ -0,0 +1,372 @@
+# -*- coding: utf-8 -*-
+import threading
+import time
+
+import webapp2
+
+from webapp2_extras.response_cache import (CachePolicy, MemcacheBackend,
+    MemoryBackend, ResponseCache, cache_response)
+
+import test_base
+
+calls = []
+now = time.time
+
+
+class NewsHandler(webapp2.RequestHandler):
+    def get(self, **kwargs):
+        calls.append(self.request.path_qs)
+        self.response.write('news %s %s %s' % (
+            kwargs.get('section'), self.request.GET.get('page'),
+            self.request.headers.get('Accept-Language')))
+
+        if self.request.GET.get('cookie'):
+            self.response.set_cookie('foo', 'bar')
+
+        if self.request.GET.get('vary'):
+            self.response.headers['Vary'] = 'Cookie'
+
+        if self.request.GET.get('error'):
+            self.response.status = 500
+
+    def post(self, **kwargs):
+        calls.append('post')
+        self.response.write('posted')
+
+
+@cache_response(ttl=60)
+class DecoratedHandler(webapp2.RequestHandler):
+    def get(self, *args):
+        calls.append(self.request.path)
+        self.response.write('decorated %s' % self.request.path)
+
+
+class StreamHandler(webapp2.RequestHandler):
+    def get(self):
+        calls.append('stream')
+        yield 'streamed'
+
+
+class FakeMemcache(object):
+    """A stand-in for memcache.Client."""
+
+    def __init__(self):
+        self.values = {}
+
+    def get(self, key):
+        value = self.values.get(key)
+        if value is not None and value[1] > now():
+            return value[0]
+
+    def set(self, key, value, time=0):
+        self.values[key] = (value, now() + time)
+        return True
+
+    def delete(self, key):
+        self.values.pop(key, None)
+
+
+def get_app(backend):
+    policy = CachePolicy(ttl=60, query_args=['page'],
+                         vary=['Accept-Language'])
+    app = webapp2.WSGIApplication([
+        webapp2.Route('/news/<section>', NewsHandler, 'news',
+                      defaults={'_cache': policy}),
+        webapp2.Route('/stream', StreamHandler,
+                      defaults={'_cache': policy}),
+        webapp2.Route('/uncached', NewsHandler),
+        (r'/decorated/(\w+)', DecoratedHandler),
+    ])
+    app.warmup()
+    ResponseCache(backend).install(app.router)
+    return app
+
+
+class TestResponseCache(test_base.BaseTestCase):
+    def setUp(self):
+        super(TestResponseCache, self).setUp()
+        del calls[:]
+
+    def test_cache(self):
+        app = get_app(MemoryBackend())
+        for i in range(2):
+            rsp = app.get_response('/news/sports?page=1&utm=x%d' % i)
+            self.assertEqual(rsp.status_int, 200)
+            self.assertEqual(rsp.body, 'news sports 1 None')
+            self.assertEqual(rsp.content_type, 'text/html')
+
+        self.assertEqual(calls, ['/news/sports?page=1&utm=x0'])
+
+        # Keys include route args, query args and Vary headers.
+        app.get_response('/news/world?page=1')
+        app.get_response('/news/sports?page=2')
+        rsp = app.get_response('/news/sports?page=1',
+                               headers={'Accept-Language': 'pt'})
+        self.assertEqual(rsp.body, 'news sports 1 pt')
+        self.assertEqual(len(calls), 4)
+
+        rsp = app.get_response('/news/sports?page=1',
+                               environ={'REQUEST_METHOD': 'HEAD'})
+        self.assertEqual(rsp.status_int, 200)
+        self.assertEqual(len(calls), 4)
+
+        rsp = app.get_response('/news/sports?page=1', POST={})
+        self.assertEqual(rsp.body, 'posted')
+
+        app.get_response('/uncached')
+        app.get_response('/uncached')
+        self.assertEqual(calls[-3:], ['post', '/uncached', '/uncached'])
+
+    def test_not_cacheable(self):
+        app = get_app(MemoryBackend())
+        for query in ('cookie=1', 'vary=1', 'error=1'):
+            for i in range(2):
+                app.get_response('/news/sports?' + query)
+
+        self.assertEqual(len(calls), 6)
+
+        for i in range(2):
+            self.assertEqual(app.get_response('/stream').body, 'streamed')
+
+        self.assertEqual(calls[-2:], ['stream', 'stream'])
+
+    def test_decorator(self):
+        app = get_app(MemoryBackend())
+        for i in range(2):
+            rsp = app.get_response('/decorated/foo')
+            self.assertEqual(rsp.body, 'decorated /decorated/foo')
+
+        app.get_response('/decorated/bar')
+        self.assertEqual(calls, ['/decorated/foo', '/decorated/bar'])
+        self.assertEqual(DecoratedHandler.cache_policy.ttl, 60)
+
+    def test_handler_not_created_on_hit(self):
+        created = []
+
+        class CountingHandler(NewsHandler):
+            def __init__(self, *args, **kwargs):
+                created.append(True)
+                super(CountingHandler, self).__init__(*args, **kwargs)
+
+        app = webapp2.WSGIApplication([
+            webapp2.Route('/news/<section>', CountingHandler,
+                          defaults={'_cache': CachePolicy()}),
+        ])
+        ResponseCache(MemoryBackend()).install(app.router)
+        app.get_response('/news/sports')
+        app.get_response('/news/sports')
+        self.assertEqual(created, [True])
+
+    def test_get_key(self):
+        received = []
+
+        class KwargsHandler(webapp2.RequestHandler):
+            def get(self, **kwargs):
+                received.append(kwargs)
+
+        class Config(object):
+            pass
+
+        policy = CachePolicy(query_args=['page'])
+        app = webapp2.WSGIApplication([
+            webapp2.Route('/<section>', KwargsHandler, 'section',
+                          defaults={'_cache': policy, 'config': Config()}),
+        ])
+        cache = ResponseCache(MemoryBackend())
+        cache.install(app.router)
+        # The policy is not passed to handlers.
+        app.get_response('/world')
+        self.assertEqual(received, [
+            dict(section='world', config=received[0]['config']),
+        ])
+
+        def get_key(path):
+            request = webapp2.Request.blank(path)
+            rv = app.router.match(request)
+            request.route, request.route_args, request.route_kwargs = rv
+            return cache.get_key(request, policy)
+
+        # Keys don't depend on the repr() of non-string defaults.
+        self.assertEqual(get_key('/sports?utm=1'), get_key('/sports'))
+        self.assertNotEqual(get_key('/sports?page=1'), get_key('/sports'))
+        self.assertNotEqual(get_key('/a%20b'), get_key('/a%2520b'))
+        self.assertNotEqual(get_key(u'/caf\xe9'.encode('utf-8')),
+                            get_key('/cafe'))
+
+    def test_conditional_hit(self):
+        app = get_app(MemoryBackend())
+        rsp = app.get_response('/news/sports')
+        self.assertFalse(rsp.etag)
+
+        class ETagHandler(NewsHandler):
+            etag_mode = 'strong'
+
+        app = webapp2.WSGIApplication([
+            webapp2.Route('/news/<section>', ETagHandler,
+                          defaults={'_cache': CachePolicy()}),
+        ])
+        ResponseCache(MemoryBackend()).install(app.router)
+        etag = app.get_response('/news/sports').headers['ETag']
+        rsp = app.get_response('/news/sports',
+                               headers={'If-None-Match': etag})
+        self.assertEqual(rsp.status_int, 304)
+        self.assertEqual(rsp.body, '')
+
+    def test_memcache_backend(self):
+        client = FakeMemcache()
+        app = get_app(MemcacheBackend(client))
+        app.get_response('/news/sports')
+        rsp = app.get_response('/news/sports')
+        self.assertEqual(rsp.body, 'news sports None None')
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(len(client.values), 1)
+        key = client.values.keys()[0]
+        self.assertTrue(key.startswith(ResponseCache.key_prefix))
+
+        backend = MemcacheBackend(client, max_size=10)
+        backend.set('big', 'x' * 11, 60)
+        self.assertEqual(backend.get('big'), None)
+        backend.set('small', 'x', 60)
+        self.assertEqual(backend.get('small'), 'x')
+        backend.delete('small')
+        self.assertEqual(backend.get('small'), None)
+
+    def test_coalesce(self):
+        entered = threading.Event()
+        release = threading.Event()
+
+        class SlowHandler(webapp2.RequestHandler):
+            def get(self):
+                calls.append(self.request.path)
+                if len(calls) == 1:
+                    entered.set()
+                    release.wait()
+
+                if self.request.path == '/private':
+                    self.response.set_cookie('foo', 'bar')
+
+                self.response.write('slow %d' % len(calls))
+
+        app = webapp2.WSGIApplication([
+            webapp2.Route('/slow', SlowHandler,
+                          defaults={'_cache': CachePolicy()}),
+            webapp2.Route('/private', SlowHandler,
+                          defaults={'_cache': CachePolicy()}),
+        ])
+        cache = ResponseCache(MemoryBackend(), coalesce_timeout=10)
+        cache.install(app.router)
+
+        def run_requests(path):
+            responses = []
+
+            def request():
+                responses.append(app.get_response(path))
+
+            threads = [threading.Thread(target=request) for i in range(10)]
+            threads[0].start()
+            entered.wait()
+            for thread in threads[1:]:
+                thread.start()
+
+            # Let the other requests wait for the first one.
+            time.sleep(0.05)
+            release.set()
+            for thread in threads:
+                thread.join()
+
+            return responses
+
+        responses = run_requests('/slow')
+        self.assertEqual(calls, ['/slow'])
+        self.assertEqual([r.body for r in responses], ['slow 1'] * 10)
+        self.assertEqual(cache.flights, {})
+
+        # Responses that can't be stored are not shared.
+        del calls[:]
+        entered.clear()
+        release.clear()
+        responses = run_requests('/private')
+        self.assertEqual(len(calls), 10)
+        self.assertEqual(cache.flights, {})
+
+    def test_coalesce_timeout(self):
+        release = threading.Event()
+
+        class SlowHandler(webapp2.RequestHandler):
+            def get(self):
+                calls.append(self.request.path)
+                if len(calls) == 1:
+                    release.wait()
+                    raise ValueError()
+
+                self.response.write('slow')
+
+        app = webapp2.WSGIApplication([
+            webapp2.Route('/slow', SlowHandler,
+                          defaults={'_cache': CachePolicy()}),
+        ])
+        cache = ResponseCache(MemoryBackend(), coalesce_timeout=0.01)
+        cache.install(app.router)
+        responses = []
+        thread = threading.Thread(
+            target=lambda: responses.append(app.get_response('/slow')))
+        thread.start()
+        while not calls:
+            time.sleep(0.001)
+
+        # Gives up waiting and runs the handler.
+        self.assertEqual(app.get_response('/slow').body, 'slow')
+        self.assertEqual(len(calls), 2)
+        release.set()
+        thread.join()
+        self.assertEqual(responses[0].status_int, 500)
+        self.assertEqual(cache.flights, {})
+        self.assertEqual(app.get_response('/slow').body, 'slow')
+        self.assertEqual(len(calls), 2)
+
+
+class TestMemoryBackend(test_base.BaseTestCase):
+    def test_lru(self):
+        backend = MemoryBackend(max_entries=2)
+        backend.set('a', '1', 60)
+        backend.set('b', '2', 60)
+        self.assertEqual(backend.get('a'), '1')
+        backend.set('c', '3', 60)
+        self.assertEqual(backend.get('b'), None)
+        self.assertEqual(backend.get('a'), '1')
+        self.assertEqual(backend.get('c'), '3')
+        self.assertEqual(len(backend), 2)
+
+        backend.delete('a')
+        self.assertEqual(backend.get('a'), None)
+        self.assertEqual(len(backend), 1)
+        backend.clear()
+        self.assertEqual(len(backend), 0)
+        self.assertEqual(backend.size, 0)
+
+    def test_max_size(self):
+        backend = MemoryBackend(max_size=10)
+        backend.set('a', 'x' * 4, 60)
+        backend.set('b', 'x' * 4, 60)
+        self.assertEqual(backend.size, 8)
+        backend.set('c', 'x' * 4, 60)
+        self.assertEqual(backend.get('a'), None)
+        self.assertEqual(backend.size, 8)
+        backend.set('b', 'x' * 2, 60)
+        self.assertEqual(backend.size, 6)
+        backend.set('d', 'x' * 11, 60)
+        self.assertEqual(backend.get('d'), None)
+        self.assertEqual(backend.size, 6)
+
+    def test_ttl(self):
+        backend = MemoryBackend()
+        backend.set('a', '1', 60)
+        backend.set('b', '2', 0)
+        self.assertEqual(backend.get('a'), '1')
+        self.assertEqual(backend.get('b'), None)
+        self.assertEqual(len(backend), 1)
+        self.assertEqual(backend.size, 1)
+
+
+if __name__ == '__main__':
+    test_base.main()
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+import os
+import tempfile
+
+import webapp2
+
+from webapp2_extras import route_snapshot
+from webapp2_extras.routes import DomainRoute, PathPrefixRoute, RedirectRoute
+
+import test_base
+
+
+class HomeHandler(webapp2.RequestHandler):
+    def get(self, **kwargs):
+        self.response.out.write('home: %r' % sorted(kwargs.items()))
+
+
+def get_app(extra=None):
+    routes = [
+        webapp2.Route('/', HomeHandler, 'home'),
+        webapp2.Route('/<year:\d{4}>/<month:\d{2}>/<slug>', HomeHandler,
+                      'post'),
+        webapp2.Route('/<:\d+>', 'resources.handlers.LazyHandler'),
+        RedirectRoute('/strict/', HomeHandler, 'strict', strict_slash=True),
+        PathPrefixRoute('/users/<user:\w+>', [
+            webapp2.Route('/', HomeHandler, 'user'),
+        ]),
+        DomainRoute('<subdomain>.localhost', [
+            webapp2.Route('/sub', HomeHandler, 'sub'),
+        ]),
+    ]
+    if extra:
+        routes.append(extra)
+
+    return webapp2.WSGIApplication(routes)
+
+
+class TestRouteSnapshot(test_base.BaseTestCase):
+    def test_apply(self):
+        snapshot = route_snapshot.create(get_app())
+        app = get_app()
+        self.assertTrue(route_snapshot.apply(app, snapshot))
+
+        route = app.router.build_routes['post']
+        self.assertTrue('regex' in route.__dict__)
+        self.assertEqual(route.args_count, 0)
+        self.assertEqual(route.kwargs_count, 3)
+        self.assertEqual(route.reverse_template,
+                         '/%(year)s/%(month)s/%(slug)s')
+        self.assertEqual(route.variables['slug'].pattern, '^[^/]+$')
+
+        rsp = app.get_response('/2011/07/hello')
+        self.assertEqual(rsp.status_int, 200)
+        self.assertEqual(rsp.body, "home: [('month', '07'), "
+                         "('slug', 'hello'), ('year', '2011')]")
+        self.assertEqual(app.get_response('/2011/7/hello').status_int, 404)
+        self.assertEqual(app.get_response('/users/bob/').body,
+                         "home: [('user', 'bob')]")
+        self.assertEqual(app.get_response('/strict').status_int, 301)
+        self.assertEqual(app.get_response('http://foo.localhost/sub').body,
+                         "home: [('subdomain', 'foo')]")
+        req = webapp2.Request.blank('/')
+        self.assertEqual(app.router.build(req, 'post', (),
+            dict(year=2011, month='07', slug='hi')), '/2011/07/hi')
+
+    def test_apply_changed_routes(self):
+        snapshot = route_snapshot.create(get_app())
+        app = get_app(webapp2.Route('/new', HomeHandler))
+        self.assertFalse(route_snapshot.apply(app, snapshot))
+        self.assertFalse('regex' in app.router.build_routes['post'].__dict__)
+        self.assertEqual(app.get_response('/new').status_int, 200)
+
+    def test_apply_changed_version(self):
+        snapshot = route_snapshot.create(get_app())
+        version = route_snapshot.SNAPSHOT_VERSION
+        route_snapshot.SNAPSHOT_VERSION = version + 1
+        try:
+            self.assertFalse(route_snapshot.apply(get_app(), snapshot))
+        finally:
+            route_snapshot.SNAPSHOT_VERSION = version
+
+    def test_apply_invalid(self):
+        self.assertFalse(route_snapshot.apply(get_app(), 'foo'))
+        self.assertFalse(route_snapshot.apply(get_app(), ''))
+
+    def test_save_and_load(self):
+        fd, filename = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            route_snapshot.save(get_app(), filename)
+            app = get_app()
+            self.assertTrue(route_snapshot.load(app, filename))
+            self.assertEqual(app.get_response('/').status_int, 200)
+        finally:
+            os.remove(filename)
+
+        self.assertFalse(route_snapshot.load(get_app(), filename))
+
+
+if __name__ == '__main__':
+    test_base.main()
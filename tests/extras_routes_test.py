@@ -88,6 +88,61 @@ class TestRedirectRoute(test_base.BaseTestCase):
 
         self.assertRaises(ValueError, RedirectRoute, '/strict-bar/', handler=HomeHandler, strict_slash=True)
 
+    def test_strict_slash_single_route(self):
+        route = RedirectRoute('/items/<id:\d+>/', HomeHandler, 'item',
+                              methods=['GET'], strict_slash=True)
+        self.assertEqual(len(list(route.get_match_routes())), 1)
+
+        for matcher in (webapp2.Router.default_matcher,
+                        webapp2.Router.compiled_matcher,
+                        webapp2.Router.prefix_matcher):
+            router = webapp2.Router([route])
+            router.set_matcher(matcher)
+            req = webapp2.Request.blank('/items/1/')
+            match = router.match(req)
+            self.assertTrue(match[0] is route)
+            self.assertEqual(match[2], {'id': '1'})
+
+            req = webapp2.Request.blank('/items/1')
+            match = router.match(req)
+            self.assertTrue(match[0].handler is webapp2.RedirectHandler)
+            self.assertEqual(match[2]['id'], '1')
+
+            # The redirect doesn't depend on the route methods.
+            req = webapp2.Request.blank('/items/1', POST={})
+            self.assertTrue(router.match(req)[0].handler is
+                            webapp2.RedirectHandler)
+            req = webapp2.Request.blank('/items/1/', POST={})
+            self.assertRaises(webapp2.exc.HTTPMethodNotAllowed,
+                              router.match, req)
+
+            req = webapp2.Request.blank('/items/a/')
+            self.assertRaises(webapp2.exc.HTTPNotFound, router.match, req)
+
+    def test_strict_slash_indexed(self):
+        routes = [RedirectRoute('/api/r%d/<id>' % i, HomeHandler, 'r%d' % i,
+                                strict_slash=True) for i in range(200)]
+        # Merged routes are counted one by one, so the compiled matcher
+        # reports all routes before r199.
+        for matcher, attempts in ((webapp2.Router.compiled_matcher, 399),
+                                  (webapp2.Router.prefix_matcher, 1)):
+            router = webapp2.Router(routes)
+            router.set_matcher(matcher)
+            router.set_route_stats(True)
+            match = router.match(webapp2.Request.blank('/api/r199/1'))
+            self.assertTrue(match[0] is routes[199])
+            match = router.match(webapp2.Request.blank('/api/r199/1/'))
+            self.assertTrue(match[0].handler is webapp2.RedirectHandler)
+            self.assertEqual(router.route_stats.snapshot()['r199']['attempts'],
+                             attempts)
+
+        # The 400 routes are merged into a few regexes.
+        self.assertEqual(len(router._get_match_index('compiled', 'GET')[0]),
+                         9)
+
+        route = list(routes[0].get_match_routes())[0]
+        self.assertTrue(repr(route).startswith('<_StrictSlashRoute(<Route('))
+
     def test_build_only(self):
         self.assertRaises(ValueError, RedirectRoute, '/', handler=HomeHandler, build_only=True)
 
@@ -166,6 +221,38 @@ class TestPrefixRoutes(test_base.BaseTestCase):
         self.assertEqual(router.build(webapp2.Request.blank('/'), 'user-projects', match[0], match[1]), path)
 
 
+    def test_prefix_matcher(self):
+        route = PathPrefixRoute('/a', [
+            webapp2.Route('/', 'a', 'name-a'),
+            PathPrefixRoute('/d', [
+                webapp2.Route('/<foo>', 'a/d/foo', methods=['POST']),
+            ]),
+        ])
+        self.assertEqual(len(list(route.get_index_routes())), 2)
+
+        router = webapp2.Router([route])
+        router.set_matcher(webapp2.Router.prefix_matcher)
+        self.assertEqual(router.match(webapp2.Request.blank('/a/'))[0].handler, 'a')
+
+        req = webapp2.Request.blank('/a/d/bar')
+        self.assertRaises(webapp2.exc.HTTPMethodNotAllowed, router.match, req)
+        req.method = 'POST'
+        self.assertEqual(router.match(req)[1:], ((), {'foo': 'bar'}))
+
+    def test_prefix_matcher_not_indexed(self):
+        # Nested routes that don't start with prefix + '/' are only matched
+        # after the prefix regex.
+        route = PathPrefixRoute('/u/<user:[^/]+>', [
+            webapp2.Route('-edit/<foo>', 'edit'),
+        ])
+        self.assertEqual(list(route.get_index_routes()), [route])
+
+        router = webapp2.Router([route])
+        router.set_matcher(webapp2.Router.prefix_matcher)
+        match = router.match(webapp2.Request.blank('/u/calvin-edit/bar'))
+        self.assertEqual(match[1:], ((), {'user': 'calvin', 'foo': 'bar'}))
+
+
 class TestDomainRoute(test_base.BaseTestCase):
     def test_simple(self):
         router = webapp2.Router([
@@ -221,6 +308,58 @@ class TestDomainRoute(test_base.BaseTestCase):
         match[1]['_netloc'] = 'my-subdomain.app-id.appspot.com'
         self.assertEqual(router.build(webapp2.Request.blank('/'), 'user-projects', match[0], match[1]), path)
 
+    def test_host_index(self):
+        class CustomDomainRoute(DomainRoute):
+            def match(self, request):
+                return DomainRoute.match(self, request)
+
+        routes = [
+            DomainRoute('a.example.com', [
+                webapp2.Route('/', 'A', 'a'),
+                webapp2.Route('/post', 'APost', methods=['POST']),
+            ]),
+            DomainRoute('<sub>.example.com', [
+                webapp2.Route('/', 'Wildcard', 'wildcard'),
+            ]),
+            DomainRoute('b.example.com', [
+                webapp2.Route('/', 'B', 'b'),
+                webapp2.Route('/b', 'B2', 'b2'),
+            ]),
+            CustomDomainRoute('c.example.org', [
+                webapp2.Route('/', 'C', 'c'),
+            ]),
+            webapp2.Route('/post', 'Post'),
+        ]
+        self.assertEqual(routes[0].get_literal_host(), 'a.example.com')
+        self.assertEqual(routes[1].get_literal_host(), None)
+        self.assertEqual(routes[3].get_literal_host(), None)
+
+        router = webapp2.Router(routes)
+        group = router._get_match_index('default', 'GET')[0][0]
+        self.assertTrue(isinstance(group, webapp2._HostGroup))
+        self.assertEqual(sorted(group.hosts.keys()),
+                         ['a.example.com', 'b.example.com'])
+
+        for matcher in (webapp2.Router.default_matcher,
+                        webapp2.Router.compiled_matcher,
+                        webapp2.Router.prefix_matcher):
+            router.set_matcher(matcher)
+
+            def match(uri, **kwargs):
+                req = webapp2.Request.blank(uri, **kwargs)
+                return router.match(req)[0].handler
+
+            self.assertEqual(match('http://a.example.com/'), 'A')
+            self.assertEqual(match('http://b.example.com/'), 'Wildcard')
+            self.assertEqual(match('http://b.example.com/b'), 'B2')
+            self.assertEqual(match('http://c.example.com/'), 'Wildcard')
+            self.assertEqual(match('http://c.example.org/'), 'C')
+            self.assertEqual(match('http://a.example.com/post',
+                                   POST={'foo': 'bar'}), 'APost')
+            self.assertEqual(match('http://a.example.com/post'), 'Post')
+            self.assertRaises(webapp2.exc.HTTPNotFound, router.match,
+                webapp2.Request.blank('http://c.example.org/b'))
+
     def test_guide_examples(self):
         router = webapp2.Router([
             DomainRoute(r'www.mydomain.com', [
@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+from wsgiref.util import FileWrapper
+
+import webapp2
+
+from webapp2_extras import static
+
+import test_base
+
+
+class TestStaticFileHandler(test_base.BaseTestCase):
+    def setUp(self):
+        super(TestStaticFileHandler, self).setUp()
+        self.root = tempfile.mkdtemp()
+        self.data = ''.join(chr(i % 256) for i in range(1000))
+        f = open(os.path.join(self.root, 'file.pdf'), 'wb')
+        f.write(self.data)
+        f.close()
+        os.mkdir(os.path.join(self.root, 'dir'))
+        self.app = webapp2.WSGIApplication([
+            webapp2.Route('/static/<path:.+>', static.StaticFileHandler,
+                          defaults={'_root': self.root}),
+            webapp2.Route('/cached/<path:.+>', static.StaticFileHandler,
+                          defaults={'_root': self.root, '_max_age': 60}),
+        ])
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+        static._stat_cache.clear()
+        super(TestStaticFileHandler, self).tearDown()
+
+    def test_get(self):
+        rsp = self.app.get_response('/static/file.pdf')
+        self.assertEqual(rsp.status_int, 200)
+        self.assertEqual(rsp.body, self.data)
+        self.assertEqual(rsp.content_type, 'application/pdf')
+        self.assertEqual(rsp.content_length, 1000)
+        self.assertEqual(rsp.headers['Accept-Ranges'], 'bytes')
+        self.assertEqual(rsp.headers['Cache-Control'], 'no-cache')
+        self.assertTrue(rsp.etag)
+        self.assertTrue(rsp.last_modified)
+
+        rsp = self.app.get_response('/cached/file.pdf')
+        self.assertEqual(rsp.headers['Cache-Control'], 'public, max-age=60')
+        self.assertTrue(rsp.expires)
+
+        rsp = self.app.get_response('/static/file.pdf',
+                                    environ={'REQUEST_METHOD': 'HEAD'})
+        self.assertEqual(rsp.status_int, 200)
+        self.assertEqual(rsp.body, '')
+
+    def test_not_found(self):
+        for path in ('/static/missing', '/static/dir', '/static/../file.pdf',
+                     '/static/%2e%2e/%2e%2e/etc/passwd'):
+            self.assertEqual(self.app.get_response(path).status_int, 404)
+
+    def test_conditional(self):
+        rsp = self.app.get_response('/static/file.pdf')
+        rsp = self.app.get_response('/static/file.pdf', headers={
+            'If-None-Match': '"%s"' % rsp.etag})
+        self.assertEqual(rsp.status_int, 304)
+        self.assertEqual(rsp.body, '')
+
+        rsp = self.app.get_response('/static/file.pdf', headers={
+            'If-None-Match': '"other"'})
+        self.assertEqual(rsp.status_int, 200)
+
+    def test_range(self):
+        rsp = self.app.get_response('/static/file.pdf', headers={
+            'Range': 'bytes=100-199'})
+        self.assertEqual(rsp.status_int, 206)
+        self.assertEqual(rsp.body, self.data[100:200])
+        self.assertEqual(rsp.headers['Content-Range'], 'bytes 100-199/1000')
+
+        rsp = self.app.get_response('/static/file.pdf', headers={
+            'Range': 'bytes=-10'})
+        self.assertEqual(rsp.body, self.data[-10:])
+
+        rsp = self.app.get_response('/static/file.pdf', headers={
+            'Range': 'bytes=2000-'})
+        self.assertEqual(rsp.status_int, 416)
+
+    def test_file_wrapper(self):
+        environ = webapp2.Request.blank('/static/file.pdf').environ
+        environ['wsgi.file_wrapper'] = FileWrapper
+        app_iter = self.app(environ, lambda status, headers: None)
+        self.assertTrue(isinstance(app_iter, FileWrapper))
+        self.assertEqual(''.join(app_iter), self.data)
+        app_iter.close()
+
+    def test_gzip_sibling(self):
+        f = open(os.path.join(self.root, 'file.pdf.gz'), 'wb')
+        f.write('compressed')
+        f.close()
+
+        rsp = self.app.get_response('/static/file.pdf', headers={
+            'Accept-Encoding': 'deflate, gzip'})
+        self.assertEqual(rsp.body, 'compressed')
+        self.assertEqual(rsp.content_type, 'application/pdf')
+        self.assertEqual(rsp.content_length, 10)
+        self.assertEqual(rsp.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(rsp.headers['Vary'], 'Accept-Encoding')
+        etag = rsp.etag
+
+        for accept in (None, 'deflate', 'gzip;q=0'):
+            headers = {}
+            if accept:
+                headers['Accept-Encoding'] = accept
+
+            rsp = self.app.get_response('/static/file.pdf', headers=headers)
+            self.assertEqual(rsp.body, self.data)
+            self.assertFalse('Content-Encoding' in rsp.headers)
+            self.assertEqual(rsp.headers['Vary'], 'Accept-Encoding')
+            self.assertNotEqual(rsp.etag, etag)
+
+    def test_file_iter(self):
+        f = open(os.path.join(self.root, 'file.pdf'), 'rb')
+        app_iter = static.FileIter(f, block_size=300)
+        self.assertEqual([len(c) for c in app_iter], [300, 300, 300, 100])
+        app_iter = app_iter.app_iter_range(250, 650)
+        self.assertEqual([len(c) for c in app_iter], [300, 100])
+        self.assertEqual(''.join(app_iter), self.data[250:650])
+        app_iter.close()
+        self.assertTrue(f.closed)
+
+    def test_stat_cache(self):
+        filename = os.path.join(self.root, 'file.pdf')
+        st = static._get_stat(filename, 60)
+        self.assertEqual(st.st_size, 1000)
+        os.remove(filename)
+        self.assertTrue(static._get_stat(filename, 60) is st)
+        static._stat_cache[filename] = (0, st)
+        self.assertEqual(static._get_stat(filename, 60), None)
+
+        # Missing files are cached too.
+        f = open(filename, 'wb')
+        f.write('x')
+        f.close()
+        self.assertEqual(static._get_stat(filename, 60), None)
+        static._stat_cache[filename] = (0, None)
+        self.assertEqual(static._get_stat(filename, 60).st_size, 1)
+        self.assertEqual(static._get_stat(self.root, 60), None)
+        self.assertEqual(static._stat_cache[self.root][1], None)
+
+        size = static._max_stat_cache_size
+        static._max_stat_cache_size = 3
+        try:
+            for i in range(5):
+                static._get_stat(os.path.join(self.root, str(i)), 60)
+                self.assertTrue(len(static._stat_cache) <= 3)
+        finally:
+            static._max_stat_cache_size = size
+
+
+if __name__ == '__main__':
+    test_base.main()
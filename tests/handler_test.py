@@ -2,9 +2,13 @@
 """
 Tests for webapp2 webapp2.RequestHandler
 """
+import datetime
+import hashlib
 import os
 import StringIO
 import sys
+import threading
+import time
 import urllib
 
 import webapp2
@@ -181,6 +185,61 @@ class TestHandler(test_base.BaseTestCase):
         self.assertEqual(rsp.status_int, 405)
         self.assertEqual(rsp.headers.get('Allow'), 'GET, POST')
 
+    def test_dispatch_table(self):
+        class ParentHandler(webapp2.RequestHandler):
+            def get(self):
+                self.response.write('parent get')
+
+        class ChildHandler(ParentHandler):
+            def post(self):
+                self.response.write('child post')
+
+        class NoGetHandler(ChildHandler):
+            get = None
+
+        class InstanceHandler(ParentHandler):
+            def initialize(self, request, response):
+                super(InstanceHandler, self).initialize(request, response)
+                self.put = lambda: self.response.write('instance put')
+
+        app = webapp2.WSGIApplication([
+            webapp2.Route('/parent', ParentHandler),
+            webapp2.Route('/child', ChildHandler),
+            webapp2.Route('/noget', NoGetHandler),
+            webapp2.Route('/instance', InstanceHandler),
+        ])
+        self.assertEqual(app.get_response('/parent').body, 'parent get')
+        rsp = app.get_response('/parent', POST={})
+        self.assertEqual(rsp.status_int, 405)
+        self.assertEqual(rsp.headers['Allow'], 'GET')
+
+        self.assertEqual(app.get_response('/child').body, 'parent get')
+        self.assertEqual(app.get_response('/child', POST={}).body,
+                         'child post')
+        rsp = app.get_response('/noget')
+        self.assertEqual(rsp.status_int, 405)
+        self.assertEqual(rsp.headers['Allow'], 'POST')
+        rsp = app.get_response('/instance', method='PUT')
+        self.assertEqual(rsp.body, 'instance put')
+        rsp = app.get_response('/instance', POST={})
+        self.assertEqual(rsp.status_int, 405)
+        self.assertEqual(sorted(rsp.headers['Allow'].split(', ')),
+                         ['GET', 'PUT'])
+
+        # Each class has its own table.
+        self.assertTrue(ParentHandler._dispatch_tables[0] is ParentHandler)
+        self.assertTrue(ChildHandler._dispatch_tables[0] is ChildHandler)
+        self.assertEqual(app.get_response('/parent', POST={}).status_int,
+                         405)
+
+        # Allowed methods can be a list.
+        app.allowed_methods = ['GET', 'POST']
+        self.assertEqual(app.get_response('/child', POST={}).body,
+                         'child post')
+        rsp = app.get_response('/noget')
+        self.assertEqual(rsp.status_int, 405)
+        self.assertEqual(rsp.headers['Allow'], 'POST')
+
     def test_500(self):
         req = webapp2.Request.blank('/broken')
         rsp = req.get_response(app)
@@ -430,6 +489,25 @@ The resource was found at http://localhost/somewhere; you should be redirected a
             self.assertEqual(func('route-test', _scheme='https', _full=False, year='2010', month='07', name='test'), 'https://localhost:80/2010/07/test')
             self.assertEqual(func('route-test', _scheme='https', _fragment='my-anchor', year='2010', month='07', name='test'), 'https://localhost:80/2010/07/test#my-anchor')
 
+    def test_uri_for_many(self):
+        req = webapp2.Request.blank('http://localhost:80/')
+        req.app = app
+        app.set_globals(app=app, request=req)
+        handler = webapp2.RequestHandler(req, webapp2.Response())
+        handler.app = app
+
+        items = [dict(name='a'), dict(name='b', foo='bar')]
+        self.assertEqual(handler.uri_for_many('route-test', items,
+            year='2010', month='07'), [
+            '/2010/07/a',
+            '/2010/07/b?foo=bar',
+        ])
+        self.assertEqual(handler.uri_for_many('route-test', items,
+            _scheme='https', year='2010', month='07'), [
+            'https://localhost:80/2010/07/a',
+            'https://localhost:80/2010/07/b?foo=bar',
+        ])
+
     def test_extra_request_methods(self):
         allowed_methods_backup = app.allowed_methods
         webdav_methods = ('VERSION-CONTROL', 'UNLOCK', 'PROPFIND')
@@ -613,6 +691,438 @@ The resource was found at http://localhost/somewhere; you should be redirected a
 
         self.assertRaises(ValueError, webapp2.Route, '/', handler='resources.handlers.CustomMethodHandler:custom_method', handler_method='custom_method')
 
+    def test_warmup(self):
+        class Registered(object):
+            calls = 0
+            def warmup(self):
+                self.calls += 1
+
+        routes = [
+            webapp2.Route('/lazy', 'resources.handlers.LazyHandler'),
+            webapp2.Route('/<name>', 'resources.handlers.LazyHandler',
+                          'name', build_only=True),
+            webapp2.Route('/_ah/warmup', webapp2.WarmupHandler),
+        ]
+        app = webapp2.WSGIApplication(routes)
+        app.registry['registered'] = registered = Registered()
+        app.registry['other'] = object()
+
+        timings = app.warmup()
+        self.assertEqual(sorted(timings.keys()),
+                         ['handlers', 'registered', 'routes'])
+        self.assertEqual(registered.calls, 1)
+        self.assertTrue('regex' in routes[0].__dict__)
+        self.assertTrue('_builder' in routes[1].__dict__)
+        self.assertNotEqual(routes[0].handler_adapter, None)
+        self.assertEqual(routes[1].handler_adapter, None)
+        self.assertTrue('resources.handlers.LazyHandler' in app.router.handlers)
+        self.assertTrue(webapp2.WarmupHandler._dispatch_tables[0] is
+                        webapp2.WarmupHandler)
+
+        self.assertEqual(sorted(app.warmup(registry=False).keys()),
+                         ['handlers', 'routes'])
+        self.assertEqual(registered.calls, 1)
+
+        rsp = app.get_response('/_ah/warmup')
+        self.assertEqual(rsp.status_int, 200)
+        self.assertEqual(rsp.content_type, 'text/plain')
+        self.assertEqual([line.split(':')[0] for line in
+                          rsp.body.splitlines()],
+                         ['handlers', 'registered', 'routes'])
+        self.assertEqual(registered.calls, 2)
+
+    def test_request_context_executor(self):
+        class Future(object):
+            def __init__(self, fn, args, kwargs):
+                self.thread = threading.Thread(target=self.run,
+                                               args=(fn, args, kwargs))
+                self.thread.start()
+
+            def run(self, fn, args, kwargs):
+                self.value = fn(*args, **kwargs)
+                self.request = webapp2._get_globals()[1]
+
+            def result(self):
+                self.thread.join()
+                return self.value
+
+        class ThreadExecutor(object):
+            shutdown_calls = 0
+
+            def submit(self, fn, *args, **kwargs):
+                return Future(fn, args, kwargs)
+
+            def map(self, fn, *iterables):
+                futures = [Future(fn, args, {}) for args in zip(*iterables)]
+                return [f.result() for f in futures]
+
+            def shutdown(self, wait=True):
+                self.shutdown_calls += 1
+
+        executor = ThreadExecutor()
+        pool = webapp2.RequestContextExecutor(executor)
+        futures = []
+
+        def get_path(suffix=''):
+            return webapp2.get_request().path + suffix
+
+        class ParallelHandler(webapp2.RequestHandler):
+            def get(self):
+                futures.append(pool.submit(get_path, suffix='!'))
+                self.response.write(', '.join(pool.map(get_path, 'ab')))
+                self.response.write(', ' + futures[0].result())
+
+        app = webapp2.WSGIApplication([('/parallel', ParallelHandler)])
+        rsp = app.get_response('/parallel')
+        self.assertEqual(rsp.body, '/parallela, /parallelb, /parallel!')
+        # Worker globals are cleared after the task.
+        self.assertEqual(futures[0].request, None)
+
+        # Tasks submitted without an active app are not wrapped.
+        app.set_globals(app=app)
+        self.assertTrue(pool.wrap(get_path) is not get_path)
+        app.clear_globals()
+        self.assertTrue(pool.wrap(get_path) is get_path)
+
+        with pool:
+            pass
+        self.assertEqual(executor.shutdown_calls, 1)
+
+    def test_stream(self):
+        closed = []
+
+        class StreamHandler(webapp2.RequestHandler):
+            def get(self):
+                self.response.content_type = 'text/csv'
+                try:
+                    for i in range(3):
+                        yield u'%s,%d\n' % (webapp2.get_request().path, i)
+                finally:
+                    closed.append(True)
+
+        class StreamErrorHandler(webapp2.RequestHandler):
+            def get(self):
+                self.abort(403)
+                yield 'never'
+
+            def post(self):
+                def chunks():
+                    yield 'first'
+                    raise ValueError()
+
+                self.response.stream(chunks())
+
+        def stream_view(request, *args, **kwargs):
+            return (str(i) for i in range(3))
+
+        app = webapp2.WSGIApplication([
+            ('/stream', StreamHandler),
+            ('/error', StreamErrorHandler),
+            ('/view', stream_view),
+        ])
+        rsp = app.get_response('/stream')
+        self.assertEqual(rsp.status_int, 200)
+        self.assertEqual(rsp.body, '/stream,0\n/stream,1\n/stream,2\n')
+        self.assertEqual(rsp.content_type, 'text/csv')
+        self.assertEqual(closed, [True])
+        self.assertEqual(app.get_response('/view').body, '012')
+        self.assertEqual(app.get_response('/error').status_int, 403)
+
+        # Headers are sent before the remaining chunks are read.
+        environ = webapp2.Request.blank('/stream').environ
+        started = []
+        def start_response(status, headers, exc_info=None):
+            started.append(status)
+
+        app_iter = app(environ, start_response)
+        self.assertEqual(started, ['200 OK'])
+        self.assertEqual(len(closed), 1)
+        self.assertEqual(webapp2._get_globals(), (None, None))
+        self.assertEqual(list(app_iter), ['/stream,0\n', '/stream,1\n',
+                                          '/stream,2\n'])
+        self.assertEqual(webapp2._get_globals(), (None, None))
+        app_iter.close()
+        self.assertEqual(len(closed), 2)
+
+        # Errors after the first chunk go to the WSGI server.
+        environ = webapp2.Request.blank('/error', POST={}).environ
+        app_iter = app(environ, start_response)
+        self.assertEqual(app_iter.next(), 'first')
+        self.assertRaises(ValueError, app_iter.next)
+
+    def test_etag(self):
+        class PageHandler(webapp2.RequestHandler):
+            etag_mode = 'strong'
+
+            def get(self, page):
+                if page == 'missing':
+                    self.abort(404)
+
+                self.response.last_modified = datetime.datetime(2011, 8, 1)
+                self.response.write('page %s' % page)
+
+            def post(self, page):
+                self.response.write('posted')
+
+        class WeakHandler(PageHandler):
+            etag_mode = 'weak'
+
+        rendered = []
+
+        class VersionHandler(webapp2.RequestHandler):
+            etag_mode = 'strong'
+
+            def get_etag_key(self, page):
+                return 'version 1'
+
+            def get(self, page):
+                rendered.append(page)
+                self.response.write('page %s' % page)
+
+        app = webapp2.WSGIApplication([
+            ('/page/(\w+)', PageHandler),
+            ('/weak/(\w+)', WeakHandler),
+            ('/version/(\w+)', VersionHandler),
+        ])
+        rsp = app.get_response('/page/1')
+        self.assertEqual(rsp.status_int, 200)
+        self.assertEqual(rsp.body, 'page 1')
+        etag = rsp.headers['ETag']
+        self.assertEqual(etag, '"%s"' % hashlib.md5('page 1').hexdigest())
+
+        rsp = app.get_response('/page/1', headers={'If-None-Match': etag})
+        self.assertEqual(rsp.status_int, 304)
+        self.assertEqual(rsp.body, '')
+        self.assertEqual(rsp.headers['ETag'], etag)
+        self.assertFalse('Content-Type' in rsp.headers)
+
+        rsp = app.get_response('/page/2', headers={'If-None-Match': etag})
+        self.assertEqual(rsp.status_int, 200)
+        self.assertEqual(rsp.body, 'page 2')
+
+        rsp = app.get_response('/page/2', headers={'If-None-Match': '*'})
+        self.assertEqual(rsp.status_int, 304)
+        rsp = app.get_response('/page/missing', headers={
+            'If-None-Match': '*'})
+        self.assertEqual(rsp.status_int, 404)
+
+        rsp = app.get_response('/page/1', headers={
+            'If-Modified-Since': 'Mon, 01 Aug 2011 00:00:00 GMT'})
+        self.assertEqual(rsp.status_int, 304)
+        rsp = app.get_response('/page/1', headers={
+            'If-Modified-Since': 'Sun, 31 Jul 2011 00:00:00 GMT'})
+        self.assertEqual(rsp.status_int, 200)
+
+        rsp = app.get_response('/page/1', POST={}, headers={
+            'If-None-Match': etag})
+        self.assertEqual(rsp.status_int, 200)
+        self.assertFalse('ETag' in rsp.headers)
+        rsp = app.get_response('/page/missing', headers={
+            'If-None-Match': etag})
+        self.assertEqual(rsp.status_int, 404)
+
+        rsp = app.get_response('/weak/1')
+        self.assertEqual(rsp.headers['ETag'], 'W/' + etag)
+        rsp = app.get_response('/weak/1', headers={
+            'If-None-Match': 'W/' + etag})
+        self.assertEqual(rsp.status_int, 304)
+
+        rsp = app.get_response('/version/1')
+        self.assertEqual(rsp.body, 'page 1')
+        etag = rsp.headers['ETag']
+        self.assertEqual(etag, '"%s"' % hashlib.md5('version 1').hexdigest())
+        rsp = app.get_response('/version/2', headers={'If-None-Match': etag})
+        self.assertEqual(rsp.status_int, 304)
+        self.assertEqual(rendered, ['1'])
+
+        class FileHandler(webapp2.RequestHandler):
+            etag_mode = 'strong'
+
+            def get(self):
+                self.response.app_iter = iter(['file ', 'data'])
+
+        app = webapp2.WSGIApplication([('/file', FileHandler)])
+        rsp = app.get_response('/file')
+        # Iterator bodies are not read to compute an ETag.
+        self.assertFalse('ETag' in rsp.headers)
+        self.assertEqual(rsp.body, 'file data')
+
+    def test_admission_control(self):
+        entered = threading.Event()
+        release = threading.Event()
+
+        class SlowHandler(webapp2.RequestHandler):
+            def get(self):
+                entered.set()
+                release.wait()
+                self.response.write('slow')
+
+        class FastHandler(webapp2.RequestHandler):
+            def get(self):
+                self.response.write('fast')
+
+        def handle_503(request, response, exception):
+            response.set_status(503)
+            response.write('busy')
+
+        app = webapp2.WSGIApplication([
+            webapp2.Route('/slow', SlowHandler, 'slow'),
+            webapp2.Route('/fast', FastHandler, 'fast'),
+        ])
+        responses = []
+
+        def start(path, count=1):
+            entered.clear()
+            release.clear()
+            threads = []
+            for i in range(count):
+                thread = threading.Thread(
+                    target=lambda: responses.append(app.get_response(path)))
+                thread.start()
+                threads.append(thread)
+                if i == 0:
+                    entered.wait()
+
+            return threads
+
+        def finish(threads):
+            release.set()
+            for thread in threads:
+                thread.join()
+
+        # Global limit, no queue.
+        app.set_admission_control(max_active=1)
+        threads = start('/slow')
+        self.assertEqual(app.admission_control.snapshot(), {
+            'active': 1, 'queued': 0, 'rejected': 0, 'routes': {}})
+        rsp = app.get_response('/fast')
+        self.assertEqual(rsp.status_int, 503)
+        self.assertEqual(rsp.headers['Retry-After'], '1')
+        self.assertEqual(app.admission_control.rejected, 1)
+        finish(threads)
+        self.assertEqual(responses.pop().body, 'slow')
+        self.assertEqual(app.get_response('/fast').status_int, 200)
+        self.assertEqual(app.admission_control.snapshot()['active'], 0)
+
+        # A bounded queue.
+        app.set_admission_control(max_active=1, max_queue=1,
+                                  max_queue_time=10, retry_after=5)
+        threads = start('/slow', 2)
+        while app.admission_control.snapshot()['queued'] < 1:
+            time.sleep(0.001)
+
+        rsp = app.get_response('/fast')
+        self.assertEqual(rsp.status_int, 503)
+        self.assertEqual(rsp.headers['Retry-After'], '5')
+        finish(threads)
+        self.assertEqual([r.body for r in responses], ['slow', 'slow'])
+        del responses[:]
+
+        # Maximum queue time.
+        app.set_admission_control(max_active=1, max_queue=1,
+                                  max_queue_time=0.01)
+        threads = start('/slow')
+        self.assertEqual(app.get_response('/fast').status_int, 503)
+        finish(threads)
+
+        # Route limits and error handlers.
+        app.set_admission_control(route_limits={'slow': 1})
+        app.error_handlers[503] = handle_503
+        threads = start('/slow')
+        self.assertEqual(app.admission_control.snapshot(), {
+            'rejected': 0, 'routes': {'slow': {'active': 1, 'queued': 0}}})
+        self.assertEqual(app.get_response('/fast').body, 'fast')
+        rsp = app.get_response('/slow')
+        self.assertEqual(rsp.status_int, 503)
+        self.assertEqual(rsp.body, 'busy')
+        self.assertEqual(rsp.headers['Retry-After'], '1')
+        finish(threads)
+        self.assertEqual(app.admission_control.snapshot()['routes'],
+                         {'slow': {'active': 0, 'queued': 0}})
+
+        app.set_admission_control()
+        self.assertEqual(app.admission_control, None)
+
+    def test_admission_control_stream(self):
+        class StreamHandler(webapp2.RequestHandler):
+            def get(self):
+                yield 'a'
+                yield 'b'
+
+        def stream(request, *args, **kwargs):
+            yield 'c'
+
+        app = webapp2.WSGIApplication([
+            webapp2.Route('/stream', StreamHandler, 'stream'),
+            webapp2.Route('/function', stream, 'function'),
+        ])
+        app.set_admission_control(max_active=2,
+                                  route_limits={'stream': 1, 'function': 1})
+        admission = app.admission_control
+
+        def start_response(status, headers, exc_info=None):
+            pass
+
+        for path, body in (('/stream', 'ab'), ('/function', 'c')):
+            environ = webapp2.Request.blank(path).environ
+            app_iter = app(environ, start_response)
+            # The slots are kept while the body is being sent.
+            self.assertEqual(admission.snapshot()['active'], 1)
+            self.assertEqual(admission.snapshot()['routes'][path[1:]],
+                             {'active': 1, 'queued': 0})
+            self.assertEqual(''.join(app_iter), body)
+            app_iter.close()
+            self.assertEqual(admission.snapshot()['active'], 0)
+            self.assertEqual(admission.snapshot()['routes'][path[1:]],
+                             {'active': 0, 'queued': 0})
+            app_iter.close()
+            self.assertEqual(admission.snapshot()['active'], 0)
+
+        # Slots are released when nothing is streamed.
+        rsp = app.get_response('/stream', POST={})
+        self.assertEqual(rsp.status_int, 405)
+        self.assertEqual(admission.snapshot()['active'], 0)
+
+    def test_concurrent_handler_loading(self):
+        calls = {'import': 0, 'adapt': 0}
+
+        def import_string(import_name, silent=False):
+            calls['import'] += 1
+            time.sleep(0.01)
+            return original_import_string(import_name, silent=silent)
+
+        def adapter(router, handler):
+            calls['adapt'] += 1
+            time.sleep(0.01)
+            return webapp2.Router.default_adapter(router, handler)
+
+        app = webapp2.WSGIApplication([
+            webapp2.Route('/lazy', 'resources.handlers.LazyHandler'),
+        ])
+        app.router.set_adapter(adapter)
+        start = threading.Event()
+        responses = []
+
+        def request():
+            start.wait()
+            responses.append(app.get_response('/lazy'))
+
+        original_import_string = webapp2.import_string
+        webapp2.import_string = import_string
+        try:
+            threads = [threading.Thread(target=request) for i in range(20)]
+            for thread in threads:
+                thread.start()
+
+            start.set()
+            for thread in threads:
+                thread.join()
+        finally:
+            webapp2.import_string = original_import_string
+
+        self.assertEqual(calls, {'import': 1, 'adapt': 1})
+        self.assertEqual([r.status_int for r in responses], [200] * 20)
+
     def test_factory_1(self):
         app.debug = True
         rsp = app.get_response('/bare')
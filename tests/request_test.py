@@ -152,6 +152,16 @@ class TestRequest(test_base.BaseTestCase):
         res = req.get_range('1', min_value=1, max_value=99, default=100)
         self.assertEqual(res, 99)
 
+    def test_match_path(self):
+        req = webapp2.Request.blank('/foo%20bar/%C3%A7')
+        self.assertEqual(req.match_path, '/foo bar/\xc3\xa7')
+        self.assertTrue(req.match_path is req.match_path)
+
+        req.path_info = '/baz'
+        self.assertEqual(req.match_path, '/baz')
+        req.script_name = '/app'
+        self.assertEqual(req.match_path, '/app/baz')
+
     def test_issue_3426(self):
         """When the content-type is 'application/x-www-form-urlencoded' and
         POST data is empty the content-type is dropped by Google appengine.
@@ -68,6 +68,36 @@ class TestResponse(test_base.BaseTestCase):
         self.assertEqual(rsp.body, u'foo')
         self.assertEqual(rsp.charset, 'utf-8')
 
+    def test_write_buffer(self):
+        rsp = webapp2.Response(body='start ')
+        for i in range(100):
+            rsp.write('%d ' % i)
+
+        rsp.write(u'\xe7')
+        body = 'start ' + ''.join('%d ' % i for i in range(100)) + '\xc3\xa7'
+        self.assertEqual(rsp.content_length, len(body))
+        self.assertEqual(rsp.body, body)
+        rsp.write('!')
+        self.assertEqual(rsp.body, body + '!')
+        self.assertEqual(rsp.headers['Content-Length'], str(len(body) + 1))
+
+        rsp.clear()
+        rsp.write('foo')
+        rsp.body_file.write('bar')
+        rsp.write('baz')
+        self.assertEqual(rsp.content_length, 9)
+        self.assertEqual(str(rsp.copy()).split('\n')[-1], 'foobarbaz')
+
+        # The chunks are sent without joining them.
+        rsp = webapp2.Response()
+        rsp.write('foo')
+        rsp.write('bar')
+        headers = []
+        app_iter = rsp({'REQUEST_METHOD': 'GET'},
+                       lambda status, h: headers.extend(h))
+        self.assertEqual(app_iter, ['foo', 'bar'])
+        self.assertTrue(('Content-Length', '6') in headers)
+
     def test_status(self):
         rsp = webapp2.Response()
 
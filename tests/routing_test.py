@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 import random
+import threading
 
 import webapp2
 from webapp2 import BaseRoute, RedirectHandler, Request, Route, Router
@@ -131,6 +132,71 @@ class TestRoute(test_base.BaseTestCase):
         url = route.build(Request.blank('/'), ('08', 'i-should-be-ignored', 'me-too'), dict(year='2010', foo='bar', baz='ding'))
         self.assertEqual(url, '/2010/08?baz=ding&foo=bar')
 
+    def test_build_fast_path(self):
+        route = Route(r'/users/<name>/<id:\d+>', None)
+        req = Request.blank('/')
+        self.assertEqual(route.build(req, (), dict(name=7, id=10L)),
+                         '/users/7/10')
+        self.assertEqual(route.build(req, (), dict(name=u'\xe9 x', id='12')),
+                         '/users/%C3%A9%20x/12')
+        # Negative and boolean values are still checked against the regex.
+        self.assertRaises(ValueError, route.build, req, (),
+                          dict(name='a', id=-1))
+        self.assertRaises(ValueError, route.build, req, (),
+                          dict(name='a', id=True))
+        self.assertRaises(ValueError, route.build, req, (),
+                          dict(name='a/b', id=1))
+
+    def test_build_quoted_literals(self):
+        route = Route(u'/caf\xe9 menu/<item>.html', None)
+        url = route.build(Request.blank('/'), (), dict(item='tea & cake'))
+        self.assertEqual(url, '/caf%C3%A9%20menu/tea%20%26%20cake.html')
+
+    def test_build_does_not_change_query(self):
+        route = Route(r'/<year:\d{4}>', None)
+        kwargs = dict(year=2010, foo='bar')
+        url = route.build(Request.blank('/'), (), kwargs)
+        self.assertEqual(url, '/2010?foo=bar')
+        url = route.build(Request.blank('/'), (), kwargs)
+        self.assertEqual(url, '/2010?foo=bar')
+
+    def test_build_many(self):
+        router = Router([Route(r'/docs/<id:\d+>', None, name='doc')])
+        req = Request.blank('http://localhost:8080/')
+        items = [dict(id=1), dict(id='2', page=3), dict(id=3, _full=True)]
+        self.assertEqual(router.build_many(req, 'doc', items), [
+            '/docs/1',
+            '/docs/2?page=3',
+            'http://localhost:8080/docs/3',
+        ])
+        self.assertEqual(router.build_many(req, 'doc', items[:2],
+                                           dict(_full=True, _fragment='top')), [
+            'http://localhost:8080/docs/1#top',
+            'http://localhost:8080/docs/2?page=3#top',
+        ])
+        self.assertEqual(router.build_many(req, 'doc', [{}], dict(id=5)),
+                         ['/docs/5'])
+        self.assertEqual(router.build_many(req, 'doc', []), [])
+        self.assertRaises(ValueError, router.build_many, req, 'doc',
+                          [dict(id='x')])
+        self.assertRaises(KeyError, router.build_many, req, 'foo', [])
+
+    def test_build_many_overridden(self):
+        class LowerRoute(Route):
+            def _build(self, args, kwargs):
+                path, query = super(LowerRoute, self)._build(args, kwargs)
+                return path.lower(), query
+
+        router = Router([LowerRoute(r'/Docs/<id>', None, name='doc')])
+        req = Request.blank('http://localhost:8080/')
+        items = [dict(id='A'), dict(id='B', _fragment='top')]
+        self.assertEqual(router.build_many(req, 'doc', items, dict(_full=1)), [
+            'http://localhost:8080/docs/a',
+            'http://localhost:8080/docs/b#top',
+        ])
+        self.assertEqual(router.build_many(req, 'doc', items),
+                         [router.build(req, 'doc', (), item) for item in items])
+
     def test_build_int_keyword(self):
         route = Route(r'/<year:\d{4}>', None)
         url = route.build(Request.blank('/'), (), dict(year=2010))
@@ -272,6 +338,77 @@ class TestRoute(test_base.BaseTestCase):
         req.method = 'PUT'
         self.assertRaises(webapp2.exc.HTTPMethodNotAllowed, router.match, req)
 
+    def test_methods_index(self):
+        class CountingRoute(Route):
+            calls = 0
+            def match(self, request):
+                CountingRoute.calls += 1
+                return super(CountingRoute, self).match(request)
+
+        routes = [
+            Route(r'/items/<id>', 'get', methods=['GET']),
+            Route(r'/items/<id>', 'post', methods=['POST']),
+            Route(r'/items/<id>', 'put', methods=['PUT'], schemes=['https']),
+            CountingRoute(r'/other', 'other', methods=['PUT']),
+        ]
+        for matcher in (Router.default_matcher, Router.compiled_matcher,
+                        Router.prefix_matcher):
+            router = Router(routes)
+            router.set_matcher(matcher)
+            req = Request.blank('/items/1')
+            req.method = 'POST'
+            self.assertEqual(router.match(req)[0].handler, 'post')
+            req.method = 'DELETE'
+            self.assertRaises(webapp2.exc.HTTPMethodNotAllowed, router.match, req)
+            req.method = 'PUT'
+            self.assertRaises(webapp2.exc.HTTPMethodNotAllowed, router.match, req)
+            req = Request.blank('https://mydomain.com/items/1')
+            req.method = 'PUT'
+            self.assertEqual(router.match(req)[0].handler, 'put')
+            req = Request.blank('/items')
+            self.assertRaises(webapp2.exc.HTTPNotFound, router.match, req)
+
+            # Subclasses that override match() are still called.
+            calls = CountingRoute.calls
+            req = Request.blank('/other')
+            self.assertRaises(webapp2.exc.HTTPMethodNotAllowed, router.match, req)
+            self.assertEqual(CountingRoute.calls, calls + 1)
+
+            router.add(Route(r'/items/<id>', 'delete', methods=['DELETE']))
+            req = Request.blank('/items/1')
+            req.method = 'DELETE'
+            self.assertEqual(router.match(req)[0].handler, 'delete')
+
+    def test_match_path(self):
+        class LegacyRoute(object):
+            def get_match_routes(self):
+                yield self
+
+            def get_build_routes(self):
+                return []
+
+            def match(self, request):
+                if request.path == '/legacy':
+                    return self, (), {}
+
+        class PathRoute(BaseRoute):
+            def match_path(self, request, path, method, scheme, host):
+                if path == '/a b' and host == 'localhost':
+                    return self, (), {'method': method}
+
+        legacy = LegacyRoute()
+        for matcher in (Router.default_matcher, Router.compiled_matcher,
+                        Router.prefix_matcher):
+            router = Router([Route('/', 'home'), legacy,
+                             PathRoute('/a b', 'path')])
+            router.set_matcher(matcher)
+            req = Request.blank('/legacy')
+            self.assertTrue(router.match(req)[0] is legacy)
+            req = Request.blank('/a%20b')
+            self.assertEqual(router.match(req)[2], {'method': 'GET'})
+            req = Request.blank('/a%20c')
+            self.assertRaises(webapp2.exc.HTTPNotFound, router.match, req)
+
     def test_schemes(self):
         route = Route(r'/', schemes=['http'])
         req = Request.blank('http://mydomain.com/')
@@ -286,6 +423,303 @@ class TestRoute(test_base.BaseTestCase):
         self.assertTrue(route.match(req) is None)
 
 
+class TestCompiledMatcher(test_base.BaseTestCase):
+    def get_router(self, routes):
+        router = Router(routes)
+        router.set_matcher(Router.compiled_matcher)
+        return router
+
+    def test_first_match_wins(self):
+        route_1 = Route(r'/<year:\d{4}>', 'year')
+        route_2 = Route(r'/<name>', 'name')
+        route_3 = Route(r'/<:\d+>/<slug>', 'slug', defaults={'foo': 'bar'})
+        router = self.get_router([route_1, route_2, route_3])
+
+        self.assertEqual(router.match(Request.blank('/2010')),
+                         (route_1, (), {'year': '2010'}))
+        self.assertEqual(router.match(Request.blank('/foo')),
+                         (route_2, (), {'name': 'foo'}))
+        self.assertEqual(router.match(Request.blank('/12/baz')),
+                         (route_3, ('12',), {'slug': 'baz', 'foo': 'bar'}))
+        self.assertRaises(webapp2.exc.HTTPNotFound, router.match,
+                          Request.blank('/foo/bar/baz'))
+
+    def test_methods_and_schemes(self):
+        route_1 = Route(r'/', 'secure', schemes=['https'])
+        route_2 = Route(r'/', 'post', methods=['POST'])
+        route_3 = Route(r'/', 'put', methods=['PUT'])
+        router = self.get_router([route_1, route_2, route_3])
+
+        req = Request.blank('https://mydomain.com/')
+        self.assertEqual(router.match(req)[0], route_1)
+        req = Request.blank('http://mydomain.com/')
+        req.method = 'POST'
+        self.assertEqual(router.match(req)[0], route_2)
+        req.method = 'PUT'
+        self.assertEqual(router.match(req)[0], route_3)
+        req.method = 'GET'
+        self.assertRaises(webapp2.exc.HTTPMethodNotAllowed, router.match, req)
+
+    def test_mixed_routes(self):
+        router = self.get_router([
+            Route(r'/a/<foo>', 'a'),
+            (r'/b/(\d+)', 'b'),
+            Route(r'/c/<foo>', 'c'),
+            Route(r'/d/<foo>', 'd'),
+        ])
+        self.assertEqual(router.match(Request.blank('/b/42'))[1:],
+                         (('42',), {}))
+        self.assertEqual(router.match(Request.blank('/d/bar'))[0].handler,
+                         'd')
+
+        router.add(Route(r'/e/<foo>', 'e'))
+        self.assertEqual(router.match(Request.blank('/e/bar'))[0].handler,
+                         'e')
+
+    def test_many_routes(self):
+        routes = [Route('/%d/<:\d+>/<foo>' % i, str(i)) for i in range(200)]
+        routes.append(Route('/<:\d+>' * 98, 'positions'))
+        router = self.get_router(routes)
+
+        for i in (0, 99, 199):
+            self.assertEqual(router.match(Request.blank('/%d/1/bar' % i)),
+                             (routes[i], ('1',), {'foo': 'bar'}))
+
+        args = tuple(str(i) for i in range(98))
+        req = Request.blank('/' + '/'.join(args))
+        self.assertEqual(router.match(req), (routes[-1], args, {}))
+
+
+class TestPrefixMatcher(test_base.BaseTestCase):
+    def get_router(self, routes):
+        router = Router(routes)
+        router.set_matcher(Router.prefix_matcher)
+        return router
+
+    def test_first_match_wins(self):
+        route_1 = Route(r'/<name>/foo', 'any')
+        route_2 = Route(r'/api/v2/<name>', 'name')
+        route_3 = Route(r'/api/v2/docs', 'docs')
+        route_4 = Route(r'/api/v2/docs/<id:\d+>', 'doc', defaults={'a': 'b'})
+        route_5 = Route(r'/api/v1', 'v1')
+        router = self.get_router([route_1, route_2, route_3, route_4, route_5])
+
+        self.assertEqual(router.match(Request.blank('/api/foo')),
+                         (route_1, (), {'name': 'api'}))
+        self.assertEqual(router.match(Request.blank('/api/v2/docs')),
+                         (route_2, (), {'name': 'docs'}))
+        self.assertEqual(router.match(Request.blank('/api/v2/docs/1')),
+                         (route_4, (), {'id': '1', 'a': 'b'}))
+        self.assertEqual(router.match(Request.blank('/api/v1'))[0], route_5)
+        self.assertRaises(webapp2.exc.HTTPNotFound, router.match,
+                          Request.blank('/api/v'))
+        self.assertRaises(webapp2.exc.HTTPNotFound, router.match,
+                          Request.blank('/api/v3/docs/1'))
+
+    def test_not_indexed_routes(self):
+        route_1 = Route(r'/docs/<id:\d+>', 'doc', methods=['POST'])
+        route_2 = webapp2.SimpleRoute(r'/docs/(\w+)', 'simple')
+        route_3 = Route(r'/docs/1', 'one')
+        router = self.get_router([route_1, route_2, route_3])
+
+        self.assertEqual(router.match(Request.blank('/docs/1')),
+                         (route_2, ('1',), {}))
+        req = Request.blank('/docs/1')
+        req.method = 'POST'
+        self.assertEqual(router.match(req), (route_1, (), {'id': '1'}))
+
+    def test_add(self):
+        router = self.get_router([Route(r'/foo', 'foo')])
+        self.assertRaises(webapp2.exc.HTTPNotFound, router.match,
+                          Request.blank('/foobar'))
+        router.add(Route(r'/foobar', 'foobar'))
+        self.assertEqual(router.match(Request.blank('/foobar'))[0].handler,
+                         'foobar')
+
+
+class TestMatchCache(test_base.BaseTestCase):
+    def test_lru(self):
+        cache = webapp2.MatchCache(2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        cache.set('c', 3)
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('c'), 3)
+        self.assertEqual(len(cache), 2)
+        self.assertEqual((cache.hits, cache.misses), (3, 1))
+
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+        self.assertEqual((cache.hits, cache.misses), (0, 0))
+
+    def test_dispatch(self):
+        def handler(request, *args, **kwargs):
+            kwargs['changed'] = True
+            return webapp2.Response(request.route.name)
+
+        class UncacheableRoute(Route):
+            match_cacheable = False
+
+        app = webapp2.WSGIApplication([
+            Route(r'/<name>', handler, 'name', defaults={'foo': 'bar'}),
+            UncacheableRoute(r'/a/<name>', handler, 'uncacheable'),
+        ])
+        app.router.set_match_cache(100)
+        cache = app.router.match_cache
+
+        for i in range(3):
+            rsp = app.get_response('/foo')
+            self.assertEqual(rsp.body, 'name')
+
+        self.assertEqual((cache.hits, cache.misses), (2, 1))
+        route, args, kwargs = cache.get(('/foo', 'GET', 'http', 'localhost'))
+        self.assertEqual(kwargs, {'name': 'foo', 'foo': 'bar'})
+
+        rsp = app.get_response('/foo', POST={'a': 'b'})
+        self.assertEqual(rsp.body, 'name')
+        self.assertEqual(len(cache), 2)
+
+        for i in range(2):
+            rsp = app.get_response('/a/foo')
+            self.assertEqual(rsp.body, 'uncacheable')
+
+        self.assertEqual(len(cache), 2)
+
+        rsp = app.get_response('/foo/bar')
+        self.assertEqual(rsp.status_int, 404)
+        self.assertEqual(len(cache), 2)
+
+        app.router.add(Route(r'/b', handler, 'b'))
+        self.assertEqual(len(cache), 0)
+
+        app.router.set_match_cache(None)
+        self.assertEqual(app.router.match_cache, None)
+
+    def test_match_cache_uncacheable_before(self):
+        def handler(request, *args, **kwargs):
+            return webapp2.Response(request.route.name)
+
+        class HeaderRoute(Route):
+            match_cacheable = False
+
+            def match(self, request):
+                if request.headers.get('Accept') == 'application/json':
+                    return super(HeaderRoute, self).match(request)
+
+        app = webapp2.WSGIApplication([
+            Route(r'/home', handler, 'home'),
+            HeaderRoute(r'/<name>', handler, 'api'),
+            Route(r'/<name>', handler, 'plain'),
+        ])
+        app.router.set_match_cache(100)
+        cache = app.router.match_cache
+
+        # The route before the uncacheable one is still cached.
+        app.get_response('/home')
+        self.assertEqual(len(cache), 1)
+
+        # Routes after it are not, so it is always tried.
+        for i in range(2):
+            rsp = app.get_response('/foo')
+            self.assertEqual(rsp.body, 'plain')
+            rsp = app.get_response('/foo',
+                                   headers={'Accept': 'application/json'})
+            self.assertEqual(rsp.body, 'api')
+
+        self.assertEqual(len(cache), 1)
+
+
+class TestRouteStats(test_base.BaseTestCase):
+    def test_dispatch(self):
+        def handler(request, *args, **kwargs):
+            if kwargs.get('name') == 'error':
+                raise ValueError()
+
+            return webapp2.Response('ok')
+
+        app = webapp2.WSGIApplication([
+            Route(r'/', handler, 'home'),
+            Route(r'/users', handler),
+            Route(r'/users/<name>', handler, 'user'),
+        ])
+        self.assertEqual(app.get_route_stats(), {})
+        app.router.set_route_stats(True)
+
+        app.get_response('/')
+        app.get_response('/users')
+        app.get_response('/users/foo')
+        app.get_response('/users/bar')
+        app.get_response('/nothing')
+        rsp = app.get_response('/users/error')
+        self.assertEqual(rsp.status_int, 500)
+
+        stats = app.get_route_stats()
+        self.assertEqual(sorted(stats.keys()), ['/users', 'home', 'user'])
+        self.assertEqual(stats['home']['matches'], 1)
+        self.assertEqual(stats['home']['attempts'], 1)
+        self.assertEqual(stats['/users']['attempts'], 2)
+        user = stats['user']
+        self.assertEqual(user['matches'], 3)
+        self.assertEqual(user['attempts'], 9)
+        self.assertEqual(user['dispatches'], 3)
+        self.assertEqual(user['errors'], 1)
+        self.assertTrue(user['max_time'] <= user['total_time'])
+
+        # Cached matches don't try any regex.
+        app.router.set_match_cache(10)
+        app.get_response('/users/foo')
+        app.get_response('/users/foo')
+        self.assertEqual(app.get_route_stats(clear=True)['user']['attempts'],
+                         12)
+        self.assertEqual(app.get_route_stats(), {})
+
+        app.router.set_route_stats(False)
+        app.get_response('/')
+        self.assertEqual(app.get_route_stats(), {})
+
+    def test_threads(self):
+        route = Route(r'/', None, 'home')
+        stats = webapp2.RouteStats()
+
+        def record():
+            for i in range(100):
+                stats.add_match(route, 2)
+                stats.add_dispatch(route, 0.5, i % 2 == 0)
+
+        threads = [threading.Thread(target=record) for i in range(5)]
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(stats.snapshot(), {'home': {
+            'matches': 500, 'attempts': 1000, 'dispatches': 500,
+            'errors': 250, 'total_time': 250.0, 'max_time': 0.5}})
+
+    def test_finished_threads(self):
+        route = Route(r'/', None, 'home')
+        stats = webapp2.RouteStats()
+
+        def record():
+            stats.add_match(route, 1)
+
+        for i in range(50):
+            thread = threading.Thread(target=record)
+            thread.start()
+            thread.join()
+
+        # Counters of finished threads are merged, but not lost.
+        self.assertTrue(len(stats.shards) < 5)
+        self.assertEqual(stats.snapshot()['home']['matches'], 50)
+        stats.add_match(route, 1)
+        self.assertEqual(stats.snapshot()['home']['matches'], 51)
+        stats.clear()
+        self.assertEqual(stats.snapshot(), {})
+
+
 class TestSimpleRoute(test_base.BaseTestCase):
     def test_no_variable(self):
         router = webapp2.Router([(r'/', 'my_handler')])
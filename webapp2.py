@@ -11,19 +11,28 @@
 from __future__ import with_statement
 
 import cgi
+import hashlib
 import inspect
 import logging
 import os
 import re
 import sys
 import threading
+import time
+import types
 import urllib
 import urlparse
+import weakref
 from wsgiref import handlers
 
 import webob
 from webob import exc
 
+try: # pragma: no cover
+    from thread import get_ident as _get_thread_ident
+except ImportError: # pragma: no cover
+    from dummy_thread import get_ident as _get_thread_ident
+
 _webapp = _webapp_util = _local = None
 
 try: # pragma: no cover
@@ -72,6 +81,30 @@ _route_re = re.compile(r"""
     \>               # The exact character ">"
     """, re.VERBOSE)
 
+#: Regex for named groups in a route regex, renamed when routes are merged.
+_route_group_re = re.compile(r'(?<!\\)(\(\?P[<=])')
+
+#: Regex for constructs that prevent a route regex from being merged:
+#: inline flags affect the whole pattern and numbered back references
+#: change meaning when groups are added before them.
+_route_unmergeable_re = re.compile(r'\(\?[iLmsux]+\)|\\[1-9]')
+
+#: Regex for variables in a reverse template.
+_reverse_template_re = re.compile(r'%\(([a-zA-Z_]\w*)\)s')
+
+#: Variable regexes that always match a non-negative integer, and how
+#: :meth:`Route._build` checks string values for them.
+_route_variable_kinds = {
+    '^[^/]+$': 'segment',
+    '^\\d+$': 'digits',
+}
+
+#: Keywords with special meaning when building URIs.
+_special_build_keys = frozenset(['_full', '_scheme', '_netloc', '_fragment'])
+
+#: Maximum number of capturing groups supported in a single regex.
+_max_regex_groups = 99
+
 # Set same default messages from webapp plus missing ones.
 _webapp_status_reasons = {
     203: 'Non-Authoritative Information',
@@ -112,6 +145,8 @@ class Request(webob.Request):
     request_body_tempfile_limit = 0
     uri = property(lambda self: self.url)
     query = property(lambda self: self.query_string)
+    # Cached tuple (script_name, path_info, match_path).
+    _match_path = None
 
     def __init__(self, environ, *args, **kwargs):
         """Constructs a Request object from a WSGI environment.
@@ -126,6 +161,25 @@ class Request(webob.Request):
                                       *args, **kwargs)
         self.registry = {}
 
+    @property
+    def match_path(self):
+        """The unquoted request path, used to match routes.
+
+        This is the same as ``urllib.unquote(request.path)``, but it is
+        computed only once while ``SCRIPT_NAME`` and ``PATH_INFO`` don't
+        change.
+        """
+        environ = self.environ
+        script_name = environ.get('SCRIPT_NAME')
+        path_info = environ.get('PATH_INFO')
+        cache = self._match_path
+        if (cache is None or cache[0] is not script_name or
+            cache[1] is not path_info):
+            cache = self._match_path = (script_name, path_info,
+                                        urllib.unquote(self.path))
+
+        return cache[2]
+
     def get(self, argument_name, default_value='', allow_multiple=False):
         """Returns the query or POST argument with the given name.
 
@@ -334,19 +388,80 @@ class Response(webob.Response):
         """Constructs a response with the default settings."""
         super(Response, self).__init__(*args, **kwargs)
         self.out = self
-        self.headers['Cache-Control'] = 'no-cache'
+        if 'Cache-Control' not in self.headers:
+            # Keep the header of responses built from a header list, e.g.,
+            # by Request.get_response().
+            self.headers['Cache-Control'] = 'no-cache'
 
     def write(self, text):
-        """Appends a text to the response body."""
+        """Appends a text to the response body.
+
+        Written chunks are encoded and kept in a list, which is joined only
+        if the body is read, and sent as is to the WSGI server. The
+        ``Content-Length`` header is updated when the body, the content
+        length or the body iterator are read, or the response is sent.
+        """
         # webapp uses StringIO as Response.out, so we need to convert anything
         # that is not str or unicode to string to keep same behavior.
         if not isinstance(text, basestring):
             text = unicode(text)
 
-        if isinstance(text, unicode) and not self.charset:
-            self.charset = self.default_charset
+        if isinstance(text, unicode):
+            if not self.charset:
+                self.charset = self.default_charset
+
+            text = text.encode(self.charset)
+
+        buf = self._app_iter
+        if buf.__class__ is not _BodyBuffer:
+            body = self.body
+            buf = _BodyBuffer()
+            if body:
+                buf.append(body)
+                buf.length = len(body)
+                buf.counted = 1
+
+            self._app_iter = buf
+            self._body = None
+
+        buf.append(text)
+        buf.length += len(text)
+        buf.counted += 1
+
+    def _update_content_length(self):
+        """Sets the ``Content-Length`` header for the written body."""
+        buf = self._app_iter
+        if buf.__class__ is _BodyBuffer:
+            webob.Response.content_length.fset(self, buf.get_length())
+
+    def _get_body(self):
+        self._update_content_length()
+        return webob.Response.body.fget(self)
+
+    body = property(_get_body, webob.Response.body.fset,
+                    webob.Response.body.fdel, doc=webob.Response.body.__doc__)
 
-        super(Response, self).write(text)
+    def _get_app_iter(self):
+        self._update_content_length()
+        return webob.Response.app_iter.fget(self)
+
+    app_iter = property(_get_app_iter, webob.Response.app_iter.fset,
+                        webob.Response.app_iter.fdel,
+                        doc=webob.Response.app_iter.__doc__)
+
+    def _get_content_length(self):
+        self._update_content_length()
+        return webob.Response.content_length.fget(self)
+
+    content_length = property(_get_content_length,
+                              webob.Response.content_length.fset,
+                              webob.Response.content_length.fdel,
+                              doc=webob.Response.content_length.__doc__)
+
+    def __call__(self, environ, start_response):
+        """WSGI application interface."""
+        self._update_content_length()
+        return super(Response, self).__call__(environ, start_response)
 
     def _set_status(self, value):
         """The status string, including code and message."""
@@ -419,6 +534,35 @@ class Response(webob.Response):
 
     headers = property(_get_headers, _set_headers, doc=_get_headers.__doc__)
 
+    def stream(self, iterable):
+        """Sends the response body in chunks, as they are produced.
+
+        Headers are sent first, then the WSGI server reads the chunks from
+        ``iterable``. A handler can also return a generator, which is passed
+        to this method::
+
+            class ExportHandler(webapp2.RequestHandler):
+                def get(self):
+                    self.response.content_type = 'text/csv'
+                    for row in get_rows():
+                        yield ','.join(row) + '\\n'
+
+        The first chunk is read right away, so exceptions raised before
+        anything is sent are handled as usual. The remaining chunks are read
+        with the app and request globals of the current request; exceptions
+        raised by them are propagated to the WSGI server, since headers were
+        already sent. Don't write to the response after calling this.
+
+        :param iterable:
+            An iterable of strings. Unicode strings are encoded using the
+            response charset.
+        """
+        if self.charset is None:
+            self.charset = self.default_charset
+
+        self.app_iter = _StreamIterator(iterable, self.charset)
+        self.content_length = None
+
     def has_error(self):
         """Indicates whether the response was an error response."""
         return self.status_int >= 400
@@ -435,13 +579,14 @@ class Response(webob.Response):
         :param start_response:
             The WSGI-compatible start_response function.
         """
+        body = self.body
         if (self.headers.get('Cache-Control') == 'no-cache' and
             not self.headers.get('Expires')):
             self.headers['Expires'] = 'Fri, 01 Jan 1990 00:00:00 GMT'
-            self.headers['Content-Length'] = str(len(self.body))
+            self.headers['Content-Length'] = str(len(body))
 
         write = start_response(self.status, self.headerlist)
-        write(self.body)
+        write(body)
 
     @staticmethod
     def http_status_message(code):
@@ -469,6 +614,12 @@ class RequestHandler(object):
     response = None
     #: A :class:`WSGIApplication` instance.
     app = None
+    #: Enables automatic ETags and ``304 Not Modified`` responses for GET
+    #: and HEAD requests: ``'strong'`` or ``'weak'``. Default is None,
+    #: disabled. See :meth:`get_etag_key`.
+    etag_mode = None
+    # Tuple (class, {allowed_methods: table}) set by _get_dispatch_table().
+    _dispatch_tables = None
 
     def __init__(self, request=None, response=None):
         """Initializes this request handler with the given WSGI application,
@@ -516,16 +667,35 @@ class RequestHandler(object):
         """
         request = self.request
         method_name = request.route.handler_method
-        if not method_name:
-            method_name = _normalize_handler_method(request.method)
+        if method_name:
+            method = getattr(self, method_name, None)
+        else:
+            cls = self.__class__
+            entry = _get_dispatch_table(cls, self.app.allowed_methods)[0].get(
+                request.method)
+            if entry is None or entry[0] in self.__dict__:
+                # Not in the class table: the method is not allowed by the
+                # app or was set in the instance.
+                method = getattr(self,
+                    _normalize_handler_method(request.method), None)
+            elif entry[1] is None:
+                method = None
+            else:
+                method = entry[1].__get__(self, cls)
 
-        method = getattr(self, method_name, None)
         if method is None:
             # 405 Method Not Allowed.
             # The response MUST include an Allow header containing a
             # list of valid methods for the requested resource.
             # http://www.w3.org/Protocols/rfc2616/rfc2616-sec10.html#sec10.4.6
-            valid = ', '.join(_get_handler_methods(self))
+            allowed_methods = self.app.allowed_methods
+            valid = _get_dispatch_table(self.__class__, allowed_methods)[1]
+            for method in allowed_methods:
+                if _normalize_handler_method(method) in self.__dict__:
+                    # Methods set in the instance are not in the table.
+                    valid = ', '.join(_get_handler_methods(self))
+                    break
+
             self.abort(405, headers=[('Allow', valid)])
 
         # The handler only receives *args if no named variables are set.
@@ -534,10 +704,101 @@ class RequestHandler(object):
             args = ()
 
         try:
-            return method(*args, **kwargs)
+            conditional = (self.etag_mode is not None and
+                           request.method in ('GET', 'HEAD'))
+            if conditional:
+                key = self.get_etag_key(*args, **kwargs)
+                if key is not None:
+                    self._set_etag(key)
+                    if self._check_not_modified():
+                        # Rendering is skipped.
+                        return None
+
+            rv = method(*args, **kwargs)
+            if isinstance(rv, types.GeneratorType):
+                # Streamed response. See Response.stream().
+                self.response.stream(rv)
+                return None
+
+            if conditional and rv is None and \
+               self.response.status_int == 200:
+                if 'ETag' not in self.response.headers and \
+                   isinstance(self.response.app_iter, list):
+                    # Other bodies, like files, are not read here: they
+                    # need get_etag_key().
+                    self._set_etag(self.response.body)
+
+                self._check_not_modified()
+
+            return rv
         except Exception, e:
             return self.handle_exception(e, self.app.debug)
 
+    def get_etag_key(self, *args, **kwargs):
+        """Returns a key that changes whenever the response changes, e.g.,
+        the version or modification time of the rendered entity.
+
+        Used when :attr:`etag_mode` is set. If a key is returned, the ETag is
+        computed from it before the handler method is called, and the method
+        is not called if the client copy is fresh. Otherwise, by default, the
+        ETag is computed from the response body, if it was written to the
+        response. Bodies set as iterators in ``response.app_iter`` are not
+        read, so they only get an ETag from this key.
+
+        :param args:
+            Positional arguments from the matched route.
+        :param kwargs:
+            Keyword arguments from the matched route.
+        :returns:
+            A string, or None.
+        """
+        return None
+
+    def _set_etag(self, data):
+        """Sets the response ETag from a hash of the given string."""
+        if isinstance(data, unicode):
+            data = data.encode('utf-8')
+
+        etag = '"%s"' % hashlib.md5(data).hexdigest()
+        if self.etag_mode == 'weak':
+            etag = 'W/' + etag
+
+        self.response.headers['ETag'] = etag
+
+    def _check_not_modified(self):
+        """Turns the response into a ``304 Not Modified`` if the client copy
+        is fresh, according to ``If-None-Match`` or ``If-Modified-Since``.
+
+        :returns:
+            True if the response was changed to a 304.
+        """
+        request = self.request
+        response = self.response
+        # Checks the header: request.if_none_match is false for '*'.
+        if 'If-None-Match' in request.headers:
+            etag = response.headers.get('ETag')
+            if etag is None:
+                return False
+
+            # Weak comparison, as allowed for GET and HEAD.
+            if etag.startswith('W/'):
+                etag = etag[2:]
+
+            if etag.strip('"') not in request.if_none_match:
+                return False
+        elif request.if_modified_since and response.last_modified:
+            if response.last_modified > request.if_modified_since:
+                return False
+        else:
+            return False
+
+        response.status = 304
+        response.body = ''
+        for name in ('Content-Type', 'Content-Length'):
+            response.headers.pop(name, None)
+
+        return True
+
     def error(self, code):
         """Clears the response and sets the given HTTP status code.
 
@@ -593,6 +854,22 @@ class RequestHandler(object):
     # Alias.
     url_for = uri_for
 
+    def uri_for_many(self, _name, _iterable, **kwargs):
+        """Returns a list of URIs for a named :class:`Route`.
+
+        :param _name:
+            The route name.
+        :param _iterable:
+            An iterable of dictionaries of keyword arguments to build each
+            URI.
+        :param kwargs:
+            Keyword arguments common to all URIs.
+
+        .. seealso:: :meth:`Router.build_many`.
+        """
+        return self.app.router.build_many(self.request, _name, _iterable,
+                                          kwargs)
+
     def handle_exception(self, exception, debug):
         """Called if this handler throws an exception during execution.
 
@@ -704,6 +981,10 @@ class BaseRoute(object):
     name = None
     #: True if this route is only used for URI generation and never matches.
     build_only = False
+    #: False if matches of this route must not be stored in the
+    #: :class:`MatchCache`, because they depend on more than the request
+    #: path, method, scheme and host.
+    match_cacheable = True
     #: The handler or string in dotted notation to be lazily imported.
     handler = None
     #: The custom handler method, if handler is a class.
@@ -732,6 +1013,7 @@ class BaseRoute(object):
         self.handler = handler
         self.name = name
         self.build_only = build_only
+        _check_match_path(self)
 
     def match(self, request):
         """Matches all routes against a request object.
@@ -745,6 +1027,28 @@ class BaseRoute(object):
         """
         raise NotImplementedError()
 
+    def match_path(self, request, path, method, scheme, host):
+        """Matches this route against the current request, using values
+        extracted from the request once by the router.
+
+        The default implementation calls :meth:`match`. Subclasses that only
+        override :meth:`match` are always matched by it.
+
+        :param request:
+            A :class:`Request` instance.
+        :param path:
+            The unquoted request path (:attr:`Request.match_path`).
+        :param method:
+            The request method.
+        :param scheme:
+            The request scheme.
+        :param host:
+            The request host name (``SERVER_NAME``).
+        :returns:
+            A tuple ``(route, args, kwargs)`` if a route matched, or None.
+        """
+        return self.match(request)
+
     def build(self, request, args, kwargs):
         """Returns a URI for this route.
 
@@ -759,6 +1063,27 @@ class BaseRoute(object):
         """
         raise NotImplementedError()
 
+    def build_many(self, request, iterable, kwargs):
+        """Returns a list of URIs for this route.
+
+        :param request:
+            The current :class:`Request` object.
+        :param iterable:
+            An iterable of dictionaries of keyword arguments to build each
+            URI.
+        :param kwargs:
+            Dictionary of keyword arguments common to all URIs.
+        :returns:
+            A list of absolute or relative URIs.
+        """
+        uris = []
+        for item in iterable:
+            values = kwargs.copy()
+            values.update(item)
+            uris.append(self.build(request, (), values))
+
+        return uris
+
     def get_routes(self):
         """Generator to get all routes from a route.
 
@@ -789,6 +1114,20 @@ class BaseRoute(object):
         if self.name is not None:
             yield self.name, self
 
+    def get_index_routes(self):
+        """Generator to get the routes that replace a match route in indexed
+        matchers: :meth:`Router.compiled_matcher` and
+        :meth:`Router.prefix_matcher`.
+
+        Routes that pre-match a request before testing nested routes can
+        yield the nested routes instead, if they produce the same results
+        when matched by themselves.
+
+        :yields:
+            This route or the nested routes that replace it.
+        """
+        yield self
+
 
 class SimpleRoute(BaseRoute):
     """A route that is compatible with webapp's routing mechanism.
@@ -813,7 +1152,15 @@ class SimpleRoute(BaseRoute):
 
         .. seealso:: :meth:`BaseRoute.match`.
         """
-        match = self.regex.match(urllib.unquote(request.path))
+        return SimpleRoute.match_path(self, request, _get_match_path(request),
+                                      None, None, None)
+
+    def match_path(self, request, path, method, scheme, host):
+        """Matches this route against the current request.
+
+        .. seealso:: :meth:`BaseRoute.match_path`.
+        """
+        match = self.regex.match(path)
         if match:
             return self, match.groups(), {}
 
@@ -938,11 +1285,19 @@ class Route(BaseRoute):
 
         .. seealso:: :meth:`BaseRoute.match`.
         """
-        match = self.regex.match(urllib.unquote(request.path))
-        if not match or self.schemes and request.scheme not in self.schemes:
+        return Route.match_path(self, request, _get_match_path(request),
+                                request.method, request.scheme, None)
+
+    def match_path(self, request, path, method, scheme, host):
+        """Matches this route against the current request.
+
+        .. seealso:: :meth:`match` and :meth:`BaseRoute.match_path`.
+        """
+        match = self.regex.match(path)
+        if not match or self.schemes and scheme not in self.schemes:
             return None
 
-        if self.methods and request.method not in self.methods:
+        if self.methods and method not in self.methods:
             # This will be caught by the router, so routes with different
             # methods can be tried.
             raise exc.HTTPMethodNotAllowed()
@@ -965,17 +1320,183 @@ class Route(BaseRoute):
             scheme = scheme or request.scheme
 
         path, query = self._build(args, kwargs)
-        return _urlunsplit(scheme, netloc, path, query, anchor)
+        return _urlunsplit_quoted(scheme, netloc, path, query, anchor)
+
+    def build_many(self, request, iterable, kwargs):
+        """Returns a list of URIs for this route.
+
+        Special keywords in the common `kwargs` are resolved once. Items
+        that set special keywords are built with :meth:`build`, like in
+        :meth:`BaseRoute.build_many`.
+
+        .. seealso:: :meth:`Router.build_many`.
+        """
+        cls = self.__class__
+        if cls.build.im_func is not Route.build.im_func or \
+           cls._build.im_func is not Route._build.im_func:
+            # Overridden in a subclass: the builder can't be used directly.
+            return BaseRoute.build_many(self, request, iterable, kwargs)
+
+        common = kwargs
+        kwargs = kwargs.copy()
+        scheme = kwargs.pop('_scheme', None)
+        netloc = kwargs.pop('_netloc', None)
+        anchor = kwargs.pop('_fragment', None)
+        full = kwargs.pop('_full', False) and not scheme and not netloc
+
+        if full or scheme or netloc:
+            netloc = netloc or request.host
+            scheme = scheme or request.scheme
+
+        if scheme and netloc:
+            # Same as urlparse.urlunsplit().
+            base = '%s://%s' % (scheme, netloc)
+        else:
+            base = None
+
+        if anchor:
+            suffix = '#' + urllib.quote(_to_utf8(anchor))
+        else:
+            suffix = ''
+
+        builder = self._builder
+        uris = []
+        for item in iterable:
+            if _special_build_keys.intersection(item):
+                values = common.copy()
+                values.update(item)
+                uris.append(self.build(request, (), values))
+                continue
+
+            values = kwargs.copy()
+            values.update(item)
+            path, query = builder((), values)
+            if query:
+                uris.append(_urlunsplit_quoted(scheme, netloc, path, query,
+                                               anchor))
+                continue
+
+            if base is not None:
+                if path and path[:1] != '/':
+                    path = '/' + path
+
+                path = base + path
+
+            uris.append(path + suffix)
+
+        return uris
 
     def _build(self, args, kwargs):
         """Returns the URI path for this route.
 
         :returns:
-            A tuple ``(path, kwargs)`` with the built URI path and extra
-            keywords to be used as URI query arguments.
+            A tuple ``(path, query)`` with the built and quoted URI path and
+            a dictionary of extra keywords to be used as URI query arguments,
+            or None if there are no extra keywords.
+        """
+        return self._builder(args, kwargs)
+
+    @cached_property
+    def _builder(self):
+        """Lazy compiler of the function used by :meth:`_build`.
+
+        The function source is generated for this route: variables are
+        built in a fixed order, literal parts are quoted in advance and
+        values that always match a variable regex (e.g., non-negative
+        integers for ``[^/]+`` or ``\d+``) skip the regex.
         """
         # Access self.regex just to set the lazy properties.
-        regex = self.regex
+        self.regex
+        variables = self.variables
+        parts = _reverse_template_re.split(self.reverse_template)
+        literals, names = parts[::2], parts[1::2]
+        if [p for p in literals if '%' in p] or \
+            sorted(names) != sorted(variables):
+            # Not a template built by _parse_route_template().
+            return self._build_formatted
+
+        namespace = {
+            'defaults': self.defaults,
+            'variables': variables,
+            'missing': object(),
+            'quote': urllib.quote,
+            'to_utf8': _to_utf8,
+        }
+        lines = [
+            'def builder(args, kwargs):',
+            '    consumed = 0',
+            '    count = len(args)',
+        ]
+        path = [repr(urllib.quote(_to_utf8(literals[0])))]
+        for index, name in enumerate(names):
+            v = 'v%d' % index
+            regex = variables[name]
+            kind = _route_variable_kinds.get(regex.pattern)
+            label = name.strip('_')
+            namespace['regex%d' % index] = regex
+            lines += [
+                '    %s = kwargs.get(%r, missing)' % (v, name),
+                '    if %s is missing:' % v,
+                '        %s = defaults.get(%r)' % (v, name),
+                '    else:',
+                '        consumed += 1',
+            ]
+            key = name[2:-2]
+            if self.args_count and name == '__%s__' % key and key.isdigit():
+                lines += [
+                    '    if count > %s:' % key,
+                    '        %s = args[%s]' % (v, key),
+                ]
+
+            lines += [
+                '    if not %s:' % v,
+                '        raise KeyError(%r)' %
+                ('Missing argument "%s" to build URI.' % label),
+            ]
+            if kind is not None:
+                # Non-negative integers need neither validation nor quoting.
+                lines += [
+                    '    if %s.__class__ in (int, long) and %s >= 0:' % (v, v),
+                    '        %s = str(%s)' % (v, v),
+                    '    else:',
+                ]
+            else:
+                lines.append('    if True:')
+
+            lines += [
+                '        if not isinstance(%s, basestring):' % v,
+                '            %s = str(%s)' % (v, v),
+            ]
+            if kind == 'segment':
+                lines.append("        if '/' in %s:" % v)
+            else:
+                lines.append('        if not regex%d.match(%s):' % (index, v))
+
+            lines += [
+                "            raise ValueError('URI building error: Value "
+                "\"%%s\" is not supported for argument \"%%s\".' %% "
+                "(%s, %r))" % (v, label),
+                '        %s = quote(to_utf8(%s))' % (v, v),
+            ]
+            path += [v, repr(urllib.quote(_to_utf8(literals[index + 1])))]
+
+        lines += [
+            '    query = None',
+            '    if len(kwargs) > consumed:',
+            '        query = dict((k, v) for k, v in kwargs.iteritems() if',
+            '                     k not in variables)',
+            "    return ''.join((%s,)), query" % ', '.join(path),
+        ]
+        code = compile('\n'.join(lines), '<route builder %r>' % self.template,
+                       'exec')
+        exec code in namespace
+        return namespace['builder']
+
+    def _build_formatted(self, args, kwargs):
+        """Builds the URI path formatting :attr:`reverse_template`.
+
+        .. seealso:: :meth:`_build`.
+        """
         variables = self.variables
         if self.args_count:
             for index, value in enumerate(args):
@@ -999,7 +1520,11 @@ class Route(BaseRoute):
 
             values[name] = value
 
-        return (self.reverse_template % values, kwargs)
+        path = self.reverse_template % values
+        if path:
+            path = urllib.quote(_to_utf8(path))
+
+        return path, kwargs
 
     def __repr__(self):
         return '<Route(%r, %r, name=%r, defaults=%r, build_only=%r)>' % \
@@ -1007,6 +1532,293 @@ class Route(BaseRoute):
             self.build_only)
 
 
+class _RouteGroup(object):
+    """A sequence of :class:`Route` instances merged into a single regex.
+
+    Each route pattern becomes an alternative wrapped in a named group, so
+    the matched route is found by the index of the last closed group.
+    Alternatives are tried in order, which keeps first-match-wins.
+    """
+
+    def __init__(self, routes):
+        """Initializes and compiles the group.
+
+        :param routes:
+            A list of routes accepted by :func:`_is_mergeable_route`.
+        """
+        self.routes = routes
+        self.variables = []
+        self.tails = {}
+        parts = []
+        for index, route in enumerate(routes):
+            prefix = '_%d_' % index
+            pattern = _route_group_re.sub(r'\1' + prefix,
+                                          route.regex.pattern[1:-1])
+            parts.append('(?P<_%d>%s)' % (index, pattern))
+            self.variables.append([(prefix + name, name) for name in
+                                   route.regex.groupindex])
+
+        self.regex = re.compile('^(?:%s)$' % '|'.join(parts))
+        groupindex = self.regex.groupindex
+        self.indexes = dict((groupindex['_%d' % i], i) for i in
+                            xrange(len(routes)))
+
+    def get_tail(self, index):
+        """Returns a group with the routes starting at the given index.
+
+        This is used to resume matching when a matched route is rejected
+        because of its schemes or methods.
+
+        :param index:
+            Index of the first route to be included.
+        :returns:
+            A :class:`_RouteGroup` or None if there are no routes left.
+        """
+        if index >= len(self.routes):
+            return None
+
+        group = self.tails.get(index)
+        if group is None:
+            group = self.tails[index] = _RouteGroup(self.routes[index:])
+
+        return group
+
+    def iter_matches(self, path, scheme):
+        """Generator to get the routes that match a path and scheme, in
+        order, ignoring the route methods.
+
+        :param path:
+            The unquoted request path.
+        :param scheme:
+            The request scheme.
+        :yields:
+            Tuples ``(group, index, match)`` with the group and index of a
+            matched route and the regex match object.
+        """
+        group = self
+        while group is not None:
+            match = group.regex.match(path)
+            if not match:
+                return
+
+            index = group.indexes[match.lastindex]
+            schemes = group.routes[index].schemes
+            if not schemes or scheme in schemes:
+                yield group, index, match
+
+            group = group.get_tail(index + 1)
+
+    def match(self, request):
+        """Matches the merged routes against the current request.
+
+        Follows the same contract as :meth:`Route.match`.
+        """
+        return self.match_path(request, _get_match_path(request),
+                               request.method, request.scheme, None)
+
+    def match_path(self, request, path, method, scheme, host):
+        """Same as :meth:`match`, using values extracted from the request.
+
+        .. seealso:: :meth:`BaseRoute.match_path`.
+        """
+        method_not_allowed = False
+        for group, index, match in self.iter_matches(path, scheme):
+            route = group.routes[index]
+            if route.methods and method not in route.methods:
+                method_not_allowed = True
+                continue
+
+            kwargs = route.defaults.copy()
+            for name, key in group.variables[index]:
+                kwargs[key] = match.group(name)
+
+            args, kwargs = _split_route_variables(kwargs)
+            return route, args, kwargs
+
+        if method_not_allowed:
+            raise exc.HTTPMethodNotAllowed()
+
+    def __repr__(self):
+        return '<_RouteGroup(%r)>' % self.routes
+
+
+class _HostGroup(object):
+    """Consecutive host routes indexed by host.
+
+    Host routes, like :class:`webapp2_extras.routes.DomainRoute`, match the
+    request host (``SERVER_NAME``) before trying their nested routes. They
+    implement ``get_literal_host()``, which returns the only host they match
+    or None if the host template has variables. Routes with a literal host
+    are looked up in a dictionary, so only those for the request host are
+    tried, together with the routes with variables.
+    """
+
+    def __init__(self, routes):
+        """Indexes the routes.
+
+        :param routes:
+            A list of host routes.
+        """
+        self.routes = routes
+        wildcards = []
+        hosts = {}
+        for position, route in enumerate(routes):
+            host = route.get_literal_host()
+            if host is None:
+                wildcards.append((position, route))
+            else:
+                hosts.setdefault(host, []).append((position, route))
+
+        #: Routes to be tried for hosts without a literal host route.
+        self.wildcards = [r for i, r in wildcards]
+        #: Maps literal hosts to the routes to be tried, in the same order.
+        self.hosts = {}
+        for host, entries in hosts.iteritems():
+            entries.extend(wildcards)
+            entries.sort()
+            self.hosts[host] = [r for i, r in entries]
+
+    def match(self, request):
+        """Matches the routes for the request host.
+
+        .. seealso:: :meth:`BaseRoute.match`.
+        """
+        return self.match_path(request, _get_match_path(request),
+                               request.method, request.scheme,
+                               request.environ['SERVER_NAME'])
+
+    def match_path(self, request, path, method, scheme, host):
+        """Same as :meth:`match`, using values extracted from the request.
+
+        .. seealso:: :meth:`BaseRoute.match_path`.
+        """
+        routes = self.hosts.get(host, self.wildcards)
+        method_not_allowed = False
+        for route in routes:
+            try:
+                match = route.match_path(request, path, method, scheme, host)
+                if match:
+                    return match
+            except exc.HTTPMethodNotAllowed:
+                method_not_allowed = True
+
+        if method_not_allowed:
+            raise exc.HTTPMethodNotAllowed()
+
+
+class _MatchPathAdapter(object):
+    """Wraps a match route that doesn't implement ``match_path()``."""
+
+    def __init__(self, route):
+        self.route = route
+
+    def match_path(self, request, path, method, scheme, host):
+        """Calls ``match()`` in the wrapped route."""
+        return self.route.match(request)
+
+
+class _PrefixNode(object):
+    """A node of :class:`_PrefixTree`."""
+
+    def __init__(self, parent=None):
+        self.parent = parent
+        #: Maps the first character of an edge label to ``(label, node)``.
+        self.edges = {}
+        #: Tuples ``(position, route)`` for routes indexed in this node.
+        self.entries = []
+        # Routes to be tried for paths ending in this node, built lazily.
+        self.routes = None
+
+    def get_routes(self):
+        """Returns the routes indexed in this node and in its ancestors,
+        in the order they were added, with mergeable routes merged.
+        """
+        routes = self.routes
+        if routes is None:
+            entries = []
+            node = self
+            while node is not None:
+                entries.extend(node.entries)
+                node = node.parent
+
+            entries.sort()
+            routes = _merge_routes([r for i, r in entries])
+            routes = self.routes = _group_host_routes(routes)
+
+        return routes
+
+
+class _PrefixTree(object):
+    """A radix tree of routes indexed by the literal prefix of their templates.
+
+    Looking up a path walks the tree once, so only routes with a prefix of
+    the path are tried, together with routes that have no literal prefix.
+    """
+
+    def __init__(self, routes):
+        """Builds the tree.
+
+        :param routes:
+            A list of routes, as returned by :func:`_get_index_routes`.
+        """
+        self.root = _PrefixNode()
+        for position, route in enumerate(routes):
+            self.add(_get_route_prefix(route), (position, route))
+
+    def add(self, prefix, entry):
+        """Adds an entry to the node for the given prefix, splitting edges
+        as needed.
+        """
+        node = self.root
+        pos = 0
+        while pos < len(prefix):
+            edge = node.edges.get(prefix[pos])
+            if edge is None:
+                child = _PrefixNode(node)
+                node.edges[prefix[pos]] = (prefix[pos:], child)
+                node = child
+                break
+
+            label, child = edge
+            common = 1
+            end = min(len(label), len(prefix) - pos)
+            while common < end and label[common] == prefix[pos + common]:
+                common += 1
+
+            if common < len(label):
+                # Split the edge at the end of the common prefix.
+                middle = _PrefixNode(node)
+                middle.edges[label[common]] = (label[common:], child)
+                child.parent = middle
+                node.edges[prefix[pos]] = (label[:common], middle)
+                child = middle
+
+            node = child
+            pos += common
+
+        node.entries.append(entry)
+
+    def get_routes(self, path):
+        """Returns the routes to be tried for a path.
+
+        :param path:
+            The unquoted request path.
+        :returns:
+            A list of routes and route groups.
+        """
+        node = self.root
+        pos = 0
+        while pos < len(path):
+            edge = node.edges.get(path[pos])
+            if edge is None or not path.startswith(edge[0], pos):
+                break
+
+            pos += len(edge[0])
+            node = edge[1]
+
+        return node.get_routes()
+
+
 class BaseHandlerAdapter(object):
     """A basic adapter to dispatch a handler.
 
@@ -1066,49 +1878,465 @@ class Webapp2HandlerAdapter(BaseHandlerAdapter):
         return handler.dispatch()
 
 
-class Router(object):
-    """A URI router used to match, dispatch and build URIs."""
+class MatchCache(object):
+    """A bounded cache of route matches, used by :class:`Router`.
 
-    #: Class used when the route is set as a tuple.
-    route_class = SimpleRoute
-    #: All routes that can be matched.
-    match_routes = None
-    #: All routes that can be built.
-    build_routes = None
-    #: Handler classes imported lazily.
-    handlers = None
+    When the cache is full, the least recently used match is discarded.
+    """
 
-    def __init__(self, routes=None):
-        """Initializes the router.
+    #: Maximum number of cached matches.
+    max_size = None
+    #: Number of lookups that found a cached match.
+    hits = 0
+    #: Number of lookups that didn't find a cached match.
+    misses = 0
 
-        :param routes:
-            A sequence of :class:`Route` instances or, for simple routes,
-            tuples ``(regex, handler)``.
+    def __init__(self, max_size):
+        """Initializes the cache.
+
+        :param max_size:
+            Maximum number of cached matches.
         """
-        self.match_routes = []
-        self.build_routes = {}
-        self.handlers = {}
-        if routes:
-            for route in routes:
-                self.add(route)
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.clear()
 
-    def add(self, route):
-        """Adds a route to this router.
+    def clear(self):
+        """Removes all cached matches and resets the counters."""
+        with self.lock:
+            # A circular doubly linked list of [prev, next, key, value]
+            # entries, from least to most recently used.
+            self.root = root = []
+            root[:] = [root, root, None, None]
+            self.entries = {}
+            self.hits = self.misses = 0
 
-        :param route:
-            A :class:`Route` instance or, for simple routes, a tuple
-            ``(regex, handler)``.
-        """
-        if isinstance(route, tuple):
-            # Exceptional case: simple routes defined as a tuple.
-            route = self.route_class(*route)
+    def get(self, key):
+        """Returns a cached match, or None if it is not cached.
 
-        for r in route.get_match_routes():
+        :param key:
+            The match key.
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            # Move the entry to the most recently used position.
+            prev, next = entry[0], entry[1]
+            prev[1], next[0] = next, prev
+            root = self.root
+            last = root[0]
+            last[1] = root[0] = entry
+            entry[0], entry[1] = last, root
+            return entry[3]
+
+    def set(self, key, value):
+        """Caches a match.
+
+        :param key:
+            The match key.
+        :param value:
+            The match, a tuple ``(route, args, kwargs)``.
+        """
+        with self.lock:
+            if key in self.entries:
+                return
+
+            root = self.root
+            if len(self.entries) >= self.max_size:
+                # Discard the least recently used entry.
+                first = root[1]
+                root[1] = first[1]
+                first[1][0] = root
+                del self.entries[first[2]]
+
+            last = root[0]
+            last[1] = root[0] = self.entries[key] = [last, root, key, value]
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class RouteStats(object):
+    """Per-route statistics, used by :class:`Router`.
+
+    Each thread updates its own counters, so no lock is needed to record
+    them. Counters are merged when a :meth:`snapshot` is taken. Counters of
+    finished threads are merged into a single total, so statistics don't
+    grow with the number of threads created by the server.
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.local = threading.local()
+        # Counters of live threads, as {thread ident: (shard, owner ref)}.
+        # Shards are dictionaries {key: record}.
+        self.shards = {}
+        # Merged counters of finished threads, as {key: record}.
+        self.retired = {}
+
+    def add_match(self, route, attempts):
+        """Records a route match.
+
+        :param route:
+            The matched route.
+        :param attempts:
+            Number of routes tried until the route matched, including it,
+            or 0 if the match was cached. Routes merged by
+            :meth:`Router.compiled_matcher` are counted one by one.
+        """
+        record = self._get_record(route)
+        record[0] += 1
+        record[1] += attempts
+
+    def add_dispatch(self, route, seconds, error=False):
+        """Records a handler dispatch.
+
+        :param route:
+            The dispatched route.
+        :param seconds:
+            Time spent by the handler, in seconds.
+        :param error:
+            True if the handler raised an exception.
+        """
+        record = self._get_record(route)
+        record[2] += 1
+        if error:
+            record[3] += 1
+
+        record[4] += seconds
+        if seconds > record[5]:
+            record[5] = seconds
+
+    def snapshot(self):
+        """Returns the statistics for all routes.
+
+        :returns:
+            A dictionary keyed by route name or, for unnamed routes, by
+            template. Values are dictionaries with the keys ``matches``,
+            ``attempts`` (number of routes tried until the route matched),
+            ``dispatches``, ``errors`` (handler exceptions), ``total_time``
+            and ``max_time`` (handler time, in seconds).
+        """
+        stats = {}
+        with self.lock:
+            shards = [shard for shard, ref in self.shards.itervalues()]
+            _merge_route_records(stats, self.retired)
+
+        for shard in shards:
+            _merge_route_records(stats, shard)
+
+        return dict((key, {
+            'matches': values[0],
+            'attempts': values[1],
+            'dispatches': values[2],
+            'errors': values[3],
+            'total_time': values[4],
+            'max_time': values[5],
+        }) for key, values in stats.iteritems())
+
+    def clear(self):
+        """Resets the statistics of all routes."""
+        with self.lock:
+            for shard, ref in self.shards.itervalues():
+                shard.clear()
+
+            self.retired.clear()
+
+    def _get_record(self, route):
+        """Returns the counters of a route for the current thread."""
+        shard = getattr(self.local, 'shard', None)
+        if shard is None:
+            shard = self._add_shard()
+
+        key = route.name or route.template
+        record = shard.get(key)
+        if record is None:
+            # matches, attempts, dispatches, errors, total and max time.
+            record = shard[key] = [0, 0, 0, 0, 0.0, 0.0]
+
+        return record
+
+    def _add_shard(self):
+        """Sets the counters for the current thread.
+
+        The thread-local owner object is released when the thread ends,
+        and then its counters are retired. A thread that reuses the ident
+        of a finished thread reuses its counters.
+        """
+        ident = _get_thread_ident()
+        owner = _RouteStatsOwner()
+
+        def retire(ref):
+            self._retire(ident, ref)
+
+        with self.lock:
+            entry = self.shards.get(ident)
+            if entry is None:
+                shard = {}
+            else:
+                shard = entry[0]
+
+            self.shards[ident] = (shard, weakref.ref(owner, retire))
+
+        self.local.owner = owner
+        self.local.shard = shard
+        return shard
+
+    def _retire(self, ident, ref):
+        """Merges the counters of a finished thread into :attr:`retired`."""
+        with self.lock:
+            entry = self.shards.get(ident)
+            if entry is None or entry[1] is not ref:
+                # Reused by another thread.
+                return
+
+            del self.shards[ident]
+            _merge_route_records(self.retired, entry[0])
+
+
+class _RouteStatsOwner(object):
+    """Kept in thread-local storage to detect the end of a thread."""
+
+    __slots__ = ('__weakref__',)
+
+
+def _merge_route_records(stats, shard):
+    """Adds the records of a :class:`RouteStats` shard to ``stats``."""
+    for key, record in shard.items():
+        values = stats.get(key)
+        if values is None:
+            values = stats[key] = [0, 0, 0, 0, 0.0, 0.0]
+
+        for i in range(5):
+            values[i] += record[i]
+
+        values[5] = max(values[5], record[5])
+
+
+class AdmissionControl(object):
+    """Limits the number of requests handled at once, used by
+    :class:`WSGIApplication`.
+
+    Requests over a limit wait in a bounded queue. If the queue is full or
+    the wait is too long, they are rejected with ``503 Service Unavailable``
+    and a ``Retry-After`` header, so that a slow handler doesn't make all
+    requests slow.
+
+    A request keeps its slot until the handler returns or, for streamed
+    responses (see :meth:`Response.stream`), until the WSGI server closes
+    the response body.
+    """
+
+    #: Number of rejected requests.
+    rejected = 0
+
+    def __init__(self, max_active=None, max_queue=0, max_queue_time=1.0,
+                 route_limits=None, retry_after=1):
+        """Initializes the admission control.
+
+        :param max_active:
+            Maximum number of requests handled at once, or None for no
+            global limit.
+        :param max_queue:
+            Maximum number of requests waiting for each limit.
+        :param max_queue_time:
+            Maximum seconds that a request waits in a queue.
+        :param route_limits:
+            A dictionary mapping route names to the maximum number of
+            requests handled at once by each route.
+        :param retry_after:
+            Value of the ``Retry-After`` header of rejected requests, in
+            seconds.
+        """
+        self.retry_after = retry_after
+        self.lock = threading.Lock()
+        self.limiter = None
+        if max_active is not None:
+            self.limiter = _Limiter(max_active, max_queue, max_queue_time)
+
+        self.route_limiters = dict((name, _Limiter(limit, max_queue,
+                                                   max_queue_time))
+                                   for name, limit in
+                                   (route_limits or {}).iteritems())
+
+    def enter(self, response, route=None):
+        """Waits for a slot to handle a request, globally or for a route.
+
+        :param response:
+            The :class:`Response` of the request. A ``Retry-After`` header
+            is set if the request is rejected, so that it is kept by error
+            handlers.
+        :param route:
+            A :class:`BaseRoute` with a limit in ``route_limits``, or None
+            for the global limit.
+        :raises:
+            ``exc.HTTPServiceUnavailable`` if the request is rejected.
+        """
+        limiter = self._get_limiter(route)
+        if limiter is None or limiter.acquire():
+            return
+
+        with self.lock:
+            self.rejected += 1
+
+        retry_after = str(self.retry_after)
+        response.headers['Retry-After'] = retry_after
+        abort(503, headers=[('Retry-After', retry_after)])
+
+    def leave(self, route=None):
+        """Releases the slot taken by :meth:`enter`.
+
+        :param route:
+            The route passed to :meth:`enter`.
+        """
+        limiter = self._get_limiter(route)
+        if limiter is not None:
+            limiter.release()
+
+    def snapshot(self):
+        """Returns the current number of requests being handled and waiting.
+
+        :returns:
+            A dictionary with ``'active'`` and ``'queued'`` counts for the
+            global limit, if set, ``'rejected'`` with the total number of
+            rejected requests and ``'routes'``, a dictionary with the counts
+            of each route with a limit.
+        """
+        rv = {
+            'rejected': self.rejected,
+            'routes': dict((name, limiter.snapshot()) for name, limiter in
+                           self.route_limiters.iteritems()),
+        }
+        if self.limiter is not None:
+            rv.update(self.limiter.snapshot())
+
+        return rv
+
+    def _get_limiter(self, route):
+        if route is None:
+            return self.limiter
+
+        return self.route_limiters.get(route.name)
+
+
+class _Limiter(object):
+    """A counting semaphore with a bounded queue and wait time."""
+
+    def __init__(self, max_active, max_queue, max_queue_time):
+        self.max_active = max_active
+        self.max_queue = max_queue
+        self.max_queue_time = max_queue_time
+        self.condition = threading.Condition(threading.Lock())
+        self.active = self.queued = 0
+
+    def acquire(self):
+        """Takes a slot, waiting in the queue if needed.
+
+        :returns:
+            True if a slot was taken, False if the queue is full or the
+            wait timed out.
+        """
+        with self.condition:
+            if self.active < self.max_active:
+                self.active += 1
+                return True
+
+            if self.queued >= self.max_queue:
+                return False
+
+            self.queued += 1
+            try:
+                deadline = time.time() + self.max_queue_time
+                while self.active >= self.max_active:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        return False
+
+                    self.condition.wait(remaining)
+
+                self.active += 1
+                return True
+            finally:
+                self.queued -= 1
+
+    def release(self):
+        """Releases a slot and wakes up a waiting request."""
+        with self.condition:
+            self.active -= 1
+            self.condition.notify()
+
+    def snapshot(self):
+        with self.condition:
+            return {'active': self.active, 'queued': self.queued}
+
+
+class Router(object):
+    """A URI router used to match, dispatch and build URIs."""
+
+    #: Class used when the route is set as a tuple.
+    route_class = SimpleRoute
+    #: All routes that can be matched.
+    match_routes = None
+    #: All routes that can be built.
+    build_routes = None
+    #: Handler classes imported lazily.
+    handlers = None
+    #: A :class:`MatchCache` used by the dispatcher, if enabled.
+    #: See :meth:`set_match_cache`.
+    match_cache = None
+    # Match routes indexed by matcher and request method, built lazily.
+    _match_indexes = None
+    # Routes whose matches can be cached, built lazily.
+    _cacheable_routes = None
+    #: A :class:`RouteStats` updated by the matchers and the dispatcher, if
+    #: enabled. See :meth:`set_route_stats`.
+    route_stats = None
+    # Locks to import and adapt each handler only once, keyed by handler.
+    _handler_locks = None
+
+    def __init__(self, routes=None):
+        """Initializes the router.
+
+        :param routes:
+            A sequence of :class:`Route` instances or, for simple routes,
+            tuples ``(regex, handler)``.
+        """
+        self.match_routes = []
+        self.build_routes = {}
+        self.handlers = {}
+        self._match_indexes = {}
+        self._handler_locks = {}
+        self._handler_locks_lock = threading.Lock()
+        if routes:
+            for route in routes:
+                self.add(route)
+
+    def add(self, route):
+        """Adds a route to this router.
+
+        :param route:
+            A :class:`Route` instance or, for simple routes, a tuple
+            ``(regex, handler)``.
+        """
+        if isinstance(route, tuple):
+            # Exceptional case: simple routes defined as a tuple.
+            route = self.route_class(*route)
+
+        for r in route.get_match_routes():
             self.match_routes.append(r)
 
         for name, r in route.get_build_routes():
             self.build_routes[name] = r
 
+        self._match_indexes = {}
+        self._cacheable_routes = None
+        if self.match_cache is not None:
+            self.match_cache.clear()
+
     def set_matcher(self, func):
         """Sets the function called to match URIs.
 
@@ -1140,6 +2368,39 @@ class Router(object):
         """
         self.dispatch = func.__get__(self, self.__class__)
 
+    def set_match_cache(self, max_size):
+        """Enables or disables the cache of route matches.
+
+        When enabled, the dispatcher stores the route matched for a request
+        path, method, scheme and host (``SERVER_NAME``), so repeated
+        requests skip matching. Matches of routes that have
+        :attr:`BaseRoute.match_cacheable` set to False, or that come after
+        such a route, are never cached.
+
+        :param max_size:
+            Maximum number of cached matches, or None to disable the cache.
+        """
+        if max_size:
+            self.match_cache = MatchCache(max_size)
+        else:
+            self.match_cache = None
+
+    def set_route_stats(self, enabled):
+        """Enables or disables the per-route statistics.
+
+        When enabled, :attr:`route_stats` counts matches, routes tried
+        before each match, dispatches, handler errors and handler time for
+        each route. Only the default dispatcher and the matchers included in
+        webapp2 update the statistics.
+
+        :param enabled:
+            True to enable statistics, False to disable them.
+        """
+        if enabled:
+            self.route_stats = RouteStats()
+        else:
+            self.route_stats = None
+
     def set_adapter(self, func):
         """Sets the function that adapts loaded handlers for dispatching.
 
@@ -1152,7 +2413,9 @@ class Router(object):
     def default_matcher(self, request):
         """Matches all routes against a request object.
 
-        The first one that matches is returned.
+        The first one that matches is returned. Routes are indexed by the
+        HTTP methods they allow, so :class:`Route` instances that don't
+        allow the request method are only tested to tell a 404 from a 405.
 
         :param request:
             A :class:`Request` instance.
@@ -1163,16 +2426,121 @@ class Router(object):
             ``exc.HTTPMethodNotAllowed`` if a route matched but the HTTP
             method was not allowed.
         """
+        routes, excluded = self._get_match_index('default', request.method)
+        return self._match_routes(request, routes, excluded)
+
+    def compiled_matcher(self, request):
+        """Matches all routes against a request object using merged regexes.
+
+        Consecutive :class:`Route` instances are merged into a single regular
+        expression, so a request is tested against a few combined patterns
+        instead of one pattern per route. Routes that implement
+        :meth:`BaseRoute.get_index_routes`, like
+        :class:`webapp2_extras.routes.PathPrefixRoute`, are replaced by the
+        routes they yield. Other routes are matched as usual.
+        The result is the same as :meth:`default_matcher`: routes are tried
+        in the order they were added and the first one that matches wins.
+
+        To use it, set it as the router matcher::
+
+            app = webapp2.WSGIApplication(routes)
+            app.router.set_matcher(webapp2.Router.compiled_matcher)
+
+        .. seealso:: :meth:`default_matcher`.
+        """
+        routes, excluded = self._get_match_index('compiled', request.method)
+        return self._match_routes(request, routes, excluded)
+
+    def prefix_matcher(self, request):
+        """Matches routes indexed by path prefix against a request object.
+
+        Routes are indexed in a radix tree by the literal part of their
+        templates that comes before the first variable, so only routes with
+        a prefix of the request path are tried, together with routes that
+        can't be indexed. Nested routes of
+        :class:`webapp2_extras.routes.PathPrefixRoute` are indexed as well.
+        The result is the same as :meth:`default_matcher`.
+
+        To use it, set it as the router matcher::
+
+            app = webapp2.WSGIApplication(routes)
+            app.router.set_matcher(webapp2.Router.prefix_matcher)
+
+        .. seealso:: :meth:`default_matcher`.
+        """
+        routes, excluded = self._get_match_index('prefix', request.method)
+        path = _get_match_path(request)
+        return self._match_routes(request, routes.get_routes(path),
+                                  excluded.get_routes(path))
+
+    def _get_match_index(self, matcher, method):
+        """Returns the match routes indexed for a matcher and HTTP method.
+
+        Indexes are built on first use and discarded when a route is added.
+
+        :param matcher:
+            The matcher name: ``'default'``, ``'compiled'`` or ``'prefix'``.
+        :param method:
+            The request method.
+        :returns:
+            A tuple ``(routes, excluded)``. The first item has the routes to
+            be tried for the method. The second has routes that match other
+            methods only, and is used to tell a 404 from a 405. For the
+            prefix matcher both are a :class:`_PrefixTree`.
+        """
+        key = (matcher, method)
+        index = self._match_indexes.get(key)
+        if index is None:
+            routes = self.match_routes
+            if matcher in ('compiled', 'prefix'):
+                routes = _get_index_routes(routes)
+
+            routes = [r if hasattr(r, 'match_path') else _MatchPathAdapter(r)
+                      for r in routes]
+
+            routes, excluded = _split_routes_by_method(routes, method)
+            if matcher == 'compiled':
+                routes = _group_host_routes(_merge_routes(routes))
+                index = (routes, _merge_routes(excluded))
+            elif matcher == 'prefix':
+                index = (_PrefixTree(routes), _PrefixTree(excluded))
+            else:
+                index = (_group_host_routes(routes), excluded)
+
+            self._match_indexes[key] = index
+
+        return index
+
+    def _match_routes(self, request, routes, excluded):
+        """Returns the first match from the given routes.
+
+        .. seealso:: :meth:`_get_match_index`.
+        """
+        path = _get_match_path(request)
+        method = request.method
+        scheme = request.scheme
+        host = request.environ.get('SERVER_NAME')
         method_not_allowed = False
-        for route in self.match_routes:
+        stats = self.route_stats
+        attempts = 0
+        for route in routes:
             try:
-                match = route.match(request)
-                if match:
-                    return match
+                match = route.match_path(request, path, method, scheme, host)
             except exc.HTTPMethodNotAllowed:
+                # Only raised by routes that can't be indexed by method.
                 method_not_allowed = True
+                match = None
 
-        if method_not_allowed:
+            if stats is not None:
+                attempts += _count_tried_routes(route, match)
+
+            if match:
+                if stats is not None:
+                    stats.add_match(match[0], attempts)
+
+                return match
+
+        if method_not_allowed or _match_any_path(request, excluded):
             raise exc.HTTPMethodNotAllowed()
 
         raise exc.HTTPNotFound()
@@ -1212,6 +2580,38 @@ class Router(object):
 
         return route.build(request, args, kwargs)
 
+    def build_many(self, request, name, iterable, kwargs=None):
+        """Returns a list of URIs for a named :class:`Route`.
+
+        The route is looked up once, and the special keywords ``_full``,
+        ``_scheme``, ``_netloc`` and ``_fragment`` in `kwargs` are resolved
+        once for all URIs, which is much faster than calling :meth:`build`
+        in a loop to render long lists of links. Items can also set special
+        keywords, which override the common ones for that URI.
+
+        .. note::
+           This uses the routes in :attr:`build_routes` directly, and
+           ignores a builder set with :meth:`set_builder`.
+
+        :param request:
+            The current :class:`Request` object.
+        :param name:
+            The route name.
+        :param iterable:
+            An iterable of dictionaries of keyword arguments to build each
+            URI, as described in :meth:`default_builder`.
+        :param kwargs:
+            Dictionary of keyword arguments common to all URIs, including
+            the special keywords described in :meth:`default_builder`.
+        :returns:
+            A list of absolute or relative URIs.
+        """
+        route = self.build_routes.get(name)
+        if route is None:
+            raise KeyError('Route named %r is not defined.' % name)
+
+        return route.build_many(request, iterable, kwargs or {})
+
     def default_dispatcher(self, request, response):
         """Dispatches a handler.
 
@@ -1226,11 +2626,68 @@ class Router(object):
         :returns:
             The returned value from the handler.
         """
-        route, args, kwargs = rv = self.match(request)
+        if self.match_cache is None:
+            rv = self.match(request)
+        else:
+            rv = self._match_cached(request)
+
+        route, args, kwargs = rv
         request.route, request.route_args, request.route_kwargs = rv
 
         if route.handler_adapter is None:
-            handler = route.handler
+            self._set_handler_adapter(route)
+
+        admission = getattr(request.app, 'admission_control', None)
+        if admission is not None and route.name in admission.route_limiters:
+            admission.enter(response, route)
+            streamed = False
+            try:
+                rv = self._call_handler(route, request, response)
+                if isinstance(rv, types.GeneratorType):
+                    # Reads the first chunk while the slot is taken.
+                    response.stream(rv)
+                    rv = None
+
+                # Streamed bodies keep the slot until they are closed.
+                streamed = _call_on_close(response if rv is None else rv,
+                                          lambda: admission.leave(route))
+                return rv
+            finally:
+                if not streamed:
+                    admission.leave(route)
+
+        return self._call_handler(route, request, response)
+
+    def _call_handler(self, route, request, response):
+        """Calls the adapted handler of a route, updating the statistics."""
+        if self.route_stats is None:
+            return route.handler_adapter(request, response)
+
+        start = time.time()
+        try:
+            rv = route.handler_adapter(request, response)
+        except:
+            self.route_stats.add_dispatch(route, time.time() - start, True)
+            raise
+
+        self.route_stats.add_dispatch(route, time.time() - start)
+        return rv
+
+    def _set_handler_adapter(self, route):
+        """Imports the handler of a route if needed, and sets the adapted
+        handler in :attr:`BaseRoute.handler_adapter`.
+
+        This is thread-safe: if several threads load the same handler at
+        once, one imports and adapts it while the others wait.
+
+        :param route:
+            A route with a handler.
+        """
+        handler = route.handler
+        with self._get_handler_lock(handler):
+            if route.handler_adapter is not None:
+                return
+
             if isinstance(handler, basestring):
                 if handler not in self.handlers:
                     self.handlers[handler] = handler = import_string(handler)
@@ -1239,7 +2696,96 @@ class Router(object):
 
             route.handler_adapter = self.adapt(handler)
 
-        return route.handler_adapter(request, response)
+    def _get_handler_lock(self, handler):
+        """Returns the lock used to load a handler.
+
+        :param handler:
+            A handler or a string in dotted notation to import a handler.
+        """
+        with self._handler_locks_lock:
+            lock = self._handler_locks.get(handler)
+            if lock is None:
+                lock = self._handler_locks[handler] = threading.Lock()
+
+            return lock
+
+    def warmup(self):
+        """Parses all route templates and imports and adapts all handlers.
+
+        Routes and handlers are otherwise loaded lazily, on first use.
+
+        :returns:
+            A dictionary with the time spent by each stage, in seconds:
+            ``'routes'`` to compile route regexes and URI builders, and
+            ``'handlers'`` to import and adapt handlers.
+        """
+        routes = _get_all_routes(self)
+        timings = {}
+
+        start = time.time()
+        for route in routes:
+            if isinstance(getattr(route.__class__, 'regex', None),
+                          cached_property):
+                route.regex
+
+            if isinstance(route, Route):
+                route._builder
+
+        timings['routes'] = time.time() - start
+
+        start = time.time()
+        for route in routes:
+            if getattr(route, 'build_only', True) or \
+                getattr(route, 'handler', None) is None:
+                continue
+
+            if route.handler_adapter is None:
+                self._set_handler_adapter(route)
+
+        timings['handlers'] = time.time() - start
+        return timings
+
+    def _match_cached(self, request):
+        """Matches a request using the :attr:`match_cache`.
+
+        Keyword arguments are copied, so handlers can't change cached values.
+        """
+        key = (_get_match_path(request), request.method, request.scheme,
+               request.environ.get('SERVER_NAME'))
+        rv = self.match_cache.get(key)
+        if rv is None:
+            rv = self.match(request)
+            if rv and rv[0] in self._get_cacheable_routes():
+                self.match_cache.set(key, (rv[0], rv[1], rv[2].copy()))
+
+            return rv
+
+        route, args, kwargs = rv
+        if self.route_stats is not None:
+            self.route_stats.add_match(route, 0)
+
+        return route, args, kwargs.copy()
+
+    def _get_cacheable_routes(self):
+        """Returns the set of routes whose matches can be cached.
+
+        Routes after the first one with :attr:`BaseRoute.match_cacheable`
+        set to False are excluded: that route may match other requests to
+        the same path, so it must be tried again.
+        """
+        routes = self._cacheable_routes
+        if routes is None:
+            routes = set()
+            for route in self.match_routes:
+                if not getattr(route, 'match_cacheable', False):
+                    break
+
+                routes.add(route)
+                routes.update(_get_index_routes([route]))
+
+            self._cacheable_routes = routes
+
+        return routes
 
     def default_adapter(self, handler):
         """Adapts a handler for dispatching.
@@ -1389,6 +2935,108 @@ class RequestContext(object):
             self.app.clear_globals()
 
 
+class RequestContextExecutor(object):
+    """Wraps an executor to run tasks with the app and request globals of
+    the thread that submits them.
+
+    :func:`get_app` and :func:`get_request` are bound to the current thread,
+    so they are not available in worker threads. Tasks submitted through
+    this wrapper see the app and request that were active when they were
+    submitted::
+
+        from concurrent import futures
+
+        pool = webapp2.RequestContextExecutor(
+            futures.ThreadPoolExecutor(max_workers=8))
+
+        class MyHandler(webapp2.RequestHandler):
+            def get(self):
+                results = pool.map(fetch_backend, ['users', 'items'])
+                ...
+
+    The previous globals of the worker thread are restored when each task
+    ends.
+    """
+
+    #: The wrapped executor.
+    executor = None
+
+    def __init__(self, executor):
+        """Initializes the wrapper.
+
+        :param executor:
+            An object with the ``submit()`` and ``map()`` methods of
+            ``concurrent.futures.Executor``.
+        """
+        self.executor = executor
+
+    def submit(self, fn, *args, **kwargs):
+        """Schedules ``fn(*args, **kwargs)`` in the executor.
+
+        :returns:
+            The value returned by the executor, usually a future.
+        """
+        return self.executor.submit(self.wrap(fn), *args, **kwargs)
+
+    def map(self, fn, *iterables, **kwargs):
+        """Same as the builtin ``map()``, but calls are run in the executor.
+
+        :returns:
+            The value returned by the executor, usually an iterator.
+        """
+        return self.executor.map(self.wrap(fn), *iterables, **kwargs)
+
+    def shutdown(self, wait=True):
+        """Shuts down the wrapped executor."""
+        return self.executor.shutdown(wait=wait)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.shutdown(wait=True)
+        return False
+
+    def wrap(self, fn):
+        """Returns a function that calls ``fn`` with the current app and
+        request globals, from any thread.
+
+        :param fn:
+            A callable.
+        :returns:
+            The wrapped callable.
+        """
+        app, request = _get_globals()
+        if app is None:
+            return fn
+
+        def run_in_context(*args, **kwargs):
+            return _call_with_globals(app, request, fn, *args, **kwargs)
+
+        return run_in_context
+
+
+class WarmupHandler(RequestHandler):
+    """Warms up the application for all GET requests.
+
+    On App Engine, add this route to handle warmup requests::
+
+        app = WSGIApplication([
+            Route('/_ah/warmup', WarmupHandler),
+        ])
+
+    It calls :meth:`WSGIApplication.warmup` and responds with the time spent
+    by each stage.
+    """
+
+    def get(self):
+        """Performs a warmup."""
+        timings = self.app.warmup()
+        self.response.headers['Content-Type'] = 'text/plain'
+        for stage, seconds in sorted(timings.items()):
+            self.response.write('%s: %.3fs\n' % (stage, seconds))
+
+
 class WSGIApplication(object):
     """A WSGI-compliant application."""
 
@@ -1417,6 +3065,9 @@ class WSGIApplication(object):
     #: A dictionary mapping HTTP error codes to callables to handle those
     #: HTTP exceptions. See :meth:`handle_exception`.
     error_handlers = None
+    #: An :class:`AdmissionControl` instance, if enabled. See
+    #: :meth:`set_admission_control`.
+    admission_control = None
     #: Active :class:`WSGIApplication` instance. See :meth:`set_globals`.
     app = None
     #: Active :class:`Request` instance. See :meth:`set_globals`.
@@ -1442,6 +3093,26 @@ class WSGIApplication(object):
         self.config = self.config_class(config)
         self.router = self.router_class(routes)
 
+    def set_admission_control(self, max_active=None, max_queue=0,
+                              max_queue_time=1.0, route_limits=None,
+                              retry_after=1):
+        """Limits the number of requests handled at once.
+
+        Requests over the global limit or the limit of the matched route
+        wait in a bounded queue, or are rejected with a ``503 Service
+        Unavailable`` that goes through :attr:`error_handlers`. The current
+        load is returned by ``admission_control.snapshot()``.
+
+        The arguments are described in :class:`AdmissionControl`. Call it
+        without arguments to disable limits.
+        """
+        if max_active is None and not route_limits:
+            self.admission_control = None
+        else:
+            self.admission_control = AdmissionControl(
+                max_active, max_queue, max_queue_time, route_limits,
+                retry_after)
+
     def set_globals(self, app=None, request=None):
         """Registers the global variables for app and request.
 
@@ -1491,8 +3162,30 @@ class WSGIApplication(object):
                     # 501 Not Implemented.
                     raise exc.HTTPNotImplemented()
 
-                rv = self.router.dispatch(request, response)
-                if rv is not None:
+                admission = self.admission_control
+                if admission is None:
+                    rv = self.router.dispatch(request, response)
+                else:
+                    admission.enter(response)
+                    streamed = False
+                    try:
+                        rv = self.router.dispatch(request, response)
+                        if isinstance(rv, types.GeneratorType):
+                            # Reads the first chunk while the slot is taken.
+                            response.stream(rv)
+                            rv = None
+
+                        # Streamed bodies keep the slot until they are
+                        # closed by the WSGI server.
+                        streamed = _call_on_close(
+                            response if rv is None else rv, admission.leave)
+                    finally:
+                        if not streamed:
+                            admission.leave()
+
+                if isinstance(rv, types.GeneratorType):
+                    response.stream(rv)
+                elif rv is not None:
                     response = rv
             except Exception, e:
                 try:
@@ -1510,6 +3203,11 @@ class WSGIApplication(object):
             try:
                 return response(environ, start_response)
             except Exception, e:
+                app_iter = getattr(response, 'app_iter', None)
+                if isinstance(app_iter, _StreamIterator):
+                    # Not returned, so the WSGI server won't close it.
+                    app_iter.close()
+
                 return self._internal_error(e)(environ, start_response)
 
     def _internal_error(self, exception):
@@ -1580,6 +3278,68 @@ class WSGIApplication(object):
         else: # pragma: no cover
             handlers.CGIHandler().run(app)
 
+    def warmup(self, registry=True):
+        """Loads everything that is otherwise loaded lazily on first use.
+
+        Call this before serving requests, or add a :class:`WarmupHandler`
+        route. It parses all route templates, imports and adapts all
+        handlers, builds the dispatch tables of :class:`RequestHandler`
+        classes and, optionally, warms up the objects in :attr:`registry`
+        that have a ``warmup()`` method, e.g., preloading templates in
+        :class:`webapp2_extras.jinja2.Jinja2` and
+        :class:`webapp2_extras.mako.Mako` or translations in
+        :class:`webapp2_extras.i18n.I18nStore`.
+
+        :param registry:
+            True to call ``warmup()`` in registered objects.
+        :returns:
+            A dictionary with the time spent by each stage, in seconds. See
+            :meth:`Router.warmup`. Registered objects are reported by
+            registry key.
+        """
+        timings = self.router.warmup()
+        start = time.time()
+        for route in _get_all_routes(self.router):
+            handler = getattr(getattr(route, 'handler_adapter', None),
+                              'handler', None)
+            if inspect.isclass(handler) and issubclass(handler,
+                                                       RequestHandler):
+                _get_dispatch_table(handler, self.allowed_methods)
+
+        timings['handlers'] += time.time() - start
+        if registry:
+            for key, obj in sorted(self.registry.items()):
+                func = getattr(obj, 'warmup', None)
+                if func is not None:
+                    start = time.time()
+                    func()
+                    timings[key] = time.time() - start
+
+        return timings
+
+    def get_route_stats(self, clear=False):
+        """Returns a snapshot of the per-route statistics.
+
+        Statistics are disabled by default. Enable them with
+        ``app.router.set_route_stats(True)``.
+
+        :param clear:
+            True to reset the statistics after the snapshot is taken.
+        :returns:
+            A dictionary with the statistics for each route, as described in
+            :meth:`RouteStats.snapshot`, or an empty dictionary if
+            statistics are disabled.
+        """
+        stats = self.router.route_stats
+        if stats is None:
+            return {}
+
+        snapshot = stats.snapshot()
+        if clear:
+            stats.clear()
+
+        return snapshot
+
     def get_response(self, *args, **kwargs):
         """Creates a request and returns a response for this app.
 
@@ -1813,13 +3573,18 @@ def _urlunsplit(scheme=None, netloc=None, path=None, query=None,
     :returns:
         An assembled absolute or relative URI.
     """
+    if path:
+        path = urllib.quote(_to_utf8(path))
+
+    return _urlunsplit_quoted(scheme, netloc, path, query, fragment)
+
+
+def _urlunsplit_quoted(scheme, netloc, path, query, fragment):
+    """Same as :func:`_urlunsplit`, but the path must be already quoted."""
     if not scheme or not netloc:
         scheme = None
         netloc = None
 
-    if path:
-        path = urllib.quote(_to_utf8(path))
-
     if query and not isinstance(query, basestring):
         if isinstance(query, dict):
             query = query.iteritems()
@@ -1849,6 +3614,53 @@ def _get_handler_methods(handler):
     return methods
 
 
+def _get_dispatch_table(cls, allowed_methods):
+    """Returns the dispatch table of a handler class.
+
+    Tables are built on first use and stored in the class itself, one for
+    each set of allowed methods. Subclasses get their own tables; changing
+    the methods of a class after it was used requires to reset its
+    ``_dispatch_tables`` attribute to None.
+
+    :param cls:
+        A :class:`RequestHandler` class.
+    :param allowed_methods:
+        The HTTP methods allowed by the app, as any iterable.
+    :returns:
+        A tuple ``(methods, allow)``. The first item maps each HTTP method
+        to a tuple ``(method_name, function)``; the function is None if the
+        class doesn't implement the method. Methods implemented by other
+        callables than plain functions are not included. The second item is
+        the value for the ``Allow`` header of a 405 response.
+    """
+    tables = cls._dispatch_tables
+    if tables is None or tables[0] is not cls:
+        # Not set or inherited.
+        tables = cls._dispatch_tables = (cls, {})
+
+    # Apps may set allowed methods as a list. This is a no-op for the
+    # default frozenset.
+    key = frozenset(allowed_methods)
+    table = tables[1].get(key)
+    if table is None:
+        methods = {}
+        allow = []
+        for method in allowed_methods:
+            method_name = _normalize_handler_method(method)
+            value = getattr(cls, method_name, None)
+            if value:
+                allow.append(method)
+
+            if value is None:
+                methods[method] = (method_name, None)
+            elif inspect.ismethod(value) and value.im_self is None:
+                methods[method] = (method_name, value.im_func)
+
+        table = tables[1][key] = (methods, ', '.join(allow))
+
+    return table
+
+
 def _normalize_handler_method(method):
     """Transforms an HTTP method into a valid Python identifier."""
     return method.lower().replace('-', '_')
@@ -1892,6 +3704,17 @@ def _get_route_variables(match, default_kwargs=None):
     """Returns (args, kwargs) for a route match."""
     kwargs = default_kwargs or {}
     kwargs.update(match.groupdict())
+    return _split_route_variables(kwargs)
+
+
+def _split_route_variables(kwargs):
+    """Moves the positional variables of a route match to a tuple.
+
+    :param kwargs:
+        A dictionary with all variables of a route match.
+    :returns:
+        A tuple ``(args, kwargs)``.
+    """
     if kwargs:
         args = tuple(value[1] for value in sorted(
             (int(key[2:-2]), kwargs.pop(key)) for key in kwargs.keys() \
@@ -1902,6 +3725,377 @@ def _get_route_variables(match, default_kwargs=None):
     return args, kwargs
 
 
+def _is_template_route(route):
+    """Checks if a route is matched only by the regex of its template.
+
+    This is true for :class:`Route` instances, but not for subclasses that
+    change how routes are matched or for templates using regex constructs
+    that affect the whole pattern.
+    """
+    cls = route.__class__
+    if (not isinstance(route, Route) or cls.regex is not Route.regex or
+        cls.match.im_func is not Route.match.im_func or
+        cls.match_path.im_func is not Route.match_path.im_func):
+        return False
+
+    return not _route_unmergeable_re.search(route.regex.pattern)
+
+
+def _is_mergeable_route(route):
+    """Checks if a route regex can be merged by :class:`_RouteGroup`."""
+    return (_is_template_route(route) and
+            route.regex.groups < _max_regex_groups)
+
+
+def _get_index_routes(routes):
+    """Returns match routes replaced by the routes they yield in
+    :meth:`BaseRoute.get_index_routes`.
+    """
+    rv = []
+    for route in routes:
+        get_index_routes = getattr(route, 'get_index_routes', None)
+        if get_index_routes is None:
+            rv.append(route)
+        else:
+            rv.extend(get_index_routes())
+
+    return rv
+
+
+def _split_routes_by_method(routes, method):
+    """Splits match routes by an HTTP method.
+
+    :returns:
+        A tuple ``(routes, excluded)``. Excluded routes are :class:`Route`
+        instances that don't allow the method; all others are kept, in the
+        same order.
+    """
+    rv, excluded = [], []
+    for route in routes:
+        if (_is_template_route(route) and route.methods and
+            method not in route.methods):
+            excluded.append(route)
+        else:
+            rv.append(route)
+
+    return rv, excluded
+
+
+def _match_any_path(request, routes):
+    """Checks if a request path and scheme are matched by any of the given
+    routes or route groups, ignoring their methods.
+    """
+    if not routes:
+        return False
+
+    path = _get_match_path(request)
+    scheme = request.scheme
+    for route in routes:
+        if isinstance(route, _RouteGroup):
+            for rv in route.iter_matches(path, scheme):
+                return True
+        elif (route.regex.match(path) and
+              (not route.schemes or scheme in route.schemes)):
+            return True
+
+    return False
+
+
+def _count_tried_routes(route, match):
+    """Returns the number of routes tried when matching a route, for
+    :class:`RouteStats`. Merged routes of a :class:`_RouteGroup` are counted
+    one by one, as in matchers that don't merge them.
+    """
+    if route.__class__ is not _RouteGroup:
+        return 1
+
+    if match:
+        return route.routes.index(match[0]) + 1
+
+    return len(route.routes)
+
+
+def _get_match_path(request):
+    """Returns the unquoted request path, used to match routes.
+
+    :param request:
+        A :class:`Request` or a ``webob.Request`` instance.
+    """
+    try:
+        return request.match_path
+    except AttributeError:
+        return urllib.unquote(request.path)
+
+
+def _check_match_path(route):
+    """Makes :meth:`BaseRoute.match_path` call ``match()`` if the route class
+    overrides ``match()`` but not ``match_path()``, so that subclasses of
+    routes written before ``match_path()`` existed keep working.
+
+    :param route:
+        A route instance.
+    """
+    for cls in route.__class__.__mro__:
+        if 'match_path' in cls.__dict__:
+            return
+
+        if 'match' in cls.__dict__:
+            route.match_path = _match_path_adapter.__get__(route,
+                                                           route.__class__)
+            return
+
+
+def _match_path_adapter(self, request, path, method, scheme, host):
+    """Implements ``match_path()`` calling ``match()``."""
+    return self.match(request)
+
+
+def _get_all_routes(router):
+    """Returns a list of all routes in a router, including nested routes.
+
+    :param router:
+        A :class:`Router` instance.
+    :returns:
+        A list of match routes, then build routes sorted by name, without
+        repetitions.
+    """
+    routes = []
+    seen = set()
+
+    def add(route):
+        if id(route) in seen:
+            return
+
+        seen.add(id(route))
+        routes.append(route)
+        if hasattr(route, 'get_match_children'):
+            for r in route.get_match_children():
+                add(r)
+
+            for n, r in sorted(route.get_build_children()):
+                add(r)
+
+    for route in router.match_routes:
+        add(route)
+
+    for name, route in sorted(router.build_routes.iteritems()):
+        add(route)
+
+    return routes
+
+
+def _get_route_prefix(route):
+    """Returns the literal path prefix of a route, used to index it.
+
+    Routes that can't be indexed have an empty prefix.
+    """
+    if not _is_template_route(route):
+        return ''
+
+    template = route.template
+    match = _route_re.search(template)
+    if match:
+        template = template[:match.start()]
+
+    if isinstance(template, unicode):
+        # Request paths are byte strings.
+        try:
+            template = template.encode('ascii')
+        except UnicodeError:
+            return ''
+
+    return template
+
+
+def _merge_routes(routes):
+    """Merges consecutive mergeable routes into :class:`_RouteGroup` objects.
+
+    :param routes:
+        A list of match routes.
+    :returns:
+        A list of routes and route groups, in the same order.
+    """
+    rv = []
+    group = []
+    groups_count = 0
+    for route in routes:
+        if _is_mergeable_route(route):
+            count = route.regex.groups + 1
+            if groups_count + count > _max_regex_groups:
+                rv.extend(_merge_route_group(group))
+                group, groups_count = [], 0
+
+            group.append(route)
+            groups_count += count
+        else:
+            rv.extend(_merge_route_group(group))
+            group, groups_count = [], 0
+            rv.append(route)
+
+    rv.extend(_merge_route_group(group))
+    return rv
+
+
+def _group_host_routes(routes):
+    """Indexes runs of consecutive host routes by host.
+
+    :param routes:
+        A list of match routes.
+    :returns:
+        A list of routes, with each run of two or more routes that implement
+        ``get_literal_host()`` replaced by a :class:`_HostGroup`.
+    """
+    rv = []
+    group = []
+    for route in routes + [None]:
+        if getattr(route, 'get_literal_host', None) is not None:
+            group.append(route)
+            continue
+
+        if len(group) > 1:
+            rv.append(_HostGroup(group))
+        else:
+            rv.extend(group)
+
+        group = []
+        if route is not None:
+            rv.append(route)
+
+    return rv
+
+
+def _merge_route_group(routes):
+    """Returns a list with a :class:`_RouteGroup` for the given routes, or
+    the routes themselves if there is nothing to be merged.
+    """
+    if len(routes) > 1:
+        return [_RouteGroup(routes)]
+
+    return routes
+
+
+def _get_globals():
+    """Returns the active app and request, or None, for the current thread.
+
+    Unlike :func:`get_app` and :func:`get_request`, these are the objects
+    themselves, not proxies.
+    """
+    if _local is not None: # pragma: no cover
+        return getattr(_local, 'app', None), getattr(_local, 'request', None)
+
+    return WSGIApplication.app, WSGIApplication.request # pragma: no cover
+
+
+class _BodyBuffer(list):
+    """Encoded chunks written to a response body, with their total length.
+
+    :meth:`Response.write` updates the length as it appends chunks. Chunks
+    appended by other means, e.g. ``Response.body_file``, are counted when
+    the length is read.
+    """
+
+    __slots__ = ('length', 'counted')
+
+    def __init__(self):
+        self.length = self.counted = 0
+
+    def get_length(self):
+        """Returns the total length of the chunks."""
+        if self.counted != len(self):
+            self.length += sum(len(chunk) for chunk in self[self.counted:])
+            self.counted = len(self)
+
+        return self.length
+
+
+def _call_with_globals(app, request, func, *args, **kwargs):
+    """Calls a function with the given app and request globals, then restores
+    the previous globals of the current thread.
+    """
+    previous = _get_globals()
+    app.set_globals(app=app, request=request)
+    try:
+        return func(*args, **kwargs)
+    finally:
+        if previous[0] is None:
+            app.clear_globals()
+        else:
+            app.set_globals(app=previous[0], request=previous[1])
+
+
+class _StreamIterator(object):
+    """A response body iterator that reads chunks with the app and request
+    globals active when it was created. See :meth:`Response.stream`.
+    """
+
+    def __init__(self, iterable, charset):
+        self.iterable = iterable
+        self.iterator = iter(iterable)
+        self.charset = charset
+        self.app, self.request = _get_globals()
+        # Functions called once when the iterator is closed.
+        self.callbacks = []
+        # Read the first chunk in the current context.
+        try:
+            self.first = self._encode(self.iterator.next())
+        except StopIteration:
+            self.first = None
+            self.iterator = iter(())
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        if self.first is not None:
+            chunk, self.first = self.first, None
+            return chunk
+
+        if self.app is None:
+            return self._encode(self.iterator.next())
+
+        return self._encode(_call_with_globals(self.app, self.request,
+                                               self.iterator.next))
+
+    def close(self):
+        try:
+            close = getattr(self.iterable, 'close', None)
+            if close is None:
+                pass
+            elif self.app is None:
+                close()
+            else:
+                _call_with_globals(self.app, self.request, close)
+        finally:
+            callbacks, self.callbacks = self.callbacks, []
+            for callback in callbacks:
+                callback()
+
+    def _encode(self, chunk):
+        if isinstance(chunk, unicode):
+            return chunk.encode(self.charset)
+
+        return chunk
+
+
+def _call_on_close(response, func):
+    """Calls a function when the body of a streamed response is closed.
+
+    :param response:
+        A response object.
+    :param func:
+        A function without arguments.
+    :returns:
+        True if the response is streamed. Otherwise the function is not
+        called and False is returned.
+    """
+    app_iter = getattr(response, 'app_iter', None)
+    if isinstance(app_iter, _StreamIterator):
+        app_iter.callbacks.append(func)
+        return True
+
+    return False
+
+
 def _set_thread_safe_app():
     """Assigns WSGIApplication globals to a proxy pointing to thread-local."""
     if _local is not None: # pragma: no cover
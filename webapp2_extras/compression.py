@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+"""
+    webapp2_extras.compression
+    ==========================
+
+    Transparent gzip and deflate compression of responses.
+
+    :copyright: 2011 by tipfy.org.
+    :license: Apache Sotware License, see LICENSE for details.
+"""
+import re
+import zlib
+
+from webob.acceptparse import Accept
+
+#: Encodings supported by :class:`CompressionMiddleware`, in order of
+#: preference, mapped to the ``wbits`` argument of ``zlib.compressobj()``.
+ENCODINGS = (
+    ('gzip', 16 + zlib.MAX_WBITS),
+    ('deflate', zlib.MAX_WBITS),
+)
+
+#: Content types compressed by default. Types starting with ``text/`` and
+#: types with a ``+xml`` or ``+json`` suffix are also compressed.
+DEFAULT_MIME_TYPES = frozenset([
+    'application/atom+xml',
+    'application/javascript',
+    'application/json',
+    'application/rss+xml',
+    'application/x-javascript',
+    'application/xhtml+xml',
+    'application/xml',
+    'image/svg+xml',
+])
+
+#: Matches the suffix added to the ETag of compressed responses.
+_etag_suffix_re = re.compile(r'-(%s)"' % '|'.join(
+    name for name, wbits in ENCODINGS))
+
+
+class CompressionMiddleware(object):
+    """WSGI middleware that compresses responses when the client accepts it.
+
+    Wrap the application to compress its responses::
+
+        app = webapp2.WSGIApplication(routes)
+        app = CompressionMiddleware(app)
+
+    The encoding is negotiated from the ``Accept-Encoding`` request header.
+    Only successful responses with a compressible content type and without
+    a ``Content-Encoding`` are compressed. They all get
+    ``Vary: Accept-Encoding``, so that caches keep one copy per encoding.
+
+    Bodies sent as lists, like those of :class:`webapp2.Response`, are
+    compressed at once and the ``Content-Length`` is updated. Other bodies,
+    like streamed responses, are compressed incrementally: each chunk is
+    flushed as soon as it is produced and ``Content-Length`` is removed.
+    Compressed responses don't have ``Accept-Ranges``, as byte ranges of the
+    compressed body are not supported.
+
+    The ETag of a compressed response gets a suffix with the encoding, as it
+    identifies a different entity. The suffix is removed from
+    ``If-None-Match`` before calling the application, so it still answers
+    ``304 Not Modified`` to clients with a fresh compressed copy.
+    """
+
+    def __init__(self, app, min_size=512, level=6, mime_types=None):
+        """Initializes the middleware.
+
+        :param app:
+            The WSGI application to wrap.
+        :param min_size:
+            Bodies smaller than this, in bytes, are not compressed.
+            Streamed bodies are always compressed, as their size is unknown.
+        :param level:
+            Compression level, from 1 (fastest) to 9 (smallest).
+        :param mime_types:
+            Content types to compress, in addition to ``text/*``, ``+xml``
+            and ``+json`` types. Default is :data:`DEFAULT_MIME_TYPES`.
+        """
+        self.app = app
+        self.min_size = min_size
+        self.level = level
+        if mime_types is None:
+            mime_types = DEFAULT_MIME_TYPES
+
+        self.mime_types = frozenset(mime_types)
+
+    def __call__(self, environ, start_response):
+        state = {}
+
+        def capture_start_response(status, headers, exc_info=None):
+            state['start'] = (status, headers, exc_info)
+            return write
+
+        def write(data):
+            # Responses sent using write() are not compressed: headers
+            # must be sent before the body is known.
+            if 'write' not in state:
+                state['write'] = start_response(*state.pop('start'))
+
+            state['write'](data)
+
+        if_none_match = environ.get('HTTP_IF_NONE_MATCH')
+        if if_none_match:
+            environ['HTTP_IF_NONE_MATCH'] = _etag_suffix_re.sub(
+                '"', if_none_match)
+
+        app_iter = self.app(environ, capture_start_response)
+        if 'start' not in state:
+            # Started by write().
+            return app_iter
+
+        status, headers, exc_info = state.pop('start')
+        if if_none_match and status.startswith('304 '):
+            headers = _get_not_modified_headers(headers, if_none_match)
+        headers, encoding = self._prepare_headers(environ, status, headers)
+        if encoding is None:
+            start_response(status, headers, exc_info)
+            return app_iter
+
+        wbits = dict(ENCODINGS)[encoding]
+        if isinstance(app_iter, (list, tuple)):
+            body = ''.join(app_iter)
+            if len(body) < self.min_size:
+                # Content-Length may be missing, so check the actual size.
+                start_response(status, headers, exc_info)
+                return [body]
+
+            compressor = zlib.compressobj(self.level, zlib.DEFLATED, wbits)
+            data = compressor.compress(body) + compressor.flush()
+            if len(data) >= len(body):
+                # Not worth it.
+                start_response(status, headers, exc_info)
+                return [body]
+
+            headers = _get_encoded_headers(headers, encoding)
+            headers = _set_header(headers, 'Content-Length', str(len(data)))
+            start_response(status, headers, exc_info)
+            return [data]
+
+        headers = _get_encoded_headers(headers, encoding)
+        headers = _set_header(headers, 'Content-Length', None)
+        start_response(status, headers, exc_info)
+        return _CompressIter(app_iter, self.level, wbits)
+
+    def get_encoding(self, environ):
+        """Returns the best encoding accepted by the client, or None if it
+        accepts none of :data:`ENCODINGS`.
+
+        :param environ:
+            The WSGI environment.
+        """
+        value = environ.get('HTTP_ACCEPT_ENCODING')
+        if not value:
+            return None
+
+        accept = Accept('Accept-Encoding', value)
+        return accept.best_match([name for name, wbits in ENCODINGS])
+
+    def is_compressible(self, content_type):
+        """Returns True if responses of a content type can be compressed.
+
+        :param content_type:
+            The ``Content-Type`` header value.
+        """
+        mime_type = content_type.split(';', 1)[0].strip().lower()
+        return (mime_type.startswith('text/') or
+                mime_type in self.mime_types or
+                mime_type.endswith(('+xml', '+json')))
+
+    def _prepare_headers(self, environ, status, headers):
+        """Returns ``(headers, encoding)``, where headers include ``Vary``
+        if needed and encoding is None if the response must not be
+        compressed.
+        """
+        if not status.startswith(('200 ', '203 ')):
+            return headers, None
+
+        values = dict((k.lower(), v) for k, v in headers)
+        if 'content-encoding' in values or 'content-range' in values:
+            return headers, None
+
+        if not self.is_compressible(values.get('content-type', '')):
+            return headers, None
+
+        vary = values.get('vary')
+        if vary is None:
+            headers = list(headers) + [('Vary', 'Accept-Encoding')]
+        elif vary.strip() != '*' and 'accept-encoding' not in [
+            v.strip().lower() for v in vary.split(',')]:
+            headers = _set_header(headers, 'Vary', vary + ', Accept-Encoding')
+
+        if environ.get('REQUEST_METHOD') == 'HEAD':
+            return headers, None
+
+        length = values.get('content-length')
+        if length is not None and length.isdigit() and \
+           int(length) < self.min_size:
+            return headers, None
+
+        return headers, self.get_encoding(environ)
+
+
+class _CompressIter(object):
+    """Compresses a response body incrementally."""
+
+    def __init__(self, app_iter, level, wbits):
+        self.app_iter = app_iter
+        self.level = level
+        self.wbits = wbits
+
+    def __iter__(self):
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, self.wbits)
+        for chunk in self.app_iter:
+            if chunk:
+                # Flush so that streamed chunks reach the client right away.
+                yield compressor.compress(chunk) + \
+                    compressor.flush(zlib.Z_SYNC_FLUSH)
+
+        yield compressor.flush()
+
+    def close(self):
+        if hasattr(self.app_iter, 'close'):
+            self.app_iter.close()
+
+
+def _set_header(headers, name, value):
+    """Returns a copy of a header list replacing a header, or removing it if
+    ``value`` is None.
+    """
+    key = name.lower()
+    headers = [(k, v) for k, v in headers if k.lower() != key]
+    if value is not None:
+        headers.append((name, value))
+
+    return headers
+
+
+def _get_encoded_headers(headers, encoding):
+    """Returns the headers of a response compressed with an encoding."""
+    # Ranges of the compressed body are not supported.
+    headers = _set_header(headers, 'Accept-Ranges', None)
+    headers.append(('Content-Encoding', encoding))
+    for k, v in headers:
+        if k.lower() == 'etag' and v.endswith('"'):
+            # The compressed body is a different entity.
+            return _set_header(headers, 'ETag', '%s-%s"' % (v[:-1], encoding))
+
+    return headers
+
+
+def _get_not_modified_headers(headers, if_none_match):
+    """Returns the headers of a 304 response, with the ETag suffix sent
+    by the client if it validated a compressed copy.
+    """
+    for k, v in headers:
+        if k.lower() == 'etag' and v.endswith('"'):
+            for name, wbits in ENCODINGS:
+                etag = '%s-%s"' % (v[:-1], name)
+                if etag in if_none_match:
+                    return _set_header(headers, 'ETag', etag)
+
+    return headers
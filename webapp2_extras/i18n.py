@@ -12,6 +12,7 @@
 """
 import datetime
 import gettext as gettext_stdlib
+import os
 
 import babel
 from babel import dates
@@ -189,6 +190,25 @@ class I18nStore(object):
 
         return trans
 
+    def warmup(self, locales=None):
+        """Loads translation catalogs, so that they are ready to be used.
+        Called by :meth:`webapp2.WSGIApplication.warmup`.
+
+        :param locales:
+            A list of locale codes to load. If not set, the default locale
+            and all locales found in the translations directory are loaded.
+        """
+        if locales is None:
+            locales = [self.default_locale]
+            dirname = self.translations_path
+            if os.path.isdir(dirname):
+                for locale in sorted(os.listdir(dirname)):
+                    if os.path.isdir(os.path.join(dirname, locale)):
+                        locales.append(locale)
+
+        for locale in locales:
+            self.get_translations(locale)
+
     def load_translations(self, dirname, locales, domains):
         """Loads a translation catalog.
 
@@ -12,6 +12,8 @@
 """
 from __future__ import absolute_import
 
+import logging
+
 import jinja2
 
 import webapp2
@@ -41,6 +43,11 @@ import webapp2
 #:
 #: filters
 #:     Extra filters for the Jinja2 environment.
+#:
+#: warmup_extensions
+#:     Extensions of the template files loaded by :meth:`Jinja2.warmup`,
+#:     without the leading dot. If None, all files are loaded. Default is
+#:     ``html``, ``htm``, ``xml`` and ``txt``.
 default_config = {
     'template_path': 'templates',
     'compiled_path': None,
@@ -54,6 +61,7 @@ default_config = {
     },
     'globals': None,
     'filters': None,
+    'warmup_extensions': ['html', 'htm', 'xml', 'txt'],
 }
 
 
@@ -181,6 +189,38 @@ class Jinja2(object):
         template = self.environment.get_template(filename)
         return getattr(template.module, attribute)
 
+    def warmup(self, templates=None):
+        """Loads and compiles templates, so that they are ready to be
+        rendered. Called by :meth:`webapp2.WSGIApplication.warmup`.
+
+        .. note::
+           Only the last ``cache_size`` templates (50 by default) are kept
+           by the environment. Set ``cache_size`` in ``environment_args``
+           to keep more templates.
+
+        Templates that fail to compile are logged and skipped.
+
+        :param templates:
+            A list of template filenames to load. If not set, all templates
+            with one of the ``warmup_extensions`` set in the configuration
+            are loaded, unless the loader can't list them (e.g., when
+            compiled templates are used).
+        """
+        env = self.environment
+        if templates is None:
+            extensions = self.config['warmup_extensions']
+            try:
+                templates = env.list_templates(extensions=extensions)
+            except TypeError:
+                # The loader can't list templates.
+                return
+
+        for filename in templates:
+            try:
+                env.get_template(filename)
+            except (jinja2.TemplateError, UnicodeError):
+                logging.exception('Template %r failed to compile.', filename)
+
 
 # Factories -------------------------------------------------------------------
 
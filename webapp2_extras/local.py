@@ -21,9 +21,9 @@ except ImportError: # pragma: no cover
         # catch all, py.* fails with so many different errors.
         get_current_greenlet = int
 try:
-    from thread import get_ident as get_current_thread, allocate_lock
+    from thread import get_ident as get_current_thread
 except ImportError: # pragma: no cover
-    from dummy_thread import get_ident as get_current_thread, allocate_lock
+    from dummy_thread import get_ident as get_current_thread
 
 
 # get the best ident function.  if greenlets are not installed we can
@@ -38,56 +38,66 @@ else:
 class Local(object):
     """A container for thread-local objects.
 
-    Attributes are assigned or retrieved using the current thread.
+    Attributes are assigned or retrieved using the current thread, or the
+    current greenlet if greenlets are available.
+
+    Each thread or greenlet only reads and writes its own storage, so no
+    lock is needed: a single dictionary operation is atomic.
+
+    The context identity can be changed, e.g., for servers that run
+    requests in coroutines, passing a function to the constructor or
+    assigning it to ``__ident_func__``::
+
+        local = Local(ident_func=get_current_coroutine_id)
+        local.__ident_func__ = get_current_coroutine_id
     """
 
-    __slots__ = ('__storage__', '__lock__')
+    __slots__ = ('__storage__', '__ident_func__')
 
-    def __init__(self):
+    def __init__(self, ident_func=None):
+        """Initializes the container.
+
+        :param ident_func:
+            A function that returns a hashable identity of the current
+            context. Default is :func:`get_ident`.
+        """
         object.__setattr__(self, '__storage__', {})
-        object.__setattr__(self, '__lock__', allocate_lock())
+        object.__setattr__(self, '__ident_func__', ident_func or get_ident)
 
     def __iter__(self):
-        return self.__storage__.iteritems()
+        # A copy, because other threads may change the storage.
+        return iter(self.__storage__.items())
 
     def __call__(self, proxy):
         """Creates a proxy for a name."""
         return LocalProxy(self, proxy)
 
     def __release_local__(self):
-        self.__storage__.pop(get_ident(), None)
+        self.__storage__.pop(self.__ident_func__(), None)
 
     def __getattr__(self, name):
-        self.__lock__.acquire()
         try:
-            try:
-                return self.__storage__[get_ident()][name]
-            except KeyError:
-                raise AttributeError(name)
-        finally:
-            self.__lock__.release()
+            return self.__storage__[self.__ident_func__()][name]
+        except KeyError:
+            raise AttributeError(name)
 
     def __setattr__(self, name, value):
-        self.__lock__.acquire()
+        if name == '__ident_func__':
+            object.__setattr__(self, name, value)
+            return
+
+        ident = self.__ident_func__()
+        storage = self.__storage__
         try:
-            ident = get_ident()
-            storage = self.__storage__
-            if ident in storage:
-                storage[ident][name] = value
-            else:
-                storage[ident] = {name: value}
-        finally:
-            self.__lock__.release()
+            storage[ident][name] = value
+        except KeyError:
+            storage[ident] = {name: value}
 
     def __delattr__(self, name):
-        self.__lock__.acquire()
         try:
-            try:
-                del self.__storage__[get_ident()][name]
-            except KeyError:
-                raise AttributeError(name)
-        finally:
-            self.__lock__.release()
+            del self.__storage__[self.__ident_func__()][name]
+        except KeyError:
+            raise AttributeError(name)
 
 
 class LocalProxy(object):
@@ -12,6 +12,10 @@
 """
 from __future__ import absolute_import
 
+import logging
+import os
+
+from mako import exceptions
 from mako import lookup
 
 import webapp2
@@ -20,8 +24,14 @@ import webapp2
 #:
 #: template_path
 #:     Directory for templates. Default is `templates`.
+#:
+#: warmup_extensions
+#:     Extensions of the template files loaded by :meth:`Mako.warmup`,
+#:     without the leading dot. If None, all files are loaded. Default is
+#:     ``html``, ``htm``, ``xml`` and ``txt``.
 default_config = {
     'template_path': 'templates',
+    'warmup_extensions': ['html', 'htm', 'xml', 'txt'],
 }
 
 
@@ -87,6 +97,37 @@ class Mako(object):
         template = self.environment.get_template(_filename)
         return template.render_unicode(**context)
 
+    def warmup(self, templates=None):
+        """Loads and compiles templates, so that they are ready to be
+        rendered. Called by :meth:`webapp2.WSGIApplication.warmup`.
+
+        Templates that fail to compile are logged and skipped.
+
+        :param templates:
+            A list of template filenames to load. If not set, all files in
+            the template directories with one of the ``warmup_extensions``
+            set in the configuration are loaded.
+        """
+        if templates is None:
+            extensions = self.config['warmup_extensions']
+            templates = []
+            for directory in self.environment.directories:
+                for dirpath, dirnames, filenames in os.walk(directory):
+                    path = dirpath[len(directory):].lstrip(os.sep)
+                    for filename in filenames:
+                        if filename.startswith('.'):
+                            continue
+
+                        ext = os.path.splitext(filename)[1][1:]
+                        if extensions is None or ext in extensions:
+                            templates.append(os.path.join(path, filename))
+
+        for filename in templates:
+            try:
+                self.environment.get_template(filename.replace(os.sep, '/'))
+            except (exceptions.MakoException, UnicodeError):
+                logging.exception('Template %r failed to compile.', filename)
+
 
 # Factories -------------------------------------------------------------------
 
@@ -0,0 +1,453 @@
+# -*- coding: utf-8 -*-
+"""
+    webapp2_extras.response_cache
+    =============================
+
+    Caches full responses of GET requests.
+
+    :copyright: 2011 by tipfy.org.
+    :license: Apache Sotware License, see LICENSE for details.
+"""
+from __future__ import with_statement
+
+import hashlib
+import marshal
+import threading
+import time
+import urllib
+
+import webapp2
+
+
+class CachePolicy(object):
+    """Describes how the responses of a route or handler are cached."""
+
+    def __init__(self, ttl=60, query_args=(), vary=()):
+        """Initializes the policy.
+
+        :param ttl:
+            Seconds to keep a response in the cache.
+        :param query_args:
+            Names of the query string arguments that change the response.
+            Other arguments are ignored.
+        :param vary:
+            Names of the request headers that change the response, e.g.,
+            ``Accept-Language``.
+        """
+        self.ttl = ttl
+        self.query_args = tuple(sorted(query_args))
+        self.vary = tuple(sorted(name.lower() for name in vary))
+
+
+def cache_response(ttl=60, query_args=(), vary=()):
+    """A decorator to cache the responses of a handler class or function.
+
+    The arguments are described in :class:`CachePolicy`::
+
+        @cache_response(ttl=300, query_args=['page'])
+        class ReportHandler(webapp2.RequestHandler):
+            def get(self):
+                ...
+    """
+    policy = CachePolicy(ttl, query_args, vary)
+
+    def decorator(handler):
+        handler.cache_policy = policy
+        return handler
+
+    return decorator
+
+
+class ResponseCache(object):
+    """Caches the responses of selected routes and handlers.
+
+    Enable the cache in the application router, then set a
+    :class:`CachePolicy` in the ``_cache`` default of a route, or decorate
+    the handler with :func:`cache_response`. The cache removes ``_cache``
+    from the route arguments, so routes that declare it must only be used
+    when the cache is installed::
+
+        app = webapp2.WSGIApplication([
+            webapp2.Route('/news', NewsHandler, 'news',
+                          defaults={'_cache': CachePolicy(ttl=60)}),
+        ])
+        cache = ResponseCache(MemoryBackend())
+        cache.install(app.router)
+
+    Only GET and HEAD requests are served from the cache, and only ``200``
+    responses to GET requests are stored. Responses that set cookies, are
+    marked as private or ``no-store``, are streamed or vary on headers not
+    declared in the policy are not stored.
+
+    Cached responses are checked after a route matches and before its
+    handler is created, so a hit doesn't run any handler code.
+
+    With ``coalesce_timeout`` set, concurrent GET requests that miss the
+    cache with the same key wait for the first one to finish and share its
+    response, instead of all running the handler. If the first request
+    takes too long, fails or its response can't be stored, the others run
+    the handler themselves.
+    """
+
+    #: Prefix of the cache keys.
+    key_prefix = 'webapp2.response_cache:'
+
+    def __init__(self, backend, coalesce_timeout=None):
+        """Initializes the cache.
+
+        :param backend:
+            A cache backend, e.g., :class:`MemoryBackend` or
+            :class:`MemcacheBackend`.
+        :param coalesce_timeout:
+            Maximum seconds to wait for an identical request in progress,
+            or None to disable coalescing.
+        """
+        self.backend = backend
+        self.coalesce_timeout = coalesce_timeout
+        # Requests in progress, as {key: _Flight}.
+        self.flights = {}
+        self.lock = threading.Lock()
+
+    def install(self, router):
+        """Enables the cache in a router, wrapping its handler adapter.
+
+        :param router:
+            A :class:`webapp2.Router` instance.
+        """
+        adapt = router.adapt
+
+        def adapter(router, handler):
+            policy = getattr(handler, 'cache_policy', None)
+            return _CachedHandlerAdapter(self, adapt(handler), policy)
+
+        router.set_adapter(adapter)
+        # Handlers already adapted are adapted again when used.
+        for route in webapp2._get_all_routes(router):
+            if getattr(route, 'handler_adapter', None) is not None:
+                route.handler_adapter = None
+
+    def get_key(self, request, policy):
+        """Returns the cache key for a request.
+
+        The key is derived from the host, the route name (or template), the
+        string values of the route arguments, and the query string arguments
+        and request headers declared in the policy. Route defaults that are
+        not strings are the same for all requests to a route, so they are
+        ignored.
+
+        :param request:
+            A :class:`webapp2.Request` instance with a matched route.
+        :param policy:
+            A :class:`CachePolicy` instance.
+        :returns:
+            A string.
+        """
+        route = request.route
+        parts = [_quote(request.host_url),
+                 _quote(route.name or route.template)]
+        for value in request.route_args:
+            if isinstance(value, basestring):
+                parts.append(_quote(value))
+
+        for name, value in sorted(request.route_kwargs.iteritems()):
+            if isinstance(value, basestring):
+                parts.append('%s=%s' % (_quote(name), _quote(value)))
+
+        for name in policy.query_args:
+            for value in request.GET.getall(name):
+                parts.append('?%s=%s' % (_quote(name), _quote(value)))
+
+        for name in policy.vary:
+            value = request.headers.get(name)
+            if value is not None:
+                parts.append(':%s=%s' % (name, _quote(value)))
+
+        return self.key_prefix + hashlib.md5(' '.join(parts)).hexdigest()
+
+    def dispatch(self, request, response, policy, adapter):
+        """Serves a response from the cache or dispatches the handler and
+        stores its response.
+
+        :param request:
+            A :class:`webapp2.Request` instance.
+        :param response:
+            A :class:`webapp2.Response` instance.
+        :param policy:
+            A :class:`CachePolicy` instance.
+        :param adapter:
+            The adapted handler.
+        :returns:
+            The value returned by the handler.
+        """
+        key = self.get_key(request, policy)
+        value = self.backend.get(key)
+        if value is None and request.method == 'GET' and \
+           self.coalesce_timeout is not None:
+            with self.lock:
+                flight = self.flights.get(key)
+                if flight is None:
+                    flight = self.flights[key] = _Flight()
+                    leader = True
+                else:
+                    leader = False
+
+            if leader:
+                try:
+                    return self._dispatch(request, response, policy, adapter,
+                                          key, flight)
+                finally:
+                    with self.lock:
+                        del self.flights[key]
+
+                    flight.event.set()
+
+            flight.event.wait(self.coalesce_timeout)
+            value = flight.value
+
+        if value is not None:
+            status, headerlist, body = marshal.loads(value)
+            response.status = status
+            response.headerlist = headerlist
+            response.body = body
+            # Validators of the cached response are checked by WebOb.
+            response.conditional_response = True
+            return None
+
+        return self._dispatch(request, response, policy, adapter, key)
+
+    def _dispatch(self, request, response, policy, adapter, key,
+                  flight=None):
+        """Dispatches the handler and stores its response, also in the
+        given :class:`_Flight`.
+        """
+        rv = adapter(request, response)
+        if request.method == 'GET':
+            if rv is None:
+                rsp = response
+            else:
+                rsp = rv
+
+            if self._is_cacheable(rsp, policy):
+                value = marshal.dumps((rsp.status, list(rsp.headerlist),
+                                       rsp.body))
+                self.backend.set(key, value, policy.ttl)
+                if flight is not None:
+                    flight.value = value
+
+        return rv
+
+    def _is_cacheable(self, response, policy):
+        """Returns True if a response can be stored in the cache."""
+        if not isinstance(response, webapp2.Response) or \
+           response.status_int != 200 or \
+           not isinstance(response.app_iter, list) or \
+           'Set-Cookie' in response.headers:
+            return False
+
+        cache_control = response.headers.get('Cache-Control', '').lower()
+        if 'private' in cache_control or 'no-store' in cache_control:
+            return False
+
+        vary = response.headers.get('Vary')
+        if vary:
+            for name in vary.split(','):
+                if name.strip().lower() not in policy.vary:
+                    return False
+
+        return True
+
+
+class _CachedHandlerAdapter(object):
+    """Wraps an adapted handler to serve its responses from a cache."""
+
+    def __init__(self, cache, adapter, policy):
+        self.cache = cache
+        self.adapter = adapter
+        self.policy = policy
+        # Used by WSGIApplication.warmup().
+        self.handler = getattr(adapter, 'handler', None)
+
+    def __call__(self, request, response):
+        # The policy is not a handler argument.
+        policy = request.route_kwargs.pop('_cache', None) or self.policy
+        if policy is None or request.method not in ('GET', 'HEAD'):
+            return self.adapter(request, response)
+
+        return self.cache.dispatch(request, response, policy, self.adapter)
+
+
+def _quote(value):
+    """Quotes a string for a cache key."""
+    return urllib.quote(webapp2._to_utf8(value), '')
+
+
+class _Flight(object):
+    """A handler execution shared by identical concurrent requests."""
+
+    def __init__(self):
+        self.event = threading.Event()
+        # The stored response, or None if it can't be shared.
+        self.value = None
+
+
+class MemoryBackend(object):
+    """An in-process cache backend.
+
+    When the cache is full, the least recently used entries are discarded.
+    Expired entries are discarded when they are read or to make room.
+    """
+
+    #: Total size of the stored values, in bytes.
+    size = 0
+
+    def __init__(self, max_entries=1000, max_size=32 * 1024 * 1024):
+        """Initializes the backend.
+
+        :param max_entries:
+            Maximum number of stored values.
+        :param max_size:
+            Maximum total size of the stored values, in bytes.
+        """
+        self.max_entries = max_entries
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        """Removes all values."""
+        with self.lock:
+            # A circular doubly linked list of [prev, next, key, value,
+            # expiration time] entries, from least to most recently used.
+            self.root = root = []
+            root[:] = [root, root, None, None, None]
+            self.entries = {}
+            self.size = 0
+
+    def get(self, key):
+        """Returns a value, or None if it is not stored or expired.
+
+        :param key:
+            The cache key.
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+
+            self._unlink(entry)
+            if entry[4] <= time.time():
+                self._remove(entry)
+                return None
+
+            self._append(entry)
+            return entry[3]
+
+    def set(self, key, value, ttl):
+        """Stores a value.
+
+        :param key:
+            The cache key.
+        :param value:
+            A string.
+        :param ttl:
+            Seconds to keep the value.
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self._unlink(entry)
+                self._remove(entry)
+
+            if len(value) > self.max_size:
+                return
+
+            root = self.root
+            while self.entries and (len(self.entries) >= self.max_entries or
+                                    self.size + len(value) > self.max_size):
+                # Discard the least recently used entry.
+                first = root[1]
+                self._unlink(first)
+                self._remove(first)
+
+            entry = [None, None, key, value, time.time() + ttl]
+            self._append(entry)
+            self.entries[key] = entry
+            self.size += len(value)
+
+    def delete(self, key):
+        """Removes a value.
+
+        :param key:
+            The cache key.
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self._unlink(entry)
+                self._remove(entry)
+
+    def _unlink(self, entry):
+        prev, next = entry[0], entry[1]
+        prev[1], next[0] = next, prev
+
+    def _append(self, entry):
+        root = self.root
+        last = root[0]
+        last[1] = root[0] = entry
+        entry[0], entry[1] = last, root
+
+    def _remove(self, entry):
+        del self.entries[entry[2]]
+        self.size -= len(entry[3])
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class MemcacheBackend(object):
+    """A cache backend using memcache.
+
+    It accepts any client with the ``python-memcached`` API, like
+    ``memcache.Client`` or the App Engine ``memcache`` module.
+    """
+
+    def __init__(self, client, max_size=1000000):
+        """Initializes the backend.
+
+        :param client:
+            A memcache client.
+        :param max_size:
+            Maximum size of a value, in bytes. Larger values are not stored.
+            The default is the item size limit of memcached.
+        """
+        self.client = client
+        self.max_size = max_size
+
+    def get(self, key):
+        """Returns a value, or None if it is not stored or expired.
+
+        :param key:
+            The cache key.
+        """
+        return self.client.get(key)
+
+    def set(self, key, value, ttl):
+        """Stores a value.
+
+        :param key:
+            The cache key.
+        :param value:
+            A string.
+        :param ttl:
+            Seconds to keep the value.
+        """
+        if len(value) <= self.max_size:
+            self.client.set(key, value, time=ttl)
+
+    def delete(self, key):
+        """Removes a value.
+
+        :param key:
+            The cache key.
+        """
+        self.client.delete(key)
@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+"""
+    webapp2_extras.route_snapshot
+    =============================
+
+    Precompiled route tables to speed up cold starts.
+
+    Route templates are parsed and their regular expressions compiled the
+    first time each route is used. A snapshot stores the parsed templates
+    and the compiled regular expressions of all routes of an application,
+    so a new instance can load them at once instead.
+
+    :copyright: 2011 by tipfy.org.
+    :license: Apache Sotware License, see LICENSE for details.
+"""
+import hashlib
+import logging
+import marshal
+import sre_compile
+import sre_parse
+import sys
+
+import _sre
+
+import webapp2
+
+#: Version of the snapshot format.
+SNAPSHOT_VERSION = 1
+
+#: Attributes set by the lazy template parser of a route.
+_parsed_attributes = ('reverse_template', 'args_count', 'kwargs_count',
+                      'variables')
+
+
+def create(app):
+    """Returns a snapshot of the parsed routes of an application.
+
+    All routes are parsed, so this is also a way to check that all route
+    templates are valid.
+
+    :param app:
+        A :class:`webapp2.WSGIApplication` instance.
+    :returns:
+        The snapshot, as a string.
+    """
+    routes = _get_routes(app.router)
+    regexes = _RegexTable()
+    entries = []
+    for route in routes:
+        entry = {'regex': regexes.add(route.regex)}
+        for attr in _parsed_attributes:
+            if attr not in route.__dict__:
+                continue
+
+            value = route.__dict__[attr]
+            if attr == 'variables':
+                value = dict((k, regexes.add(v)) for k, v in
+                             value.iteritems())
+
+            entry[attr] = value
+
+        entries.append(entry)
+
+    return marshal.dumps({
+        'version': _get_version(),
+        'hash': _get_hash(routes),
+        'regexes': regexes.items,
+        'routes': entries,
+    })
+
+
+def apply(app, snapshot):
+    """Sets the parsed routes of an application from a snapshot.
+
+    Nothing is changed if the snapshot was created by a different version of
+    webapp2 or Python, or if the route definitions changed: routes are then
+    parsed lazily as usual.
+
+    :param app:
+        A :class:`webapp2.WSGIApplication` instance.
+    :param snapshot:
+        A snapshot returned by :func:`create`.
+    :returns:
+        True if the snapshot was applied, False otherwise.
+    """
+    try:
+        data = marshal.loads(snapshot)
+        if data['version'] != _get_version():
+            logging.info('Route snapshot ignored: version changed.')
+            return False
+
+        routes = _get_routes(app.router)
+        if data['hash'] != _get_hash(routes):
+            logging.info('Route snapshot ignored: routes changed.')
+            return False
+
+        regexes = [_load_regex(item) for item in data['regexes']]
+        values = []
+        for route, entry in zip(routes, data['routes']):
+            attrs = {'regex': regexes[entry['regex']]}
+            for attr in _parsed_attributes:
+                if attr in entry:
+                    attrs[attr] = entry[attr]
+
+            if 'variables' in attrs:
+                attrs['variables'] = dict((k, regexes[v]) for k, v in
+                                          attrs['variables'].iteritems())
+
+            values.append(attrs)
+    except (EOFError, ValueError, TypeError, KeyError, IndexError,
+            RuntimeError), e:
+        logging.warning('Route snapshot ignored: %s', e)
+        return False
+
+    for route, attrs in zip(routes, values):
+        route.__dict__.update(attrs)
+
+    return True
+
+
+def save(app, filename):
+    """Creates a snapshot of the parsed routes of an application and saves it
+    to a file.
+
+    :param app:
+        A :class:`webapp2.WSGIApplication` instance.
+    :param filename:
+        Path of the snapshot file.
+    """
+    snapshot = create(app)
+    f = open(filename, 'wb')
+    try:
+        f.write(snapshot)
+    finally:
+        f.close()
+
+
+def load(app, filename):
+    """Loads a snapshot file saved by :func:`save` and applies it to an
+    application.
+
+    :param app:
+        A :class:`webapp2.WSGIApplication` instance.
+    :param filename:
+        Path of the snapshot file.
+    :returns:
+        True if the snapshot was applied, False if the file doesn't exist
+        or the snapshot is outdated.
+    """
+    try:
+        f = open(filename, 'rb')
+    except IOError:
+        return False
+
+    try:
+        snapshot = f.read()
+    finally:
+        f.close()
+
+    return apply(app, snapshot)
+
+
+class _RegexTable(object):
+    """A list of serialized regexes, without repetitions."""
+
+    def __init__(self):
+        self.items = []
+        self.indexes = {}
+
+    def add(self, regex):
+        """Adds a compiled regex and returns its index in the table."""
+        key = (regex.pattern, regex.flags)
+        index = self.indexes.get(key)
+        if index is None:
+            index = self.indexes[key] = len(self.items)
+            self.items.append(_dump_regex(regex))
+
+        return index
+
+
+def _dump_regex(regex):
+    """Returns the arguments to build a compiled regex with ``_sre``.
+
+    This replicates ``sre_compile.compile()``, so that loading a snapshot
+    skips parsing and compiling the pattern.
+    """
+    # Use the flags passed to re.compile(): inline flags are parsed again.
+    flags = regex.flags
+    p = sre_parse.parse(regex.pattern, flags)
+    code = sre_compile._code(p, flags)
+    indexgroup = [None] * p.pattern.groups
+    for k, i in p.pattern.groupdict.iteritems():
+        indexgroup[i] = k
+
+    return (regex.pattern, flags | p.pattern.flags, code,
+            p.pattern.groups - 1, p.pattern.groupdict, indexgroup)
+
+
+def _load_regex(data):
+    """Returns a compiled regex from the result of :func:`_dump_regex`."""
+    return _sre.compile(*data)
+
+
+def _get_routes(router):
+    """Returns a list of all routes with a template parser in a router.
+
+    Nested routes are included, in a stable order.
+    """
+    return [r for r in webapp2._get_all_routes(router) if
+            isinstance(getattr(r.__class__, 'regex', None),
+                       webapp2.cached_property)]
+
+
+def _get_hash(routes):
+    """Returns a hash of the route definitions."""
+    signature = []
+    for route in routes:
+        signature.append((
+            '%s.%s' % (route.__class__.__module__, route.__class__.__name__),
+            getattr(route, 'template', None),
+            getattr(route, 'prefix', None),
+            _get_handler_path(getattr(route, 'handler', None)),
+            getattr(route, 'handler_method', None),
+            getattr(route, 'name', None),
+        ))
+
+    return hashlib.sha1(repr(signature)).hexdigest()
+
+
+def _get_handler_path(handler):
+    """Returns the dotted path of a route handler."""
+    if handler is None or isinstance(handler, basestring):
+        return handler
+
+    return '%s.%s' % (getattr(handler, '__module__', None),
+                      getattr(handler, '__name__', None))
+
+
+def _get_version():
+    """Returns the webapp2, Python and regex engine versions."""
+    return (SNAPSHOT_VERSION, webapp2.__version__, sys.version, _sre.MAGIC,
+            _sre.CODESIZE, sys.maxunicode)
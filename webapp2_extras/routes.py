@@ -9,7 +9,6 @@
     :license: Apache Sotware License, see LICENSE for details.
 """
 import re
-import urllib
 
 from webob import exc
 
@@ -26,6 +25,7 @@ class MultiRoute(object):
 
     def __init__(self, routes):
         self.routes = routes
+        webapp2._check_match_path(self)
 
     def get_children(self):
         if self.children is None:
@@ -57,6 +57,9 @@ class MultiRoute(object):
         for rv in self.build_children.iteritems():
             yield rv
 
+    def get_index_routes(self):
+        yield self
+
     get_routes = get_children
     get_match_routes = get_match_children
     get_build_routes = get_build_children
@@ -97,14 +100,20 @@ class DomainRoute(MultiRoute):
         yield self
 
     def match(self, request):
+        return DomainRoute.match_path(self, request,
+                                      webapp2._get_match_path(request),
+                                      request.method, request.scheme,
+                                      request.environ['SERVER_NAME'])
+
+    def match_path(self, request, path, method, scheme, host):
         # Use SERVER_NAME to ignore port number that comes with request.host?
         # host_match = self.regex.match(request.host.split(':', 1)[0])
-        host_match = self.regex.match(request.environ['SERVER_NAME'])
+        host_match = self.regex.match(host)
 
         if host_match:
             args, kwargs = webapp2._get_route_variables(host_match)
             return _match_routes(self.get_match_children, request, None,
-                                 kwargs)
+                                 kwargs, (path, method, scheme, host))
 
     @webapp2.cached_property
     def regex(self):
@@ -113,6 +122,19 @@ class DomainRoute(MultiRoute):
                                           default_sufix='[^\.]+')
         return regex
 
+    def get_literal_host(self):
+        """Returns the host matched by this route if the template has no
+        variables, or None. Used by the router to index routes by host.
+        """
+        cls = self.__class__
+        if (cls.match.im_func is not DomainRoute.match.im_func or
+            cls.match_path.im_func is not DomainRoute.match_path.im_func or
+            cls.regex is not DomainRoute.regex or
+            webapp2._route_re.search(self.template)):
+            return None
+
+        return self.template
+
 
 class NamePrefixRoute(MultiRoute):
     """The idea of this route is to set a base name for other routes::
@@ -203,10 +225,32 @@ class PathPrefixRoute(NamePrefixRoute):
         yield self
 
     def match(self, request):
-        if not self.regex.match(urllib.unquote(request.path)):
+        return PathPrefixRoute.match_path(self, request,
+                                          webapp2._get_match_path(request),
+                                          request.method, request.scheme,
+                                          request.environ.get('SERVER_NAME'))
+
+    def match_path(self, request, path, method, scheme, host):
+        if not self.regex.match(path):
             return None
 
-        return _match_routes(self.get_match_children, request)
+        return _match_routes(self.get_match_children, request, None, None,
+                             (path, method, scheme, host))
+
+    def get_index_routes(self):
+        # Nested routes can replace this one if their templates start with
+        # the prefix and a slash: a path matched by them is always matched
+        # by the prefix regex too.
+        routes = list(self.get_match_children())
+        prefix = self.prefix + '/'
+        for route in routes:
+            if not (isinstance(route, webapp2.Route) and
+                    route.template.startswith(prefix)):
+                yield self
+                return
+
+        for route in routes:
+            yield route
 
     @webapp2.cached_property
     def regex(self):
@@ -261,6 +305,9 @@ class RedirectRoute(webapp2.Route):
             - Access to ``/bar/`` will execute ``BarHandler`` normally.
             - Access to ``/foo/`` will redirect to ``/foo``.
             - Access to ``/bar`` will redirect to ``/bar/``.
+
+            Both URLs are matched by a single regex, and the redirect is
+            decided only when it matches.
         """
         super(RedirectRoute, self).__init__(
             template, handler=handler, name=name, defaults=defaults,
@@ -296,8 +343,8 @@ class RedirectRoute(webapp2.Route):
                 else:
                     template = self.template + '/'
 
-                yield main_route
-                yield self._get_redirect_route(template=template)
+                yield _StrictSlashRoute(main_route,
+                    self._get_redirect_route(template=template))
             else:
                 yield main_route
 
@@ -321,12 +368,85 @@ class RedirectRoute(webapp2.Route):
         return handler.uri_for(kwargs.pop('_name'), *args, **kwargs)
 
 
-def _match_routes(iter_func, request, extra_args=None, extra_kwargs=None):
-    """Tries to match a route given an iterator."""
+class _StrictSlashRoute(object):
+    """Matches a route and its redirect route for the same URL with a
+    different trailing slash, using a single regex for both.
+    """
+
+    def __init__(self, route, redirect_route):
+        """Initializes the route pair.
+
+        :param route:
+            The route to be matched.
+        :param redirect_route:
+            The route that redirects to it.
+        """
+        self.route = route
+        self.redirect_route = redirect_route
+        self.template = route.template
+
+    @webapp2.cached_property
+    def regex(self):
+        # The template without the trailing slash, followed by an optional
+        # slash.
+        if self.route.template.endswith('/'):
+            regex = self.redirect_route.regex
+        else:
+            regex = self.route.regex
+
+        return re.compile(regex.pattern[:-1] + '/?$', regex.flags)
+
+    def get_match_children(self):
+        yield self.route
+        yield self.redirect_route
+
+    def get_build_children(self):
+        return iter(())
+
+    def get_index_routes(self):
+        # Indexed matchers merge or index both routes by themselves.
+        yield self.route
+        yield self.redirect_route
+
+    def match(self, request):
+        return self.match_path(request, webapp2._get_match_path(request),
+                               request.method, request.scheme,
+                               request.environ.get('SERVER_NAME'))
+
+    def match_path(self, request, path, method, scheme, host):
+        if not self.regex.match(path):
+            return None
+
+        # The redirect route is only tried if the route doesn't match, as if
+        # it came right after it.
+        return _match_routes(self.get_match_children, request, None, None,
+                             (path, method, scheme, host))
+
+    def __repr__(self):
+        return '<%s(%r, %r)>' % (self.__class__.__name__, self.route,
+                                 self.redirect_route)
+
+
+def _match_routes(iter_func, request, extra_args=None, extra_kwargs=None,
+                  values=None):
+    """Tries to match a route given an iterator.
+
+    ``values`` is a tuple ``(path, method, scheme, host)`` passed to
+    ``match_path()``; if not set, it is extracted from the request.
+    """
+    if values is None:
+        values = (webapp2._get_match_path(request), request.method,
+                  request.scheme, request.environ.get('SERVER_NAME'))
+
     method_not_allowed = False
     for route in iter_func():
         try:
-            match = route.match(request)
+            match_path = getattr(route, 'match_path', None)
+            if match_path is None:
+                match = route.match(request)
+            else:
+                match = match_path(request, *values)
+
             if match:
                 route, args, kwargs = match
                 if extra_args:
@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+"""
+    webapp2_extras.static
+    =====================
+
+    A handler to serve static files.
+
+    Files are sent in blocks or, if the WSGI server provides it, through
+    ``wsgi.file_wrapper``, so they are never loaded in memory. Range
+    requests and conditional requests using ``ETag`` and ``Last-Modified``
+    are supported.
+
+    :copyright: 2011 by tipfy.org.
+    :license: Apache Sotware License, see LICENSE for details.
+"""
+import mimetypes
+import os
+import stat
+import time
+
+import webapp2
+
+#: Cached file stats, mapping absolute paths to tuples
+#: ``(expiration time, stat result)``. The stat result is None for missing
+#: files.
+_stat_cache = {}
+
+#: Maximum number of entries in :data:`_stat_cache`.
+_max_stat_cache_size = 10000
+
+
+class StaticFileHandler(webapp2.RequestHandler):
+    """Serves files from a directory.
+
+    The route must have a ``path`` variable and set the directory in the
+    ``_root`` default::
+
+        app = webapp2.WSGIApplication([
+            webapp2.Route('/static/<path:.+>', StaticFileHandler,
+                          defaults={'_root': '/path/to/static'}),
+        ])
+
+    Optionally, the ``_max_age`` default sets the number of seconds that
+    clients can cache the files without checking if they changed.
+
+    If a file has a gzipped copy next to it, with the same name plus
+    ``.gz``, the copy is sent as is to clients that accept gzip.
+    """
+
+    #: Size of the blocks read from files.
+    block_size = 64 * 1024
+    #: Seconds to keep the stats of a file, or that it is missing, before
+    #: checking it again.
+    stat_cache_ttl = 1
+    #: Whether to send gzipped copies of files, when they exist.
+    gzip_siblings = True
+
+    def get(self, **kwargs):
+        """Sends a file.
+
+        :param kwargs:
+            Route variables: ``path`` is the file path, relative to the
+            ``_root`` directory. ``_max_age`` is optional.
+        """
+        root = os.path.abspath(kwargs['_root'])
+        filename = os.path.abspath(os.path.join(root, kwargs['path']))
+        if not filename.startswith(root + os.sep):
+            # Paths outside of the root directory.
+            self.abort(404)
+
+        st = _get_stat(filename, self.stat_cache_ttl)
+        if st is None:
+            self.abort(404)
+
+        rsp = self.response
+        content_type = mimetypes.guess_type(filename)[0]
+        if self.gzip_siblings:
+            gz_st = _get_stat(filename + '.gz', self.stat_cache_ttl)
+            if gz_st is not None:
+                rsp.headers['Vary'] = 'Accept-Encoding'
+                if 'gzip' in self.request.accept_encoding:
+                    filename += '.gz'
+                    st = gz_st
+                    rsp.headers['Content-Encoding'] = 'gzip'
+
+        try:
+            f = open(filename, 'rb')
+        except IOError:
+            self.abort(404)
+
+        rsp.headers['Content-Type'] = content_type or \
+            'application/octet-stream'
+        rsp.last_modified = int(st.st_mtime)
+        rsp.etag = '%x-%x' % (int(st.st_mtime), st.st_size)
+        rsp.headers['Accept-Ranges'] = 'bytes'
+        max_age = kwargs.get('_max_age')
+        if max_age is None:
+            # Clients must revalidate.
+            rsp.headers['Cache-Control'] = 'no-cache'
+        else:
+            rsp.headers['Cache-Control'] = 'public, max-age=%d' % max_age
+            rsp.expires = time.time() + max_age
+
+        # Conditional and range requests are handled by WebOb when the
+        # response is sent.
+        rsp.conditional_response = True
+        file_wrapper = self.request.environ.get('wsgi.file_wrapper')
+        if file_wrapper is not None and not self.request.range:
+            # The server can send the file using the system sendfile().
+            rsp.app_iter = file_wrapper(f, self.block_size)
+        else:
+            rsp.app_iter = FileIter(f, self.block_size)
+
+        rsp.content_length = st.st_size
+
+    head = get
+
+
+class FileIter(object):
+    """Iterates over a file in blocks, optionally within a byte range.
+
+    Used as a response body, it lets WebOb serve range requests seeking the
+    file instead of reading it from the start.
+    """
+
+    def __init__(self, f, block_size=64 * 1024, start=0, stop=None):
+        """Initializes the iterator.
+
+        :param f:
+            A file object opened in binary mode.
+        :param block_size:
+            Maximum size of the blocks.
+        :param start:
+            Position of the first byte to be read.
+        :param stop:
+            Position after the last byte to be read, or None to read until
+            the end of the file.
+        """
+        self.file = f
+        self.block_size = block_size
+        self.start = start
+        self.stop = stop
+
+    def __iter__(self):
+        f = self.file
+        f.seek(self.start)
+        if self.stop is None:
+            remaining = None
+        else:
+            remaining = self.stop - self.start
+
+        while remaining is None or remaining > 0:
+            size = self.block_size
+            if remaining is not None:
+                size = min(size, remaining)
+                remaining -= size
+
+            chunk = f.read(size)
+            if not chunk:
+                break
+
+            yield chunk
+
+    def app_iter_range(self, start, stop):
+        """Returns an iterator for a byte range of the file.
+
+        :param start:
+            Position of the first byte.
+        :param stop:
+            Position after the last byte, or None.
+        """
+        return FileIter(self.file, self.block_size, start, stop)
+
+    def close(self):
+        """Closes the file."""
+        self.file.close()
+
+
+def _get_stat(filename, ttl):
+    """Returns the stats of a regular file, or None if it doesn't exist.
+
+    Results are cached for ``ttl`` seconds, also when the file doesn't
+    exist, e.g., a missing ``.gz`` copy.
+    """
+    now = time.time()
+    entry = _stat_cache.get(filename)
+    if entry is not None and entry[0] > now:
+        return entry[1]
+
+    try:
+        st = os.stat(filename)
+    except OSError:
+        st = None
+
+    if st is not None and not stat.S_ISREG(st.st_mode):
+        st = None
+
+    if len(_stat_cache) >= _max_stat_cache_size and filename not in \
+       _stat_cache:
+        # Requests for many missing files must not fill the memory.
+        for key, value in _stat_cache.items():
+            if value[0] <= now:
+                # Another thread may have removed it already.
+                _stat_cache.pop(key, None)
+
+        if len(_stat_cache) >= _max_stat_cache_size:
+            _stat_cache.clear()
+
+    _stat_cache[filename] = (now + ttl, st)
+    return st